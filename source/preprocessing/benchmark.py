@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+from datasets import Dataset, load_dataset, load_from_disk
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.preprocessing import normalize
+from run_report import RunReport
+
+
+LENGTH_DISTRIBUTIONS = ("lognormal", "uniform", "fixed")
+
+
+def generate_corpus(n_documents: int, mean_words: int = 300, length_distribution: str = "lognormal", n_topics: int = 20, seed: int = 0) -> Dataset:
+    """
+    Generates a synthetic corpus with the columns of a Wikipedia dataset. Each
+    document belongs to one of n_topics topics and mixes words of its topic
+    with common words, both drawn from a Zipf distribution, so the topic model
+    finds clusters and the keyword extraction finds typical words.
+    The paragraphs of a document have about 60 words.
+    @param int n_documents: number of documents
+    @param int mean_words: mean number of words per document
+    @param str length_distribution: distribution of the document lengths, one of
+        LENGTH_DISTRIBUTIONS
+    @param int n_topics: number of topics
+    @param int seed: the same seed always generates the same corpus
+    @return Dataset
+    """
+    rng = np.random.default_rng(seed)
+    if length_distribution == "lognormal":
+        # sigma 1 gives a long tail of long documents like in Wikipedia
+        lengths = rng.lognormal(np.log(mean_words) - 0.5, 1.0, n_documents)
+    elif length_distribution == "uniform":
+        lengths = rng.uniform(0, 2 * mean_words, n_documents)
+    else:
+        lengths = np.full(n_documents, mean_words)
+    lengths = np.maximum(lengths.astype(np.int64), 5)
+
+    common_words = np.array([f"common{i}" for i in range(2000)], dtype=object)
+    topic_words = np.array([[f"topic{t}word{i}" for i in range(200)] for t in range(n_topics)], dtype=object)
+    common_p = 1 / np.arange(1, len(common_words) + 1)
+    common_p /= common_p.sum()
+    topic_p = 1 / np.arange(1, topic_words.shape[1] + 1)
+    topic_p /= topic_p.sum()
+
+    topics = rng.integers(n_topics, size=n_documents)
+    texts = []
+    for topic, length in zip(topics.tolist(), lengths.tolist()):
+        from_topic = rng.random(length) < 0.3
+        words = rng.choice(common_words, size=length, p=common_p)
+        words[from_topic] = rng.choice(topic_words[topic], size=int(from_topic.sum()), p=topic_p)
+        paragraphs = [" ".join(words[start:start + 60]) for start in range(0, length, 60)]
+        texts.append("\n".join(paragraphs))
+
+    return Dataset.from_dict({
+        "id": list(range(n_documents)),
+        "url": [f"https://example.org/{i}" for i in range(n_documents)],
+        "title": [f"Document {i}" for i in range(n_documents)],
+        "text": texts
+    })
+
+
+class HashEmbedder:
+    """
+    Deterministic stand-in for a sentence-transformers model, which works
+    offline and costs almost nothing: the hashed bag of words of a document is
+    projected to dim dimensions with a fixed random matrix and normalized.
+    Documents with many shared words get similar embeddings.
+    """
+
+    def __init__(self, dim: int = 64, n_features: int = 2**14, seed: int = 0):
+        self.vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None)
+        self.projection = np.random.default_rng(seed).standard_normal((n_features, dim)).astype(np.float32)
+
+    def encode(self, documents: list, verbose: bool = False) -> np.ndarray:
+        embeddings = np.asarray(self.vectorizer.transform(documents) @ self.projection, dtype=np.float32)
+        return normalize(embeddings)
+
+
+def embedding_backends(embedder: str):
+    """
+    Returns the BERTopic and KeyBERT embedding backends for --embedder.
+    @param str embedder: 'hash' or the name or path of a sentence-transformers model
+    @return tuple
+    """
+    if embedder != "hash":
+        from bertopic.backend._utils import select_backend
+
+        return select_backend(embedder), embedder
+
+    from bertopic.backend import BaseEmbedder as BERTopicBaseEmbedder
+    from keybert.backend import BaseEmbedder as KeyBERTBaseEmbedder
+
+    encoder = HashEmbedder()
+
+    class BERTopicHashBackend(BERTopicBaseEmbedder):
+        def embed(self, documents: list, verbose: bool = False) -> np.ndarray:
+            return encoder.encode(documents, verbose)
+
+    class KeyBERTHashBackend(KeyBERTBaseEmbedder):
+        def embed(self, documents: list, verbose: bool = False) -> np.ndarray:
+            return encoder.encode(documents, verbose)
+
+    return BERTopicHashBackend(), KeyBERTHashBackend()
+
+
+class FakeElasticsearch:
+    """
+    In-process stand-in for the Elasticsearch client, which accepts the bulk
+    requests of elasticsearch.helpers.streaming_bulk. The documents are parsed,
+    but only counted, so the benchmark measures the client side of the load.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        """
+        @param float latency: seconds each bulk request takes, to simulate the
+            network and the cluster
+        """
+        from elasticsearch.serializer import JSONSerializer
+
+        class Transport:
+            serializer = JSONSerializer()
+
+        self.transport = Transport()
+        self.latency = latency
+        self.documents = 0
+        self.bytes = 0
+
+    def bulk(self, body: str, **kwargs) -> dict:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        self.bytes += len(body)
+        lines = body.splitlines()
+        items = []
+        for action_line in lines[0::2]:
+            action = json.loads(action_line)
+            op_type, meta = next(iter(action.items()))
+            items.append({op_type: {"_index": meta["_index"], "_id": meta.get("_id"), "status": 201}})
+        self.documents += len(items)
+        return {"took": 0, "errors": False, "items": items}
+
+
+def load_inputs(workdir: str) -> tuple:
+    dataset = load_from_disk(os.path.join(workdir, "corpus"))
+    embeddings = np.load(os.path.join(workdir, "embeddings.npy"), mmap_mode="r")
+    return dataset, embeddings
+
+
+def bench_sample(workdir: str, params: dict) -> int:
+    import create_dataset as create_ds
+
+    stream = load_dataset("json", data_files=os.path.join(workdir, "corpus.jsonl"), split="train", streaming=True)
+    n = max(1, params["size"] // 10)
+    create_ds.sample_stream(stream, n, params["seed"], assign_id=True)
+    return params["size"]
+
+
+def bench_model_view(workdir: str, params: dict) -> int:
+    import truncation
+
+    dataset, _ = load_inputs(workdir)
+    dataset.map(truncation.add_model_text, batched=True, batch_size=1000,
+                fn_kwargs={"view": "sections", "max_chars": 5000, "max_words": 0})
+    return len(dataset)
+
+
+def bench_embeddings(workdir: str, params: dict) -> int:
+    import topic_modeling as tm
+
+    dataset, _ = load_inputs(workdir)
+    topic_embedding_model, _ = embedding_backends(params["embedder"])
+    tm.embed(dataset, topic_embedding_model, "article_text", params["batch_size"])
+    return len(dataset)
+
+
+def bench_topics(workdir: str, params: dict) -> int:
+    import topic_modeling as tm
+
+    dataset, embeddings = load_inputs(workdir)
+    topic_embedding_model, _ = embedding_backends(params["embedder"])
+    topic_modeling = tm.TopicModeling(stop_words="english", embedding_model=topic_embedding_model)
+    fit_indices = tm.select_fit_indices(dataset, params["fit_sample_size"], params["seed"], "article_text", params["batch_size"])
+    topic_modeling.fit_topics(dataset, embeddings, fit_indices, "article_text", params["batch_size"])
+    return len(dataset)
+
+
+def bench_layout(workdir: str, params: dict) -> int:
+    import layout as lt
+    import topic_modeling as tm
+
+    dataset, embeddings = load_inputs(workdir)
+    fit_indices = tm.select_fit_indices(dataset, params["fit_sample_size"], params["seed"], "article_text", params["batch_size"])
+    layout_model = lt.create_layout(params["layout"], params["seed"])
+    tm.fit_layout(layout_model, embeddings, fit_indices, params["batch_size"], params["layout"])
+    return len(dataset)
+
+
+def bench_keywords_tfidf(workdir: str, params: dict) -> int:
+    import keyword_extraction as kwe
+
+    dataset, _ = load_inputs(workdir)
+    documents = dataset["article_text"]
+    vectorizer = CountVectorizer(stop_words="english").fit(documents)
+    kwe.VocabularyKeywordExtractor(documents, 5, vectorizer, "tfidf", batch_size=params["batch_size"])
+    return len(dataset)
+
+
+def bench_keywords_keybert(workdir: str, params: dict) -> int:
+    import keyword_extraction as kwe
+
+    dataset, embeddings = load_inputs(workdir)
+    _, keyword_embedding_model = embedding_backends(params["embedder"])
+    kwe.KeywordExtractor(dataset["article_text"], 5, "english", model=keyword_embedding_model, doc_embeddings=embeddings)
+    return len(dataset)
+
+
+def bench_database(workdir: str, params: dict) -> int:
+    from create_database import DBCreater
+
+    data = load_from_disk(os.path.join(workdir, "articles"))
+    db_create = DBCreater()
+    db_create.es_client = FakeElasticsearch(params["es_latency"])
+    indexed, failed = db_create.fill_article_db(data, workers=params["workers"])
+    if failed > 0:
+        raise RuntimeError(f"{failed} documents failed")
+    return indexed
+
+
+STAGES = {
+    "sample": bench_sample,
+    "model_view": bench_model_view,
+    "embeddings": bench_embeddings,
+    "topics": bench_topics,
+    "layout": bench_layout,
+    "keywords_tfidf": bench_keywords_tfidf,
+    "keywords_keybert": bench_keywords_keybert,
+    "database": bench_database,
+}
+
+
+def run_stage(stage: str, workdir: str, params: dict) -> dict:
+    """
+    Runs one stage of the benchmark. It is called in a fresh process, so the
+    peak memory only contains the stage and the loading of its inputs.
+    @return dict: the measurements of the stage
+    """
+    report = RunReport("benchmark")
+    with report.stage(stage) as entry:
+        entry["documents"] = STAGES[stage](workdir, params)
+    # the increase over the high water mark after the imports
+    entry["peak_rss_increase"] = entry["peak_rss_increase"]["self"]
+    return entry
+
+
+def prepare(workdir: str, size: int, params: dict):
+    """
+    Generates the corpus of a size and the inputs of the stages in workdir.
+    """
+    print(f"### Benchmark:  Generating corpus of {size} documents...")
+    corpus = generate_corpus(size, params["mean_words"], params["length_distribution"], seed=params["seed"])
+    # the source for the sample stage and the corpus with the columns of the later stages
+    corpus.to_json(os.path.join(workdir, "corpus.jsonl"))
+    corpus = corpus.rename_columns({"title": "heading", "text": "article_text"})
+    corpus.save_to_disk(os.path.join(workdir, "corpus"))
+    embeddings = HashEmbedder().encode(corpus["article_text"])
+    np.save(os.path.join(workdir, "embeddings.npy"), embeddings)
+
+    # the preprocessed articles in the format of article_data
+    rng = np.random.default_rng(params["seed"])
+    articles = corpus.add_column("topic", [
+        {"topic_name": "topic", "probability": float(p), "x": float(x), "y": float(y)}
+        for p, x, y in rng.random((size, 3)).tolist()])
+    articles = articles.add_column("keywords", [
+        [{"word": f"keyword{j}", "similarity": 0.5} for j in range(5)] for _ in range(size)])
+    articles.save_to_disk(os.path.join(workdir, "articles"))
+
+
+def compare(results: dict, baselines: dict, time_tolerance: float, memory_tolerance: float) -> list:
+    """
+    Compares the results with the baselines.
+    @return list: a description of each regression
+    """
+    regressions = []
+    for key, result in results.items():
+        baseline = baselines.get(key)
+        if baseline is None or "error" in result:
+            continue
+        if result["wall_time"] > baseline["wall_time"] * (1 + time_tolerance):
+            regressions.append(f"{key}: wall time {result['wall_time']:.2f}s, baseline {baseline['wall_time']:.2f}s")
+        if result["peak_rss_increase"] > baseline["peak_rss_increase"] * (1 + memory_tolerance) + 2**20:
+            regressions.append(f"{key}: peak memory +{result['peak_rss_increase'] / 2**20:.0f} MiB, " +
+                               f"baseline +{baseline['peak_rss_increase'] / 2**20:.0f} MiB")
+    return regressions
+
+
+def main(sizes: list, stages: list, params: dict, baseline_file: str, output_file: str, update_baseline: bool = False, time_tolerance: float = 0.25, memory_tolerance: float = 0.25) -> int:
+    """
+    Runs each stage on a corpus of each size and compares the results with the
+    baselines.
+    @return int: the exit status, 1 if there are regressions or failed stages
+    """
+    results = dict()
+    spawn = get_context("spawn")
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix="idt-benchmark-") as workdir:
+            prepare(workdir, size, dict(params, size=size))
+            for stage in stages:
+                key = f"{stage}@{size}"
+                print(f"### Benchmark:  Running {key}...")
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                    try:
+                        results[key] = executor.submit(run_stage, stage, workdir, dict(params, size=size)).result()
+                    except Exception as error:
+                        print(f"### Benchmark:  {key} failed: {error!r}")
+                        results[key] = {"error": repr(error)}
+
+    baselines = dict()
+    if os.path.exists(baseline_file):
+        with open(baseline_file, "r") as f:
+            baselines = json.load(f)
+
+    print(f"### Benchmark:  {'stage':<28}{'docs/s':>12}{'wall s':>10}{'CPU s':>10}{'+RSS MiB':>10}{'baseline s':>12}")
+    for key, result in results.items():
+        if "error" in result:
+            print(f"### Benchmark:  {key:<28}{'failed':>12}")
+            continue
+        baseline = baselines.get(key, {}).get("wall_time")
+        print(f"### Benchmark:  {key:<28}{result['documents'] / result['wall_time']:>12.0f}" +
+              f"{result['wall_time']:>10.2f}{result['cpu_time'] + result['children_cpu_time']:>10.2f}" +
+              f"{result['peak_rss_increase'] / 2**20:>10.0f}" +
+              (f"{baseline:>12.2f}" if baseline is not None else f"{'-':>12}"))
+
+    with open(output_file, "w") as f:
+        json.dump({"params": params, "results": results}, f, indent=4)
+
+    if update_baseline:
+        baselines.update({key: result for key, result in results.items() if "error" not in result})
+        with open(baseline_file, "w") as f:
+            json.dump(baselines, f, indent=4)
+        print(f"### Benchmark:  Updated baselines in {baseline_file}")
+        return 0
+
+    regressions = compare(results, baselines, time_tolerance, memory_tolerance)
+    for regression in regressions:
+        print(f"### Benchmark:  REGRESSION {regression}")
+    return 1 if regressions or any("error" in result for result in results.values()) else 0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="benchmark.py",
+        description="Benchmarks the stages of the preprocessing and the database " +
+            "load on synthetic corpora and compares their time and memory with " +
+            "stored baselines. Runs offline: the embeddings come from a deterministic " +
+            "hash embedder and the articles are loaded into an in-process stand-in " +
+            "for Elasticsearch. Baselines are only comparable on the same machine."
+    )
+    parser.add_argument('--sizes',
+        metavar='n',
+        nargs='+',
+        type=int,
+        help="Number of documents of the corpora. Default: 1000 10000",
+        default=[1000, 10000]
+    )
+    parser.add_argument('--stages',
+        nargs='+',
+        type=str,
+        help="The stages to benchmark. Default: all",
+        choices=list(STAGES),
+        default=list(STAGES)
+    )
+    parser.add_argument('--mean-words',
+        metavar='n',
+        type=int,
+        help="Mean number of words per document. Default: 300",
+        default=300
+    )
+    parser.add_argument('--length-distribution',
+        type=str,
+        help="Distribution of the document lengths. Default: lognormal",
+        choices=LENGTH_DISTRIBUTIONS,
+        default="lognormal"
+    )
+    parser.add_argument('--embedder',
+        metavar='MODEL',
+        type=str,
+        help="'hash' for the deterministic stand-in embedder or the name or path " +
+            "of a (small, cached) sentence-transformers model. Default: hash",
+        default="hash"
+    )
+    parser.add_argument('--layout',
+        type=str,
+        help="The layout of the layout stage. Default: pca",
+        choices=["umap", "pca", "svd+umap"],
+        default="pca"
+    )
+    parser.add_argument('--fit-sample',
+        metavar='n',
+        type=int,
+        help="--fit-sample of the topics and layout stages. Default: 0",
+        default=0
+    )
+    parser.add_argument('--batch-size',
+        metavar='n',
+        type=int,
+        help="--batch-size of the stages. Default: 10000",
+        default=10000
+    )
+    parser.add_argument('--workers',
+        metavar='n',
+        type=int,
+        help="Number of bulk workers of the database stage. Default: 4",
+        default=4
+    )
+    parser.add_argument('--es-latency',
+        metavar='SECONDS',
+        type=float,
+        help="Simulated duration of each bulk request. Default: 0",
+        default=0.0
+    )
+    parser.add_argument('--seed',
+        metavar='SEED',
+        type=int,
+        help="Seed of the corpora and the samples. Default: 0",
+        default=0
+    )
+    parser.add_argument('--baseline',
+        metavar='FILE',
+        type=str,
+        help="JSON file with the baselines. Default: benchmark_baselines.json",
+        default="benchmark_baselines.json"
+    )
+    parser.add_argument('--update-baseline',
+        action='store_true',
+        help="Store the results as the new baselines instead of comparing them",
+        default=False
+    )
+    parser.add_argument('--output',
+        metavar='FILE',
+        type=str,
+        help="JSON file for the results. Default: benchmark_results.json",
+        default="benchmark_results.json"
+    )
+    parser.add_argument('--time-tolerance',
+        metavar='FRACTION',
+        type=float,
+        help="A stage regressed if it takes this fraction longer than its baseline. " +
+            "Default: 0.25",
+        default=0.25
+    )
+    parser.add_argument('--memory-tolerance',
+        metavar='FRACTION',
+        type=float,
+        help="A stage regressed if its peak memory increase is this fraction larger " +
+            "than its baseline. Default: 0.25",
+        default=0.25
+    )
+
+    args = parser.parse_args()
+    params = {
+        "mean_words": args.mean_words,
+        "length_distribution": args.length_distribution,
+        "embedder": args.embedder,
+        "layout": args.layout,
+        "fit_sample_size": args.fit_sample,
+        "batch_size": args.batch_size,
+        "workers": args.workers,
+        "es_latency": args.es_latency,
+        "seed": args.seed
+    }
+    sys.exit(main(args.sizes, args.stages, params, args.baseline, args.output,
+                  args.update_baseline, args.time_tolerance, args.memory_tolerance))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+import contextlib
+import os
+import tempfile
+import numpy as np
+import pyarrow as pa
+
+
+@contextlib.contextmanager
+def replaced_file(path: str):
+    """
+    Yields a temporary path next to path and moves the file written there into
+    place when the block succeeds. The web app memory maps the export files, so
+    they must not be truncated or rewritten in place: a mapped page beyond the
+    end of a shrunken file kills the reading process with SIGBUS. Readers that
+    still map the old file keep it until they reopen the new one.
+    @param str path: the file to replace
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    # keep the extension, np.savez appends .npz to other names
+    fd, temporary_path = tempfile.mkstemp(prefix=".tmp-", suffix="-" + name, dir=directory)
+    os.close(fd)
+    try:
+        yield temporary_path
+        # mkstemp creates the file only readable by its owner
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def dictionary_encode(values: np.ndarray) -> pa.DictionaryArray:
+    """
+    Dictionary encodes an array of strings with int32 indices into the sorted
+    unique values.
+    @param np.ndarray values
+    @return pa.DictionaryArray
+    """
+    dictionary, indices = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return pa.DictionaryArray.from_arrays(pa.array(indices.astype(np.int32)), pa.array(dictionary))
+
+
+def write_article_columns(path: str, ids, headings, topic_names: np.ndarray, probabilities: np.ndarray, coordinates: np.ndarray, keyword_offsets: np.ndarray, keyword_words: np.ndarray):
+    """
+    Writes the columns the web app needs for the cluster plot and the keyword
+    counts as an uncompressed Arrow IPC file, which can be memory mapped and
+    read without copying. One row per document:
+    id int64, heading string, x and y float32, topic dictionary<int32, string>,
+    probability float32 and keywords list<dictionary<int32, string>>, i.e. the
+    keyword ids of each document into the keyword vocabulary.
+    @param str path: the file to write
+    @param ids: the id of each document
+    @param headings: the heading of each document
+    @param np.ndarray topic_names: the topic label of each document
+    @param np.ndarray probabilities: the topic probability of each document
+    @param np.ndarray coordinates: the 2D coordinates of each document
+    @param np.ndarray keyword_offsets: the keywords of document i are at offsets[i]:offsets[i + 1]
+    @param np.ndarray keyword_words: the keywords of all documents
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float32)
+    keywords = pa.ListArray.from_arrays(pa.array(np.asarray(keyword_offsets, dtype=np.int32)),
+                                        dictionary_encode(keyword_words))
+    table = pa.table({
+        "id": pa.array(np.asarray(ids).astype(np.int64)),
+        "heading": pa.array(headings, type=pa.string()),
+        "x": pa.array(coordinates[:, 0]),
+        "y": pa.array(coordinates[:, 1]),
+        "topic": dictionary_encode(topic_names),
+        "probability": pa.array(np.asarray(probabilities, dtype=np.float32)),
+        "keywords": keywords
+    })
+    with replaced_file(path) as temporary_path:
+        with pa.OSFile(temporary_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+
+def write_article_embeddings(path: str, embeddings: np.ndarray, batch_size: int = 65536):
+    """
+    Writes the L2-normalized embeddings of the documents as a float32 .npy
+    file, one row per document in the order of write_article_columns. The web
+    app memory maps it for the similar documents lookup, the inner product of
+    two rows is their cosine similarity. The rows are normalized in batches,
+    so the embeddings don't need to fit into memory twice.
+    @param str path: the file to write
+    @param np.ndarray embeddings: the embedding of each document
+    @param int batch_size: number of rows normalized at once
+    """
+    with replaced_file(path) as temporary_path:
+        normalized = np.lib.format.open_memmap(temporary_path, mode="w+", dtype=np.float32, shape=embeddings.shape)
+        for start in range(0, len(embeddings), batch_size):
+            batch = np.asarray(embeddings[start:start + batch_size], dtype=np.float32)
+            norms = np.linalg.norm(batch, axis=1, keepdims=True)
+            normalized[start:start + batch_size] = batch / np.maximum(norms, np.finfo(np.float32).tiny)
+        normalized.flush()
+        del normalized
+
+
+def write_neighbor_graph(path: str, neighbors: dict):
+    """
+    Writes the neighbor graph of the documents as .npz file for the tag
+    suggestions of the web app.
+    @param str path: the file to write, ending with .npz
+    @param dict neighbors: the arrays 'indices' and 'similarities'
+    """
+    with replaced_file(path) as temporary_path:
+        np.savez(temporary_path, **neighbors)
@@ -1,11 +1,29 @@
 from elasticsearch.client import IndicesClient
 from elasticsearch import Elasticsearch
+from elasticsearch.helpers import scan, streaming_bulk
 from datasets import load_from_disk
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from threading import Lock
+from run_report import RunReport
+import contextlib
+import copy
 import json
+import os
+import sys
+import time
 # TODO: mount the docker volume outside into a local path?
 # Standard setting are used, might need to be changed
 class DBCreater:
-    def __init__(self):
+    def __init__(self, replicas: int = 0, mapping: str = "v2", report: RunReport = None):
+        """
+        @param int replicas: number of replicas of the indices, must be 0 on a
+            single node cluster or the indices never become green
+        @param str mapping: version of the article mapping, 'v1' or 'v2'
+        @param RunReport report: report in which the steps of the load are
+            measured. Default: None
+        """
+        self.report = report
         self.es_client = Elasticsearch(
             "http://localhost:9200",
             http_auth=["elastic", "changeme"],
@@ -15,7 +33,7 @@ class DBCreater:
         self.tag_db = "tags"
         self.article_db_configuration = {
     "settings": {
-        "index": {"number_of_replicas": 2},
+        "index": {"number_of_replicas": replicas},
         "analysis": {
             "filter": {
                 "ngram_filter": {
@@ -49,9 +67,41 @@ class DBCreater:
     "tags": {"type": "keyword"}
         }
     }}
+        # v2 stores keywords and topic as plain objects instead of nested documents,
+        # so keywords.word and topic.topic_name can be counted and filtered with
+        # doc values aggregations. Fields which are only displayed are not indexed
+        # and the coordinates are kept as doc values to fetch them column wise.
+        self.article_db_mappings = {
+            "v1": self.article_db_configuration["mappings"],
+            "v2": {
+                "properties": {
+                    "id": {"type": "long"},
+                    "heading": {"type": "text", "norms": False},
+                    "article_text": {"type": "text"},
+                    "keywords": {
+                        "properties": {
+                            "word": {"type": "keyword"},
+                            "similarity": {"type": "float", "index": False}
+                        }
+                    },
+                    "topic": {
+                        "properties": {
+                            "topic_name": {"type": "keyword"},
+                            "x": {"type": "float", "index": False},
+                            "y": {"type": "float", "index": False},
+                            "probability": {"type": "float", "index": False}
+                        }
+                    },
+                    "url": {"type": "keyword", "index": False, "doc_values": False},
+                    "tags": {"type": "keyword", "eager_global_ordinals": True},
+                    "ingested_at": {"type": "date"}
+                }
+            }
+        }
+        self.article_db_configuration["mappings"] = self.article_db_mappings[mapping]
         self.tags_db_configuration = {
       "settings": {
-        "index": {"number_of_replicas": 2},
+        "index": {"number_of_replicas": replicas},
         "analysis": {
             "filter": {
                 "ngram_filter": {
@@ -76,20 +126,217 @@ class DBCreater:
         "properties": {
             "id": {"type": "long"},
             "name": {"type": "keyword"},
-            "description": {"type": "text"},}
+            "description": {"type": "text"},
+            # rule which adds the tag to matching articles, applied by the web app
+            "rule": {"type": "object", "enabled": False},
+            "rule_applied_until": {"type": "date", "index": False},}
     }
 
 }
 
+    def measure(self, name: str, documents: int = None):
+        """
+        Returns a context manager which measures a step in the run report, if
+        there is one.
+        @param str name: name of the step
+        @param int documents: number of documents the step processes
+        """
+        if self.report is None:
+            return contextlib.nullcontext({})
+        return self.report.stage(name, documents)
+
+    def get_index_size(self, index: str) -> int:
+        """
+        Returns the size of the primary shards of an index or alias in bytes.
+        @param str index
+        @return int
+        """
+        stats = self.es_index_client.stats(index=index, metric="store")
+        return stats["_all"]["primaries"]["store"]["size_in_bytes"]
+
     def create_article_db(self):
+        # 'articles' is an alias after an import with --alias-swap, which can't
+        # be deleted like an index
+        if self.es_index_client.exists_alias(name=self.article_db):
+            for index in self.es_index_client.get_alias(name=self.article_db):
+                self.es_index_client.delete(index=index)
         self.es_index_client.delete(index=self.article_db, ignore=404)
         self.es_index_client.create(index=self.article_db, body=self.article_db_configuration)
-    
-    def fill_article_db(self, data):
-        actions = []
-        for i in range(len(data)):
-            article = data[i]
-            action = {"index": {"_index": self.article_db, "_id": int(article["id"])}}
+
+    def get_versioned_article_dbs(self) -> list:
+        """
+        Returns the names of all versioned article indices (articles_v<N>) sorted
+        by their version.
+        @return list
+        """
+        prefix = f"{self.article_db}_v"
+        indices = self.es_index_client.get(index=f"{prefix}*")
+        versioned = [name for name in indices if name[len(prefix):].isdigit()]
+        return sorted(versioned, key=lambda name: int(name[len(prefix):]))
+
+    def create_versioned_article_db(self) -> str:
+        """
+        Creates the next versioned article index with the article configuration,
+        but without replicas and with refresh disabled, which makes bulk loading
+        it considerably faster.
+        @return str: the name of the new index
+        """
+        prefix = f"{self.article_db}_v"
+        versions = self.get_versioned_article_dbs()
+        version = int(versions[-1][len(prefix):]) + 1 if versions else 1
+        index = f"{prefix}{version}"
+
+        configuration = copy.deepcopy(self.article_db_configuration)
+        configuration["settings"]["index"].update({"number_of_replicas": 0, "refresh_interval": "-1"})
+        self.es_index_client.create(index=index, body=configuration)
+        return index
+
+    def finish_bulk_load(self, index: str):
+        """
+        Restores the replicas and refresh interval of the article configuration
+        on a bulk loaded index, refreshes it and merges it into a single segment.
+        @param str index: the bulk loaded index
+        """
+        replicas = self.article_db_configuration["settings"]["index"]["number_of_replicas"]
+        self.es_index_client.put_settings(index=index, body={
+            "index": {"number_of_replicas": replicas, "refresh_interval": None}})
+        self.es_index_client.refresh(index=index)
+        print(f"### Database:  Force merging '{index}'...")
+        self.es_index_client.forcemerge(index=index, max_num_segments=1, request_timeout=3600)
+
+    def copy_tags(self, source: str, target: str, chunk_size: int = 500) -> int:
+        """
+        Copies the tag assignments of all articles in source to the articles with
+        the same id in target. Articles which no longer exist in target are skipped.
+        @param str source: index or alias with the current tag assignments
+        @param str target: index to which the tag assignments are copied
+        @param int chunk_size: maximal number of updates per bulk request
+        @return int: number of articles whose tags were copied
+        """
+        hits = scan(self.es_client, index=source, _source=["tags"],
+                    query={"query": {"exists": {"field": "tags"}}})
+        actions = ({"_op_type": "update", "_index": target, "_id": hit["_id"],
+                    "doc": {"tags": hit["_source"]["tags"]}} for hit in hits)
+        copied = 0
+        for ok, _ in streaming_bulk(self.es_client, actions, chunk_size=chunk_size, raise_on_error=False):
+            copied += ok
+        return copied
+
+    def swap_article_alias(self, index: str, keep: int = 1):
+        """
+        Atomically points the article alias to index. An old article index with
+        the name of the alias is removed in the same request. Of the versioned
+        indices which were replaced, the newest keep are kept for a rollback,
+        the rest is deleted.
+        @param str index: the index the alias should point to
+        @param int keep: number of replaced versioned indices to keep
+        """
+        actions = [{"add": {"index": index, "alias": self.article_db}}]
+        if self.es_index_client.exists_alias(name=self.article_db):
+            for old_index in self.es_index_client.get_alias(name=self.article_db):
+                actions.append({"remove": {"index": old_index, "alias": self.article_db}})
+        elif self.es_index_client.exists(index=self.article_db):
+            actions.append({"remove_index": {"index": self.article_db}})
+        self.es_index_client.update_aliases(body={"actions": actions})
+
+        replaced = [name for name in self.get_versioned_article_dbs() if name != index]
+        for old_index in replaced[:max(0, len(replaced) - keep)]:
+            self.es_index_client.delete(index=old_index)
+
+    def get_article_mapping_version(self) -> str:
+        """
+        Returns the version of the mapping of the current article index.
+        @return str: 'v1' or 'v2'
+        """
+        mappings = self.es_index_client.get_mapping(index=self.article_db)
+        properties = next(iter(mappings.values()))["mappings"]["properties"]
+        return "v1" if properties["keywords"].get("type") == "nested" else "v2"
+
+    def migrate_article_db(self, keep: int = 1, poll_interval: int = 10):
+        """
+        Reindexes the current articles, including their tags, into a new versioned
+        index with the configured mapping and points the article alias to it.
+        The web app keeps working on the old index during the migration.
+        @param int keep: number of replaced versioned indices to keep
+        @param int poll_interval: seconds between two progress reports
+        """
+        if not self.es_index_client.exists(index=self.article_db):
+            sys.exit(f"{sys.argv[0]}: There is no index '{self.article_db}' to migrate.")
+        if self.article_db_configuration["mappings"] == self.article_db_mappings[self.get_article_mapping_version()]:
+            print(f"### Database:  '{self.article_db}' already uses this mapping; Nothing to do")
+            return
+
+        index = self.create_versioned_article_db()
+        print(f"### Database:  Reindexing '{self.article_db}' into '{index}'...")
+        with self.measure("migrate") as step:
+            task = self.es_client.reindex(
+                body={"source": {"index": self.article_db, "size": 1000}, "dest": {"index": index}},
+                wait_for_completion=False,
+                slices="auto"
+            )["task"]
+            while True:
+                status = self.es_client.tasks.get(task_id=task)
+                if status["completed"]:
+                    break
+                progress = status["task"]["status"]
+                print(f"### Database:  Reindexed {progress['created']}/{progress['total']} articles")
+                time.sleep(poll_interval)
+            step["documents"] = status["task"]["status"]["total"]
+
+        response = status.get("response", {})
+        if "error" in status or response.get("failures"):
+            self.es_index_client.delete(index=index)
+            sys.exit(f"{sys.argv[0]}: Reindexing into '{index}' failed: " +
+                     f"{status.get('error', response.get('failures'))}")
+
+        with self.measure("finish_bulk_load"):
+            self.finish_bulk_load(index)
+        print(f"### Database:  Pointing alias '{self.article_db}' to '{index}'...")
+        self.swap_article_alias(index, keep)
+
+    def import_articles(self, data, keep: int = 1, **bulk_options):
+        """
+        Imports the articles into a new versioned index without touching the
+        index the web app is reading from. After the bulk load the tag assignments
+        are copied from the current articles, the index settings are restored and
+        the article alias is switched to the new index.
+        Tags which are assigned while the import is running are not copied.
+        @param data: the dataset with the preprocessed articles
+        @param int keep: number of replaced versioned indices to keep
+        @param bulk_options: passed on to fill_article_db
+        """
+        index = self.create_versioned_article_db()
+        print(f"### Database:  Bulk loading '{index}'...")
+        with self.measure("bulk_load", len(data)) as step:
+            step["indexed"], step["failed"] = self.fill_article_db(data, index=index, **bulk_options)
+
+        if self.es_index_client.exists(index=self.article_db):
+            print(f"### Database:  Copying tags from '{self.article_db}' to '{index}'...")
+            with self.measure("copy_tags") as step:
+                copied = self.copy_tags(self.article_db, index)
+                step["documents"] = copied
+            print(f"### Database:  Copied tags of {copied} articles")
+
+        with self.measure("finish_bulk_load"):
+            self.finish_bulk_load(index)
+        print(f"### Database:  Pointing alias '{self.article_db}' to '{index}'...")
+        self.swap_article_alias(index, keep)
+
+    def article_actions(self, data, index: str, dump=None, dump_lock=None, ingested_at: str = None):
+        """
+        Generates one bulk index action per row of the dataset. The rows are read
+        one after another from the memory mapped dataset, so only the documents of
+        the bulk requests which are currently in flight are held in memory.
+        @param data: the dataset (or a shard of it) with the preprocessed articles
+        @param str index: the index to which the articles are written
+        @param dump: an open file to which the actions are additionally written
+            in the bulk (ndjson) format, or None
+        @param Lock dump_lock: lock which guards dump if it is shared by several workers
+        @param str ingested_at: time of the load, by which tag rules are applied
+            to new articles only. Default: now
+        """
+        ingested_at = ingested_at if ingested_at is not None else datetime.now(timezone.utc).isoformat()
+        for article in data:
             doc = {
                 "id": int(article["id"]),
                 "heading": article["heading"],
@@ -97,14 +344,79 @@ class DBCreater:
                 "keywords": article["keywords"],
                 "topic": article["topic"],
                 "url": article["url"],
-                "tags": []
+                "tags": [],
+                "ingested_at": ingested_at
                 }
-            actions.append(json.dumps(action))
-            actions.append(json.dumps(doc))
+            if dump is not None:
+                action = {"index": {"_index": index, "_id": doc["id"]}}
+                with dump_lock:
+                    dump.write(json.dumps(action) + "\n" + json.dumps(doc) + "\n")
+            yield {"_index": index, "_id": doc["id"], "_source": doc}
+
+    def fill_article_db(self, data, workers: int = 4, chunk_size: int = 500, max_chunk_bytes: int = 10 * 1024 * 1024, max_retries: int = 5, dump_file: str = None, report_every: int = 10000, index: str = None) -> tuple[int, int]:
+        """
+        Streams the articles of the dataset into the article index. The dataset
+        is split into one contiguous shard per worker and every worker sends its
+        shard in bulk requests of at most chunk_size documents or max_chunk_bytes
+        bytes. Requests rejected with 429 (Too Many Requests) are retried with an
+        exponential backoff.
+        @param data: the dataset with the preprocessed articles
+        @param int workers: number of concurrent bulk requests
+        @param int chunk_size: maximal number of documents per bulk request
+        @param int max_chunk_bytes: maximal size of a bulk request in bytes
+        @param int max_retries: how often a rejected bulk request is retried
+        @param str dump_file: file to which the bulk actions are written, None
+            to not write a dump (Default)
+        @param int report_every: print the throughput every n indexed documents
+        @param str index: the index to which the articles are written. Default:
+            the article index
+        @return tuple(int, int): number of indexed and failed documents
+        """
+        index = index if index is not None else self.article_db
+        workers = max(1, min(workers, len(data)))
+        progress = {"indexed": 0, "failed": 0, "reported": 0}
+        progress_lock = Lock()
+        dump_lock = Lock()
+        dump = open(dump_file, "w") if dump_file is not None else None
+        ingested_at = datetime.now(timezone.utc).isoformat()
+        start = time.perf_counter()
 
-        with open("article_demo.json", "w") as fo:
-            fo.write("\n".join(actions))
-            self.es_client.bulk(body="\n".join(actions))
+        def bulk_worker(shard_index: int):
+            shard = data.shard(num_shards=workers, index=shard_index, contiguous=True)
+            results = streaming_bulk(
+                self.es_client,
+                self.article_actions(shard, index, dump, dump_lock, ingested_at),
+                chunk_size=chunk_size,
+                max_chunk_bytes=max_chunk_bytes,
+                max_retries=max_retries,
+                initial_backoff=2,
+                max_backoff=60,
+                raise_on_error=False,
+                request_timeout=120
+            )
+            for ok, item in results:
+                with progress_lock:
+                    progress["indexed" if ok else "failed"] += 1
+                    done = progress["indexed"] + progress["failed"]
+                    if done - progress["reported"] >= report_every:
+                        progress["reported"] = done
+                        elapsed = time.perf_counter() - start
+                        print(f"### Database:  Indexed {done}/{len(data)} documents ({done / elapsed:.1f} docs/s)")
+                if not ok:
+                    print(f"### Database:  Failed to index document: {item}")
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # list() to re-raise exceptions of the workers
+                list(executor.map(bulk_worker, range(workers)))
+        finally:
+            if dump is not None:
+                dump.close()
+
+        elapsed = time.perf_counter() - start
+        print(f"### Database:  Indexed {progress['indexed']} documents in {elapsed:.1f}s " +
+              f"({progress['indexed'] / elapsed:.1f} docs/s), {progress['failed']} failed")
+        return progress["indexed"], progress["failed"]
 
     def create_tag_db(self):
         self.es_index_client.delete(index=self.tag_db, ignore=404)
@@ -112,8 +424,124 @@ class DBCreater:
 
 
 if __name__ == '__main__':
-    data = load_from_disk("article_data")
-    db_create = DBCreater()
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="create_database.py",
+        description="Writes the preprocessed articles from the export directory to " +
+            "the Elasticsearch database."
+    )
+    parser.add_argument('-w', '--workers',
+        metavar='n',
+        action='store',
+        type=int,
+        help="Number of concurrent bulk requests. Default: 4",
+        default=4
+    )
+    parser.add_argument('--chunk-size',
+        metavar='n',
+        action='store',
+        type=int,
+        help="Maximal number of documents per bulk request. Default: 500",
+        default=500
+    )
+    parser.add_argument('--chunk-bytes',
+        metavar='MB',
+        action='store',
+        type=int,
+        help="Maximal size of a bulk request in megabytes. Default: 10",
+        default=10
+    )
+    parser.add_argument('--max-retries',
+        metavar='n',
+        action='store',
+        type=int,
+        help="How often a bulk request rejected with 429 (Too Many Requests) is " +
+            "retried with exponential backoff. Default: 5",
+        default=5
+    )
+    parser.add_argument('--dump',
+        metavar='FILE',
+        action='store',
+        type=str,
+        help="Additionally write the bulk actions as ndjson to FILE. Default: None " +
+            "(don't write a dump)",
+        default=None
+    )
+    parser.add_argument('--alias-swap',
+        action='store_true',
+        help="Load the articles into a new versioned index (articles_v<N>) with " +
+            "replicas and refresh disabled, copy the existing tag assignments and " +
+            "then atomically point the 'articles' alias to it. The web app keeps " +
+            "working on the old articles during the import. Default: False " +
+            "(delete and recreate 'articles')",
+        default=False
+    )
+    parser.add_argument('--keep',
+        metavar='n',
+        action='store',
+        type=int,
+        help="With --alias-swap or --migrate: number of replaced article indices to keep for " +
+            "a rollback. Default: 1",
+        default=1
+    )
+    parser.add_argument('--mapping',
+        action='store',
+        type=str,
+        help="Version of the mapping of the article index. Default: v2",
+        choices=["v1", "v2"],
+        default="v2"
+    )
+    parser.add_argument('--migrate',
+        action='store_true',
+        help="Don't import articles, but reindex the existing articles with their " +
+            "tags into a new versioned index with the mapping given by --mapping " +
+            "and atomically point the 'articles' alias to it. Default: False",
+        default=False
+    )
+    parser.add_argument('--profile',
+        action='store_true',
+        help="Write a cProfile dump of each step of the load to the profiles " +
+            "directory next to the run report. Default: False",
+        default=False
+    )
+    parser.add_argument('--replicas',
+        metavar='n',
+        action='store',
+        type=int,
+        help="Number of replicas of the indices. Default: 0 (single node cluster)",
+        default=0
+    )
+    args = parser.parse_args()
+
+    data = None
+    report_path = "./export/run_report.json" if os.path.isdir("./export") else "./run_report.json"
+    if not args.migrate:
+        data = load_from_disk("article_data")
+        # the report is written next to article_data, like the one of the preprocessing
+        report_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(data.cache_files[0]["filename"]))),
+                                   "run_report.json")
+    report = RunReport("database", report_path, os.path.join(os.path.dirname(report_path), "profiles") if args.profile else None)
+
+    db_create = DBCreater(args.replicas, args.mapping, report)
+    if args.migrate:
+        print(f"### Migrating article database to mapping {args.mapping}...")
+        db_create.migrate_article_db(args.keep)
+        report.save(mapping=args.mapping, index_size=db_create.get_index_size(db_create.article_db))
+        sys.exit(0)
+
     print("### Writing data to database...")
-    db_create.create_article_db()
-    db_create.fill_article_db(data)
+    bulk_options = {
+        "workers": args.workers,
+        "chunk_size": args.chunk_size,
+        "max_chunk_bytes": args.chunk_bytes * 1024 * 1024,
+        "max_retries": args.max_retries,
+        "dump_file": args.dump
+    }
+    if args.alias_swap:
+        db_create.import_articles(data, args.keep, **bulk_options)
+    else:
+        db_create.create_article_db()
+        with db_create.measure("bulk_load", len(data)) as step:
+            step["indexed"], step["failed"] = db_create.fill_article_db(data, **bulk_options)
+    report.save(index_size=db_create.get_index_size(db_create.article_db))
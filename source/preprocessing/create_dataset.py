@@ -1,10 +1,116 @@
 #!/usr/bin/env python3
+import itertools
 import json
+import math
 import os
-from datasets import load_dataset, load_from_disk
+import random
+import sys
+import time
+from datasets import Dataset, load_dataset, load_from_disk
 
 
-def from_json(path:str):
+def assign_ids(documents: dict, indices: list) -> dict:
+    """
+    Batched Dataset.map function which sets the id of each document to its
+    index in the dataset.
+    @param dict documents: a batch of rows from the dataset
+    @param list indices: the indices of the rows in the dataset
+    @return dict
+    """
+    return {"id": indices}
+
+
+def reservoir_sample(rows, n: int, seed: int) -> list:
+    """
+    Draws a uniform random sample of n rows from an iterable in a single pass
+    with Algorithm L (Li, 1994). Only the n sampled rows are kept in memory and
+    the random number generator is only called O(n log(N/n)) times, the skipped
+    rows are consumed without looking at them.
+    @param rows: an iterable of rows, e.g. a streamed dataset or a range of indices
+    @param int n: size of the sample
+    @param int seed: seed of the random number generator, the same seed and
+        rows always result in the same sample
+    @return list: tuples (position, row) sorted by the position of the row in rows
+    """
+    rng = random.Random(seed)
+
+    def uniform() -> float:
+        # log() of a value in the open interval (0, 1)
+        return math.log(rng.random() or sys.float_info.min)
+
+    rows = iter(rows)
+    reservoir = list(enumerate(itertools.islice(rows, n)))
+    if len(reservoir) < n:
+        return reservoir
+
+    end = object()
+    position = n - 1
+    w = math.exp(uniform() / n)
+    while w < 1.0:
+        skip = int(uniform() / math.log(1.0 - w))
+        row = next(itertools.islice(rows, skip, None), end)
+        if row is end:
+            break
+        position += skip + 1
+        reservoir[rng.randrange(n)] = (position, row)
+        w *= math.exp(uniform() / n)
+
+    return sorted(reservoir, key=lambda entry: entry[0])
+
+
+def sample_dataset(dataset: 'dataset', n: int, seed: int) -> 'dataset':
+    """
+    Selects a seeded reservoir sample of n documents from a dataset on disk.
+    Only the sampled positions are drawn, the documents themselves are not read.
+    @param dataset: the dataset from which the documents should be selected
+    @param int n: number of documents to select
+    @param int seed: seed for the sample
+    @return 'dataset'
+    """
+    positions = [position for position, _ in reservoir_sample(range(len(dataset)), n, seed)]
+    return dataset.select(positions)
+
+
+def sample_stream(rows, n: int, seed: int, assign_id: bool = False) -> 'dataset':
+    """
+    Creates a dataset from a seeded reservoir sample of n documents of a stream
+    of documents, e.g. a streamed dataset. Memory and disk usage only depend on n.
+    @param rows: an iterable of documents (dicts)
+    @param int n: number of documents to select
+    @param int seed: seed for the sample
+    @param bool assign_id: set the id of each document to its position in the stream
+    @return 'dataset'
+    """
+    sample = reservoir_sample(rows, n, seed)
+    if assign_id:
+        return Dataset.from_list([dict(row, id=position) for position, row in sample])
+    return Dataset.from_list([row for _, row in sample])
+
+
+def sample_json(path: str, n: int, seed: int) -> 'dataset':
+    """
+    Create a Dataset from a seeded reservoir sample of n documents of a json file
+    with the structure described in from_json. If the complete dataset was already
+    created by from_json, the sample is drawn from it. Otherwise the file is
+    streamed and neither the complete dataset nor an indices mapping of it is
+    created. In both cases the id of a document is its position in the file.
+    @param str path: a relativ path from /data/import.
+    @param int n: number of documents to select
+    @param int seed: seed for the sample
+    @return 'dataset'
+    """
+    if os.path.isdir(f"./import/dataset-{path.split('/')[-1]}"):
+        print("### Preprocessing:  Found dataset on disk; Sampling Dataset...")
+        return sample_dataset(load_from_disk(f"./import/dataset-{path.split('/')[-1]}"), n, seed)
+
+    if not os.path.exists(os.path.join("/", "data", "import", path)):
+        sys.exit(f"{sys.argv[0]}: File '{path}' does not exist. Can't read documents from file.")
+
+    stream = load_dataset("json", data_files=os.path.join("/", "data", "import", path), split='train', streaming=True)
+    return sample_stream(stream, n, seed, assign_id=True)
+
+
+def from_json(path:str, num_proc: int = None):
     """
     Create Dataset from a json file with the following structure:
     [
@@ -15,8 +121,9 @@ def from_json(path:str):
         }
     ]
     @param str path: a relativ path from /data/import.
+    @param int num_proc: number of processes used to assign the ids
     """
-    if os.path.isdir("./import/dataset-paperless"):
+    if os.path.isdir(f"./import/dataset-{path.split('/')[-1]}"):
         print("### Preprocessing:  Found dataset on disk; Loading Dataset...")
         return load_from_disk(f"./import/dataset-{path.split('/')[-1]}")
 
@@ -25,11 +132,10 @@ def from_json(path:str):
     except IOError:
         sys.exit(f"{sys.argv[0]}: File '{path}' does not exist. Can't read stop words from file.")
 
-    def assign_id(document, idx):
-        document["id"] = idx
-        return document
-
-    dataset.map(assign_id, with_indices=True)
+    start = time.perf_counter()
+    dataset = dataset.map(assign_ids, with_indices=True, batched=True, batch_size=10000, num_proc=num_proc)
+    elapsed = time.perf_counter() - start
+    print(f"### Preprocessing:  Assigned ids to {len(dataset)} rows ({len(dataset) / elapsed:.0f} rows/s)")
     dataset.save_to_disk(f"./import/dataset-{path.split('/')[-1]}")
     
     return dataset
@@ -1,10 +1,22 @@
 #!/usr/bin/env python3
+import functools
+import json
 import os
 import sys
+import numpy as np
 from datasets import load_dataset, load_from_disk
+import columnar_export
 import create_dataset as create_ds
+from run_report import RunReport
 import keyword_extraction as kwe
+import layout as lt
+import neighbor_graph as ng
+import truncation
 import topic_modeling as tm
+from pipeline import Pipeline, Stage
+
+
+STAGES = ("sample", "lemmas", "embeddings", "topics", "coordinates", "keywords", "neighbors", "export")
 
 
 def create_needed_directories():
@@ -64,36 +76,408 @@ def get_dataset(subset: str) -> 'dataset':
     return dataset
 
 
-def main(subset: str, json_file:str, paperless_dir:str, data_points: int, nr_topics: int, n_keywords: int, stop_words:str, min_length_of_keywords:int, max_length_of_keywords:int, language:str, model:str):
+def get_dataset_sample(subset: str, n: int, seed: int) -> 'dataset':
     """
-    Update Dataset and run topic modeling and keyword extration
+    Get a seeded reservoir sample of n articles of the Wikipedia Dataset. If the
+    dataset is not on disk, it is streamed from Hugging Face instead of being
+    downloaded and saved completely.
+    """
+    if os.path.isdir(f"./import/dataset-{subset}"):
+        print("### Preprocessing:  Found dataset on disk; Sampling Dataset...")
+        return create_ds.sample_dataset(load_from_disk(f"./import/dataset-{subset}"), n, seed)
+
+    print("### Preprocessing:  Dataset localy not found; Streaming...")
+    stream = load_dataset("wikipedia", subset, split="train", streaming=True)
+    return create_ds.sample_stream(stream, n, seed)
+
+
+def source_identity(subset: str, json_file: str, paperless_dir: str) -> dict:
+    """
+    Identifies the source of the documents for the fingerprint of the sample
+    stage. Files are identified by their path, size and modification time.
+    @return dict
     """
-    create_needed_directories()
-    dataset = None
+    if subset is not None:
+        return {"wikipedia": subset}
+    if json_file is not None:
+        path = os.path.join("/", "data", "import", json_file)
+    else:
+        path = os.path.join(".", "import", paperless_dir, "manifest.json")
+    if not os.path.exists(path):
+        return {"file": path}
+    stat = os.stat(path)
+    return {"file": path, "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def select_documents(subset: str, json_file: str, paperless_dir: str, data_points: int, sampling: str, seed: int, num_proc: int = None) -> 'dataset':
+    """
+    Loads the documents from the source, reduced to data_points documents if
+    data_points > 0
+    """
+    if data_points > 0 and sampling == "reservoir":
+        # draw the sample while reading the source, without materializing it
+        print(f"### Preprocessing:  Sampling {data_points} Datapoints with seed {seed}...")
+        if subset is not None:
+            return get_dataset_sample(subset, data_points, seed)
+        elif json_file is not None:
+            return create_ds.sample_json(json_file, data_points, seed)
+        return create_ds.sample_dataset(create_ds.from_paperless_manifest(paperless_dir), data_points, seed)
+
     if subset is not None:
         dataset = get_dataset(subset)
     elif json_file is not None:
-        dataset = create_ds.from_json(json_file)
+        dataset = create_ds.from_json(json_file, num_proc)
     else:
         dataset = create_ds.from_paperless_manifest(paperless_dir)
 
     # reduce the ammount of data points
     if data_points > 0:
-        print("### Preprocessing:  Shuffling Dataset...")
-        dataset = dataset.shuffle()
+        print(f"### Preprocessing:  Shuffling Dataset with seed {seed}...")
+        dataset = dataset.shuffle(seed=seed)
         print(f"### Preprocessing:  Reducing Datapoints to {data_points}...")
         dataset = dataset.select(list(range(data_points)))
+    return dataset
+
+
+@functools.lru_cache(maxsize=None)
+def get_embedding_models(embedding_backend: str, model: str, language: str) -> tuple:
+    """
+    Creates the embedding models for BERTopic and KeyBERT once, both stages
+    which embed with them share the same models.
+    @return tuple: the BERTopic and the KeyBERT embedding model
+    """
+    if embedding_backend == "onnx":
+        import onnx_embedding
+
+        encoder = onnx_embedding.OnnxSentenceEncoder(model if model is not None else onnx_embedding.DEFAULT_MODEL)
+        return onnx_embedding.BERTopicBackend(encoder), onnx_embedding.KeyBERTBackend(encoder)
+    return tm.select_backend(model, language), model
+
+
+def get_text_column(dataset: 'dataset') -> str:
+    # the models only see a bounded view of long documents, if there is one
+    return "model_text" if "model_text" in dataset.column_names else "article_text"
+
+
+def run_sample(directory: str, inputs: dict, params: dict, subset: str, json_file: str, paperless_dir: str, num_proc: int = None):
+    """
+    Stage 'sample': selects the documents, renames their columns and adds the
+    model view.
+    """
+    dataset = select_documents(subset, json_file, paperless_dir, params["data_points"],
+                               params["sampling"], params["seed"], num_proc)
 
     print("### Preprocessing:  Renaming 'title' column to 'heading'...")
     dataset = dataset.rename_column("title", "heading")
     print("### Preprocessing:  Renaming 'text' column to 'article_text'...")
     dataset = dataset.rename_column("text", "article_text")
 
-    updated_dataset = tm.main(dataset, nr_topics, language, stop_words, min_length_of_keywords, max_length_of_keywords)
-    updated_dataset = kwe.main(updated_dataset, n_keywords, stop_words, min_length_of_keywords, max_length_of_keywords, model)
+    # 'article_text' keeps the full text for the database
+    if params["model_view"] != "full":
+        print(f"### Preprocessing:  Adding '{params['model_view']}' view of 'article_text' as 'model_text' column...")
+        dataset = dataset.map(
+            truncation.add_model_text,
+            batched=True,
+            batch_size=1000,
+            num_proc=num_proc,
+            fn_kwargs={"view": params["model_view"], "max_chars": params["model_view_chars"],
+                       "max_words": params["model_view_words"]}
+        )
+
+    dataset.save_to_disk(directory)
+
+
+def run_embeddings(directory: str, inputs: dict, params: dict, model: str, onnx_check: int = 100, batch_size: int = 10000):
+    """
+    Stage 'embeddings': embeds all documents once for the topic modeling, the
+    layout and the keyword extraction.
+    """
+    dataset = inputs["sample"]
+    text_column = get_text_column(dataset)
+    topic_embedding_model, _ = get_embedding_models(params["embedding_backend"], model, params["language"])
+    if params["embedding_backend"] == "onnx" and onnx_check > 0:
+        import onnx_embedding
+
+        model_name = model if model is not None else onnx_embedding.DEFAULT_MODEL
+        onnx_embedding.check_accuracy(topic_embedding_model.encoder, model_name, dataset[:onnx_check][text_column])
+
+    embeddings = tm.embed(dataset, topic_embedding_model, text_column, batch_size)
+    np.save(os.path.join(directory, "embeddings.npy"), embeddings)
+
+
+def load_embeddings(directory: str) -> np.ndarray:
+    return np.load(os.path.join(directory, "embeddings.npy"), mmap_mode="r")
+
+
+def run_lemmas(directory: str, inputs: dict, params: dict, num_proc: int = None):
+    """
+    Stage 'lemmas': lemmatizes the documents once for the topic representation,
+    in num_proc processes.
+    """
+    import lemmatization
+
+    dataset = inputs["sample"]
+    lemmatization.lemmatize_dataset(dataset, get_text_column(dataset), num_proc).save_to_disk(directory)
+
+
+def get_representation_documents(inputs: dict) -> tuple:
+    """
+    Returns the dataset and its column with the documents the vectorizer of the
+    topic model is applied to, the lemmatized documents if there are some.
+    @return tuple(dataset, str)
+    """
+    if "lemmas" in inputs:
+        return inputs["lemmas"], "lemmas"
+    return inputs["sample"], get_text_column(inputs["sample"])
+
+
+def run_topics(directory: str, inputs: dict, params: dict, model: str, batch_size: int = 10000):
+    """
+    Stage 'topics': fits the topic model and assigns a topic to each document.
+    The fitted topic model is saved without its embedding model.
+    """
+    dataset = inputs["sample"]
+    representation_dataset, representation_column = get_representation_documents(inputs)
+    topic_embedding_model, _ = get_embedding_models(params["embedding_backend"], model, params["language"])
+    topic_modeling = tm.TopicModeling(params["nr_topics"], params["language"], params["stop_words"],
+                                      params["lemmatization"], params["min_length_of_keywords"],
+                                      params["max_length_of_keywords"], params["layout"],
+                                      params["layout_seed"], topic_embedding_model,
+                                      pre_lemmatized="lemmas" in inputs)
+    fit_indices = tm.select_fit_indices(dataset, params["fit_sample_size"], params["seed"], get_text_column(dataset), batch_size)
+    topic_ids, probabilities = topic_modeling.fit_topics(representation_dataset, inputs["embeddings"], fit_indices,
+                                                         representation_column, batch_size)
+
+    np.savez(os.path.join(directory, "topics.npz"), topic_ids=topic_ids, probabilities=probabilities, fit_indices=fit_indices)
+    with open(os.path.join(directory, "topic_labels.json"), "w") as f:
+        json.dump(topic_modeling.topic_label_dict, f)
+    topic_modeling.topic_model.save(os.path.join(directory, "topic_model"), save_embedding_model=False)
+
+
+def load_topics(directory: str) -> dict:
+    topics = dict(np.load(os.path.join(directory, "topics.npz")))
+    with open(os.path.join(directory, "topic_labels.json"), "r") as f:
+        topics["topic_label_dict"] = json.load(f)
+    topics["topic_model"] = os.path.join(directory, "topic_model")
+    return topics
+
+
+def run_coordinates(directory: str, inputs: dict, params: dict, batch_size: int = 10000):
+    """
+    Stage 'coordinates': computes the 2D coordinates of the documents, fitted on
+    the same documents as the topic model.
+    """
+    topic_umap_model = None
+    if params["layout"] == "reuse":
+        from bertopic import BERTopic
+
+        topic_umap_model = BERTopic.load(inputs["topics"]["topic_model"]).umap_model
+    layout_model = lt.create_layout(params["layout"], params["layout_seed"], topic_umap_model)
+    coordinates = tm.fit_layout(layout_model, inputs["embeddings"], inputs["topics"]["fit_indices"],
+                                batch_size, params["layout"])
+    np.save(os.path.join(directory, "coordinates.npy"), coordinates)
+
+
+def load_coordinates(directory: str) -> np.ndarray:
+    return np.load(os.path.join(directory, "coordinates.npy"))
+
+
+def run_keywords(directory: str, inputs: dict, params: dict, model: str, batch_size: int = 10000):
+    """
+    Stage 'keywords': extracts the keywords of each document, with KeyBERT and
+    the saved document embeddings or by scoring the vocabulary of the topic model.
+    """
+    dataset = inputs["sample"]
+    print(f"### Keyword extraction:  Extracting Keywords with '{params['keyword_method']}'")
+    if params["keyword_method"] == "keybert":
+        documents = dataset[get_text_column(dataset)]
+        _, keyword_embedding_model = get_embedding_models(params["embedding_backend"], model, params["language"])
+        keyword_extractor = kwe.KeywordExtractor(documents, params["n_keywords"],
+                                                 params["stop_words"], params["min_length_of_keywords"],
+                                                 params["max_length_of_keywords"], keyword_embedding_model,
+                                                 inputs["embeddings"])
+    else:
+        from bertopic import BERTopic
+
+        topic_model = BERTopic.load(inputs["topics"]["topic_model"])
+        representation_dataset, representation_column = get_representation_documents(inputs)
+        documents = representation_dataset[representation_column]
+        keyword_extractor = kwe.VocabularyKeywordExtractor(documents, params["n_keywords"],
+                                                           topic_model.vectorizer_model,
+                                                           params["keyword_method"],
+                                                           inputs["topics"]["topic_ids"],
+                                                           topic_model.c_tf_idf_,
+                                                           topic_model._outliers, batch_size)
+    np.savez(os.path.join(directory, "keywords.npz"), offsets=keyword_extractor.offsets,
+             words=keyword_extractor.words.astype(str), similarities=keyword_extractor.similarities)
+
+
+def load_keywords(directory: str) -> dict:
+    keywords = dict(np.load(os.path.join(directory, "keywords.npz")))
+    keywords["words"] = keywords["words"].astype(object)
+    return keywords
+
+
+def run_neighbors(directory: str, inputs: dict, params: dict, batch_size: int = 10000):
+    """
+    Stage 'neighbors': computes the k nearest neighbor graph of the documents
+    for the tag suggestions of the web app.
+    """
+    indices, similarities = ng.knn_graph(inputs["embeddings"], params["graph_neighbors"], batch_size, seed=0)
+    np.savez(os.path.join(directory, "neighbors.npz"), indices=indices, similarities=similarities)
+
+
+def load_neighbors(directory: str) -> dict:
+    return dict(np.load(os.path.join(directory, "neighbors.npz")))
+
+
+def run_export(directory: str, inputs: dict, params: dict, num_proc: int = None, batch_size: int = 10000):
+    """
+    Stage 'export': adds the topics, coordinates and keywords to the documents
+    and saves them for create_database.py. The columns the web app reads
+    directly are saved in a columnar file, the normalized embeddings for the
+    similar documents lookup and the neighbor graph for the tag suggestions
+    next to it.
+    """
+    dataset = inputs["sample"]
+    topics = inputs["topics"]
+    topic_names = tm.topic_names(topics["topic_ids"], topics["topic_label_dict"])
+    keywords = inputs["keywords"]
+
+    print("### Preprocessing:  Save columns for the web app to export/article_columns.arrow...")
+    columnar_export.write_article_columns("./export/article_columns.arrow", dataset["id"], dataset["heading"],
+                                          topic_names, topics["probabilities"], inputs["coordinates"],
+                                          keywords["offsets"], keywords["words"])
+    print("### Preprocessing:  Save normalized embeddings to export/article_embeddings.npy...")
+    columnar_export.write_article_embeddings("./export/article_embeddings.npy", inputs["embeddings"], batch_size)
+    if "neighbors" in inputs:
+        print("### Preprocessing:  Save neighbor graph to export/article_neighbors.npz...")
+        columnar_export.write_neighbor_graph("./export/article_neighbors.npz", inputs["neighbors"])
+    elif os.path.exists("./export/article_neighbors.npz"):
+        # the graph of a previous run doesn't belong to these documents
+        os.remove("./export/article_neighbors.npz")
+
+    updated_dataset = tm.add_topic_column(dataset, topic_names, topics["probabilities"], inputs["coordinates"], num_proc)
+    print("### Keyword extraction:  Adding 'keywords' column to Dataset")
+    updated_dataset = kwe.add_keyword_column(updated_dataset, keywords["offsets"], keywords["words"],
+                                             keywords["similarities"], num_proc)
+    if "model_text" in updated_dataset.column_names:
+        updated_dataset = updated_dataset.remove_columns("model_text")
 
     print("### Preprocessing:  Save updated Dataset to export/...")
     updated_dataset.save_to_disk("./export/article_data")
+    with open(os.path.join(directory, "export.json"), "w") as f:
+        json.dump({"path": "./export/article_data", "rows": len(updated_dataset)}, f)
+
+
+def load_export(directory: str) -> dict:
+    with open(os.path.join(directory, "export.json"), "r") as f:
+        return json.load(f)
+
+
+def main(subset: str, json_file:str, paperless_dir:str, data_points: int, nr_topics: int, n_keywords: int, stop_words:str, min_length_of_keywords:int, max_length_of_keywords:int, language:str, model:str, num_proc: int = None, sampling: str = "reservoir", seed: int = 0, lemmatization: bool = False, fit_sample_size: int = 0, batch_size: int = 10000, layout: str = "umap", layout_seed: int = None, embedding_backend: str = "torch", onnx_check: int = 100, model_view: str = "full", model_view_chars: int = 0, model_view_words: int = 0, from_stage: str = None, until_stage: str = None, keyword_method: str = "keybert", profile: bool = False, graph_neighbors: int = 15):
+    """
+    Update Dataset and run topic modeling and keyword extration as a pipeline of
+    stages. The output of each stage is saved in export/stages and only the
+    stages whose parameters or inputs changed are run again.
+    """
+    create_needed_directories()
+
+    embedding = {"embedding_backend": embedding_backend, "model": model, "language": language}
+    keyword_options = {"stop_words": stop_words, "min_length_of_keywords": min_length_of_keywords,
+                       "max_length_of_keywords": max_length_of_keywords}
+    # 'reuse' lets BERTopic cluster in two dimensions, which changes the topics
+    topic_layout = {"layout": layout, "layout_seed": layout_seed if layout == "reuse" else None}
+
+    report = RunReport("preprocessing", "./export/run_report.json", "./export/profiles" if profile else None)
+    pipeline = Pipeline("./export/stages", from_stage, until_stage, report)
+    pipeline.add_stage(Stage(
+        "sample",
+        functools.partial(run_sample, subset=subset, json_file=json_file, paperless_dir=paperless_dir, num_proc=num_proc),
+        load_from_disk,
+        params={
+            "source": source_identity(subset, json_file, paperless_dir),
+            "data_points": data_points,
+            "sampling": sampling if data_points > 0 else None,
+            # the seed only matters if a sample is drawn
+            "seed": seed if data_points > 0 else None,
+            "model_view": model_view,
+            "model_view_chars": model_view_chars if model_view != "full" else None,
+            "model_view_words": model_view_words if model_view != "full" else None
+        }
+    ))
+    # with -L the documents are lemmatized once before the topic representation
+    lemma_inputs = []
+    if lemmatization:
+        pipeline.add_stage(Stage(
+            "lemmas",
+            functools.partial(run_lemmas, num_proc=num_proc),
+            load_from_disk,
+            inputs=["sample"]
+        ))
+        lemma_inputs = ["lemmas"]
+    pipeline.add_stage(Stage(
+        "embeddings",
+        functools.partial(run_embeddings, model=model, onnx_check=onnx_check, batch_size=batch_size),
+        load_embeddings,
+        inputs=["sample"],
+        params=embedding
+    ))
+    pipeline.add_stage(Stage(
+        "topics",
+        functools.partial(run_topics, model=model, batch_size=batch_size),
+        load_topics,
+        inputs=["sample", "embeddings"] + lemma_inputs,
+        params=dict(embedding, **keyword_options, **topic_layout, nr_topics=nr_topics, lemmatization=lemmatization,
+                    fit_sample_size=fit_sample_size, seed=seed if fit_sample_size > 0 else None)
+    ))
+    pipeline.add_stage(Stage(
+        "coordinates",
+        functools.partial(run_coordinates, batch_size=batch_size),
+        load_coordinates,
+        # the layout is fitted on the same documents as the topic model
+        inputs=["embeddings", "topics"],
+        params={"layout": layout, "layout_seed": layout_seed}
+    ))
+    # tfidf and ctfidf score the n-grams of the vectorizer of the topic model,
+    # which already has the keyword options
+    keyword_inputs = ["sample", "embeddings"] if keyword_method == "keybert" else ["sample", "topics"] + lemma_inputs
+    keyword_params = {"keyword_method": keyword_method, "n_keywords": n_keywords}
+    if keyword_method == "keybert":
+        keyword_params.update(embedding, **keyword_options)
+    pipeline.add_stage(Stage(
+        "keywords",
+        functools.partial(run_keywords, model=model, batch_size=batch_size),
+        load_keywords,
+        inputs=keyword_inputs,
+        params=keyword_params
+    ))
+    neighbor_inputs = []
+    if graph_neighbors > 0:
+        pipeline.add_stage(Stage(
+            "neighbors",
+            functools.partial(run_neighbors, batch_size=batch_size),
+            load_neighbors,
+            inputs=["embeddings"],
+            params={"graph_neighbors": graph_neighbors}
+        ))
+        neighbor_inputs = ["neighbors"]
+    pipeline.add_stage(Stage(
+        "export",
+        functools.partial(run_export, num_proc=num_proc, batch_size=batch_size),
+        load_export,
+        inputs=["sample", "embeddings", "topics", "coordinates", "keywords"] + neighbor_inputs
+    ))
+    pipeline.run()
+
+    # every stage processes all documents of the sample
+    if os.path.exists(os.path.join(pipeline.stage_directory("sample"), "fingerprint.json")):
+        report.set_documents(len(pipeline.output("sample")))
+    report.add_artifact("export", "./export/article_data")
+    report.add_artifact("export", "./export/article_columns.arrow")
+    report.add_artifact("export", "./export/article_embeddings.npy")
+    report.add_artifact("export", "./export/article_neighbors.npz")
+    report.save(seed=seed)
 
 
 if __name__ == "__main__":
@@ -138,6 +522,25 @@ if __name__ == "__main__":
         help="Select only the first n datapoints of the dataset. Set to 0 to use all (Default)",
         default=0
     )
+    parser.add_argument('--sampling',
+        action='store',
+        type=str,
+        help="How the n datapoints of -n are selected. 'reservoir' draws a random " +
+            "sample in a single pass over the source, without saving the complete " +
+            "dataset first. 'shuffle' loads and saves the complete dataset, shuffles " +
+            "it and selects the first n datapoints. Default: reservoir",
+        choices=["reservoir", "shuffle"],
+        default="reservoir"
+    )
+    parser.add_argument('--seed',
+        metavar='SEED',
+        action='store',
+        type=int,
+        help="Seed for the selection of the n datapoints of -n. The same seed and " +
+            "source always select the same datapoints, so a rerun can reuse the " +
+            "cached stages. Default: 0",
+        default=0
+    )
     parser.add_argument('-t', '--topics',
         metavar='t',
         action='store',
@@ -154,6 +557,18 @@ if __name__ == "__main__":
         help="Specifies that k keywords are to be created per document. Default: 5",
         default=5
     )
+    parser.add_argument('--keyword-method',
+        action='store',
+        type=str,
+        help="How the keywords of each document are extracted. 'keybert' compares " +
+            "the embedding of each candidate with the embedding of the document, " +
+            "which gives the best keywords, but is slow. 'tfidf' scores the n-grams " +
+            "of the vocabulary of the topic model by TF-IDF and 'ctfidf' by their " +
+            "c-TF-IDF weight in the topic of the document, both are much faster. " +
+            "Default: keybert",
+        choices=kwe.KEYWORD_METHODS,
+        default="keybert"
+    )
     parser.add_argument('--stop-words',
         action='store',
         metavar='STOP_WORDS',
@@ -209,9 +624,141 @@ if __name__ == "__main__":
     parser.add_argument('-L','--lemmatization',
         action='store_true',
         help="Should lemmatization be applied before the creation of the topic " +
-            "representation. Default: False",
+            "representation. The documents are lemmatized once in --num-proc " +
+            "processes and the lemmas are saved in the stage 'lemmas'. Default: False",
+        default=False
+    )
+    parser.add_argument('--fit-sample',
+        metavar='n',
+        action='store',
+        type=int,
+        help="Fit the topic model and the 2D reduction only on a sample of n documents, " +
+            "stratified by document length, and assign topics and coordinates to " +
+            "the remaining documents in batches. For corpora which are too large to " +
+            "fit on at once. Set to 0 to fit on all documents (Default)",
+        default=0
+    )
+    parser.add_argument('--batch-size',
+        metavar='n',
+        action='store',
+        type=int,
+        help="Number of documents which are embedded and assigned at once with " +
+            "--fit-sample. Default: 10000",
+        default=10000
+    )
+    parser.add_argument('--layout',
+        action='store',
+        type=str,
+        help="How the 2D coordinates of the documents for the cluster plot are " +
+            "computed. 'umap' fits a separate UMAP model. 'pca' projects the embeddings " +
+            "onto their first two principal components, which is much faster. " +
+            "'svd+umap' runs a low memory, multithreaded UMAP on SVD reduced " +
+            "embeddings initialized with the SVD. 'reuse' lets BERTopic cluster " +
+            "in two dimensions and reuses its reduction. Default: umap",
+        choices=lt.LAYOUTS,
+        default="umap"
+    )
+    parser.add_argument('--layout-seed',
+        metavar='SEED',
+        action='store',
+        type=int,
+        help="Seed for a reproducible layout. UMAP only uses a single thread if " +
+            "a seed is given. Default: None",
+        default=None
+    )
+    parser.add_argument('--embedding-backend',
+        action='store',
+        type=str,
+        help="How the sentence embeddings for the topic modeling and the keyword " +
+            "extraction are computed. 'torch' runs the sentence-transformers model " +
+            "in PyTorch. 'onnx' exports the model once to import/onnx, quantizes " +
+            "it to int8 and runs it with ONNX Runtime on all CPU cores. Default: torch",
+        choices=["torch", "onnx"],
+        default="torch"
+    )
+    parser.add_argument('--onnx-check',
+        metavar='n',
+        action='store',
+        type=int,
+        help="With --embedding-backend onnx: compare the embeddings of the first n " +
+            "documents with the fp32 embeddings of the original model and print " +
+            "their cosine similarity. Set to 0 to skip the check. Default: 100",
+        default=100
+    )
+    parser.add_argument('--model-view',
+        action='store',
+        type=str,
+        help="Which part of each document the embedding model, the topic representation " +
+            "and the keyword extraction see. 'full' uses the whole text, 'head' the " +
+            "beginning of it and 'sections' the first paragraph and evenly spaced " +
+            "parts of the following paragraphs, both within the limits of " +
+            "--model-view-chars and --model-view-words. The database always gets " +
+            "the whole text. Default: full",
+        choices=truncation.MODEL_VIEWS,
+        default="full"
+    )
+    parser.add_argument('--model-view-chars',
+        metavar='n',
+        action='store',
+        type=int,
+        help="Maximal number of characters of the model view. Set to 0 for no " +
+            "limit. Default: 5000",
+        default=5000
+    )
+    parser.add_argument('--model-view-words',
+        metavar='n',
+        action='store',
+        type=int,
+        help="Maximal number of whitespace separated words of the model view. " +
+            "This approximates the token limit of the embedding model (512 tokens " +
+            "by default), which is not counted exactly: a word is one or more " +
+            "tokens, so choose a limit below the token limit, e.g. 350 for 512 " +
+            "tokens of English text. Set to 0 for no limit (Default)",
+        default=0
+    )
+    parser.add_argument('--from-stage',
+        action='store',
+        type=str,
+        help="Run the pipeline from this stage on, even if the saved outputs of " +
+            "the stage and the following ones are up to date. The saved outputs of " +
+            "the stages before are used as they are. Without it, only the stages " +
+            "whose parameters or inputs changed since the last run are run. " +
+            "The outputs of the stages are saved in export/stages. Default: None",
+        choices=STAGES,
+        default=None
+    )
+    parser.add_argument('--until-stage',
+        action='store',
+        type=str,
+        help="Stop the pipeline after this stage. Default: None (run all stages)",
+        choices=STAGES,
+        default=None
+    )
+    parser.add_argument('--graph-neighbors',
+        metavar='k',
+        action='store',
+        type=int,
+        help="Number of nearest neighbors of each document in the similarity graph " +
+            "the web app suggests tags with. The graph is exact for up to 50000 " +
+            "documents and approximate (NN-descent) for more. Set to 0 to not " +
+            "compute it. Default: 15",
+        default=15
+    )
+    parser.add_argument('--profile',
+        action='store_true',
+        help="Write a cProfile dump of each stage that runs to export/profiles. " +
+            "The run report with the time, memory and throughput of each stage " +
+            "is always written to export/run_report.json. Default: False",
         default=False
     )
+    parser.add_argument('--num-proc',
+        metavar='n',
+        action='store',
+        type=int,
+        help="Number of processes used to lemmatize the documents and to add the " +
+            "new columns to the dataset. Default: None (a single process)",
+        default=None
+    )
 
     args = parser.parse_args()
     stop_words = args.stop_words
@@ -222,4 +769,4 @@ if __name__ == "__main__":
     if args.language != 'english':
         model = 'paraphrase-multilingual-MiniLM-L12-v2'
     
-    main(args.wikipedia, args.json, args.paperless, args.number_data_points, args.topics, args.keywords, stop_words, args.min, args.max, args.language, model)
+    main(args.wikipedia, args.json, args.paperless, args.number_data_points, args.topics, args.keywords, stop_words, args.min, args.max, args.language, model, args.num_proc, args.sampling, args.seed, args.lemmatization, args.fit_sample, args.batch_size, args.layout, args.layout_seed, args.embedding_backend, args.onnx_check, args.model_view, args.model_view_chars, args.model_view_words, args.from_stage, args.until_stage, args.keyword_method, args.profile, args.graph_neighbors)
@@ -1,5 +1,15 @@
 #!/usr/bin/env python3
+import time
+import numpy as np
+import pyarrow as pa
+from datasets import Features
 from keybert import KeyBERT
+from sklearn.preprocessing import normalize
+
+
+KEYWORD_METHODS = ("keybert", "tfidf", "ctfidf")
+# type of the 'keywords' column, with the fields sorted like datasets infers them from dicts
+KEYWORDS_TYPE = pa.list_(pa.struct([("similarity", pa.float64()), ("word", pa.string())]))
 
 
 class KeywordExtractor:
@@ -7,11 +17,15 @@ class KeywordExtractor:
     Uses keyBERT to extract a list of Keywords for a given Document.
     """
 
-    def __init__(self, documents:list, n_keywords: int, stop_words=None, min_length_of_keywords: int = 1, max_length_of_keywords: int = 1, model:str=None):
+    def __init__(self, documents:list, n_keywords: int, stop_words=None, min_length_of_keywords: int = 1, max_length_of_keywords: int = 1, model:str=None, doc_embeddings: np.ndarray = None):
         """
         @param stop_words: list of strings of stop words or known string w.g. 'english'
         @param int min_length_of_keywords: minimal number of words for a keyword
         @param int max_length_of_keywords: maximal number of words for a keyword
+        @param model: embedding backend or name of a sentence-transformers model.
+            Default: None (the default model of KeyBERT)
+        @param np.ndarray doc_embeddings: embeddings of the documents by the same
+            model, so KeyBERT doesn't embed them again. Default: None
         """
         self.kw_model = None
         if model is None:
@@ -23,8 +37,15 @@ class KeywordExtractor:
         self.stop_words = stop_words
         self.min_length_of_keywords = min_length_of_keywords
         self.max_length_of_keywords = max_length_of_keywords
+        self.doc_embeddings = np.asarray(doc_embeddings) if doc_embeddings is not None else None
         self.keywords_per_document = self.get_keywords(documents)
 
+        # flat arrays of all keywords, the keywords of document i are
+        # words[offsets[i]:offsets[i + 1]]
+        self.offsets = np.cumsum([0] + [len(keywords) for keywords in self.keywords_per_document])
+        self.words = np.array([keyword["word"] for keywords in self.keywords_per_document for keyword in keywords], dtype=object)
+        self.similarities = np.array([keyword["similarity"] for keywords in self.keywords_per_document for keyword in keywords], dtype=np.float64)
+
     def get_keywords(self, documents: list) -> list:
         """
         Generates keywords from 'article' and returns a list of dictionaries of the
@@ -40,7 +61,8 @@ class KeywordExtractor:
             keyphrase_ngram_range=(
                 self.min_length_of_keywords, self.max_length_of_keywords),
                 stop_words=self.stop_words,
-                top_n=self.n_keywords
+                top_n=self.n_keywords,
+                doc_embeddings=self.doc_embeddings
         )
 
         # Convert list of tuples to list of dictionaries
@@ -49,17 +71,152 @@ class KeywordExtractor:
 
         return keyword_dicts
 
-    def add_keywords(self, document: dict, idx) -> dict:
+
+class VocabularyKeywordExtractor:
+    """
+    Extracts keywords by a sparse TF-IDF scoring of the n-grams of the fitted
+    vocabulary of the topic model, without embedding them.
+    With 'tfidf' each n-gram of a document is weighted by its inverse document
+    frequency in the corpus, with 'ctfidf' by its c-TF-IDF weight in the topic
+    of the document. The similarity of a keyword is its weight in the L2
+    normalized score vector of the document.
+    Provides offsets, words and similarities like KeywordExtractor.
+    """
+
+    def __init__(self, documents, n_keywords: int, vectorizer, method: str = "tfidf", topic_ids: np.ndarray = None, c_tf_idf=None, topic_offset: int = 0, batch_size: int = 10000):
         """
-        Adds a new column with a list of keywords to the dataset.
-        @param dict document: a row from the dataset to which the keywords should be added
-        @return dict
+        @param documents: list or column of a dataset with the documents
+        @param int n_keywords: number of keywords per document
+        @param vectorizer: the fitted CountVectorizer of the topic model
+        @param str method: 'tfidf' or 'ctfidf'
+        @param np.ndarray topic_ids: the topic of each document, needed for 'ctfidf'
+        @param c_tf_idf: the sparse c-TF-IDF matrix of the topic model, needed for 'ctfidf'
+        @param int topic_offset: row of topic 0 in c_tf_idf, 1 if there is an outlier topic
+        @param int batch_size: number of documents vectorized at once
         """
-        document["keywords"] = self.keywords_per_document[idx]
-        return document
+        self.n_keywords = n_keywords
+        self.vectorizer = vectorizer
+        feature_names = vectorizer.get_feature_names_out().astype(object)
+
+        idf = None
+        if method == "tfidf":
+            idf = self.inverse_document_frequencies(documents, batch_size)
+
+        counts, words, similarities = [], [], []
+        start_time = time.perf_counter()
+        for start in range(0, len(documents), batch_size):
+            term_counts = vectorizer.transform(documents[start:start + batch_size])
+            if method == "tfidf":
+                scores = term_counts.multiply(idf).tocsr()
+            else:
+                rows = np.asarray(topic_ids[start:start + batch_size]) + topic_offset
+                scores = term_counts.multiply(c_tf_idf[rows]).tocsr()
+            batch_counts, batch_indices, batch_similarities = top_k_per_row(normalize(scores), n_keywords)
+            counts.append(batch_counts)
+            words.append(feature_names[batch_indices])
+            similarities.append(batch_similarities)
+
+            done = min(start + batch_size, len(documents))
+            elapsed = time.perf_counter() - start_time
+            print(f"### Keyword extraction:  Scored {done}/{len(documents)} Documents ({done / elapsed:.0f} docs/s)")
 
+        self.offsets = np.cumsum([0] + [count for batch_counts in counts for count in batch_counts.tolist()])
+        self.words = np.concatenate(words) if words else np.array([], dtype=object)
+        self.similarities = np.concatenate(similarities).astype(np.float64) if similarities else np.array([], dtype=np.float64)
+
+    def inverse_document_frequencies(self, documents, batch_size: int) -> np.ndarray:
+        """
+        Computes the smoothed inverse document frequency of each n-gram of the
+        vocabulary like sklearn's TfidfTransformer.
+        @return np.ndarray
+        """
+        document_frequencies = np.zeros(len(self.vectorizer.vocabulary_), dtype=np.int64)
+        for start in range(0, len(documents), batch_size):
+            term_counts = self.vectorizer.transform(documents[start:start + batch_size])
+            document_frequencies += np.bincount(term_counts.indices, minlength=len(document_frequencies))
+        return np.log((1 + len(documents)) / (1 + document_frequencies)) + 1
 
-def main(dataset: 'dataset', n_keywords: int, stop_words=None, min_length_of_keywords: int = 1, max_length_of_keywords: int = 1, model:str=None) -> 'dataset':
+
+def top_k_per_row(matrix, k: int) -> tuple:
+    """
+    Selects the k largest entries of each row of a sparse matrix, sorted in
+    descending order within each row.
+    @param matrix: a sparse matrix
+    @param int k: maximal number of entries per row
+    @return tuple(np.ndarray, np.ndarray, np.ndarray): the number of selected
+        entries of each row and the column indices and values of all selected entries
+    """
+    matrix = matrix.tocsr()
+    matrix.eliminate_zeros()
+    row_lengths = np.diff(matrix.indptr)
+    rows = np.repeat(np.arange(matrix.shape[0]), row_lengths)
+    # sorted by row and descending value, the rank of an entry is its distance
+    # to the start of its row
+    order = np.lexsort((-matrix.data, rows))
+    rank = np.arange(len(order)) - matrix.indptr[rows[order]]
+    selected = order[rank < k]
+    return np.minimum(row_lengths, k), matrix.indices[selected], matrix.data[selected]
+
+
+def add_keywords(documents: pa.Table, indices: list, offsets: np.ndarray, words: np.ndarray, similarities: np.ndarray) -> dict:
+    """
+    Batched Dataset.map function which adds a new column with a list of keywords
+    to the dataset. The column is built as an Arrow list array from slices of
+    the arrays, without a Python object per keyword, so the dataset is mapped
+    in the "arrow" format.
+    @param pa.Table documents: a batch of rows from the dataset
+    @param list indices: the indices of the rows in the dataset
+    @param np.ndarray offsets: the keywords of document i are at offsets[i]:offsets[i + 1]
+    @param np.ndarray words: the keywords of all documents
+    @param np.ndarray similarities: the similarity of each keyword to its document
+    @return pa.Table
+    """
+    indices = np.asarray(indices)
+    starts = offsets[indices]
+    lengths = offsets[indices + 1] - starts
+    # positions of the keywords of all rows of the batch without a loop over the rows
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    values = pa.StructArray.from_arrays([
+        pa.array(np.asarray(similarities[positions], dtype=np.float64)),
+        pa.array(words[positions], type=pa.string())
+    ], fields=list(KEYWORDS_TYPE.value_type))
+    list_offsets = pa.array(np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32))
+    return documents.append_column("keywords", pa.ListArray.from_arrays(list_offsets, values))
+
+
+def main(dataset: 'dataset', n_keywords: int, stop_words=None, min_length_of_keywords: int = 1, max_length_of_keywords: int = 1, model:str=None, num_proc: int = None, text_column: str = "article_text", doc_embeddings: np.ndarray = None) -> 'dataset':
     print("### Keyword extraction:  Adding 'keywords' column to Dataset")
-    keyword_extractor = KeywordExtractor(dataset['article_text'], n_keywords, stop_words, min_length_of_keywords, max_length_of_keywords, model)
-    return dataset.map(keyword_extractor.add_keywords, with_indices=True)
+    keyword_extractor = KeywordExtractor(dataset[text_column], n_keywords, stop_words, min_length_of_keywords, max_length_of_keywords, model, doc_embeddings)
+    return add_keyword_column(dataset, keyword_extractor.offsets, keyword_extractor.words, keyword_extractor.similarities, num_proc)
+
+
+def add_keyword_column(dataset: 'dataset', offsets: np.ndarray, words: np.ndarray, similarities: np.ndarray, num_proc: int = None) -> 'dataset':
+    """
+    Adds the column 'keywords' to the dataset.
+    @param dataset: the dataset of documents
+    @param np.ndarray offsets: the keywords of document i are at offsets[i]:offsets[i + 1]
+    @param np.ndarray words: the keywords of all documents
+    @param np.ndarray similarities: the similarity of each keyword to its document
+    @param int num_proc: number of processes used to add the column
+    @return 'dataset'
+    """
+    start = time.perf_counter()
+    features = dataset.features.copy()
+    features.update(Features.from_arrow_schema(pa.schema({"keywords": KEYWORDS_TYPE})))
+    updated_dataset = dataset.with_format("arrow").map(
+        add_keywords,
+        with_indices=True,
+        batched=True,
+        batch_size=10000,
+        num_proc=num_proc,
+        features=features,
+        fn_kwargs={
+            "offsets": offsets,
+            "words": words,
+            "similarities": similarities
+        }
+    )
+    updated_dataset = updated_dataset.with_format(None)
+    elapsed = time.perf_counter() - start
+    print(f"### Keyword extraction:  Added 'keywords' column to {len(updated_dataset)} rows ({len(updated_dataset) / elapsed:.0f} rows/s)")
+    return updated_dataset
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import numpy as np
+from umap import UMAP
+from sklearn.decomposition import PCA, TruncatedSVD
+from sklearn.preprocessing import normalize
+
+
+LAYOUTS = ("umap", "pca", "svd+umap", "reuse")
+
+
+class PCALayout:
+    """
+    Projects the L2 normalized embeddings onto their first two principal
+    components. Linear, deterministic and fast, but clusters overlap more than
+    in a UMAP layout.
+    """
+
+    def __init__(self, seed: int = None):
+        self.pca = PCA(n_components=2, random_state=seed)
+
+    def fit_transform(self, embeddings: np.ndarray) -> np.ndarray:
+        return self.pca.fit_transform(normalize(embeddings))
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        return self.pca.transform(normalize(embeddings))
+
+
+class SVDUMAPLayout:
+    """
+    Reduces the embeddings with a truncated SVD to n_components dimensions and
+    runs UMAP on the result, initialized with the first two SVD components.
+    The SVD makes the nearest neighbor search of UMAP cheaper and the spectral
+    initialization of UMAP is not needed anymore.
+    """
+
+    def __init__(self, n_components: int = 50, seed: int = None, n_jobs: int = -1):
+        """
+        @param int n_components: number of dimensions after the SVD
+        @param int seed: seed for SVD and UMAP. A seed makes UMAP deterministic,
+            but UMAP then only uses a single thread
+        @param int n_jobs: number of threads used by UMAP without a seed
+        """
+        self.svd = TruncatedSVD(n_components=n_components, random_state=seed)
+        self.seed = seed
+        self.n_jobs = n_jobs
+        self.umap_model = None
+
+    def fit_transform(self, embeddings: np.ndarray) -> np.ndarray:
+        reduced = self.svd.fit_transform(normalize(embeddings))
+        # scale the initialization to the range UMAP uses for its own
+        init = reduced[:, :2] - reduced[:, :2].mean(axis=0)
+        init = 10 * init / np.abs(init).max()
+        self.umap_model = UMAP(n_neighbors=15, n_components=2, min_dist=0.0, metric='cosine',
+                               init=init, low_memory=True, n_jobs=self.n_jobs, random_state=self.seed)
+        return self.umap_model.fit_transform(reduced)
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        return self.umap_model.transform(self.svd.transform(normalize(embeddings)))
+
+
+class ReuseLayout:
+    """
+    Reuses the UMAP model BERTopic fits for the clustering as layout. BERTopic
+    has to be given a two dimensional UMAP model for this, which saves the
+    second UMAP fit at the price of clustering in two instead of five dimensions.
+    """
+
+    def __init__(self, umap_model: UMAP):
+        """
+        @param UMAP umap_model: the umap_model of BERTopic, before it is fitted
+        """
+        self.umap_model = umap_model
+
+    def fit_transform(self, embeddings: np.ndarray) -> np.ndarray:
+        # fitted by BERTopic.fit_transform on the same embeddings
+        return self.umap_model.embedding_
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        return self.umap_model.transform(embeddings)
+
+
+def create_layout(layout: str, seed: int = None, topic_umap_model: UMAP = None):
+    """
+    Creates the model which computes the 2D coordinates of the documents. All
+    models provide fit_transform(embeddings) and transform(embeddings).
+    @param str layout: one of LAYOUTS
+    @param int seed: seed for a reproducible layout
+    @param UMAP topic_umap_model: the two dimensional UMAP model of BERTopic,
+        needed for the layout 'reuse'
+    """
+    if layout == "umap":
+        return UMAP(n_neighbors=15, n_components=2, min_dist=0.0, metric='cosine', random_state=seed)
+    elif layout == "pca":
+        return PCALayout(seed)
+    elif layout == "svd+umap":
+        return SVDUMAPLayout(seed=seed)
+    elif layout == "reuse":
+        return ReuseLayout(topic_umap_model)
+    raise ValueError(f"Unknown layout '{layout}', expected one of {', '.join(LAYOUTS)}")
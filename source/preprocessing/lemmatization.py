@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import functools
+import time
+from nltk import word_tokenize
+from nltk.stem import WordNetLemmatizer
+
+
+# number of distinct word forms whose lemma is kept per process
+CACHE_SIZE = 2**18
+# the tokens in the column 'lemmas' are separated by a space
+LEMMA_TOKEN_PATTERN = r"\S+"
+
+_wordnet_lemmatizer = None
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def lemmatize(token: str) -> str:
+    """
+    Returns the WordNet lemma of a token. Word forms repeat a lot, so the lemmas
+    are memoized in a bounded cache of each process.
+    @param str token
+    @return str
+    """
+    global _wordnet_lemmatizer
+    if _wordnet_lemmatizer is None:
+        _wordnet_lemmatizer = WordNetLemmatizer()
+    return _wordnet_lemmatizer.lemmatize(token)
+
+
+def lemmatize_document(document: str) -> list:
+    """
+    Tokenizes a document with NLTK and returns the lemma of each token.
+    @param str document
+    @return list
+    """
+    return [lemmatize(token) for token in word_tokenize(document)]
+
+
+class LemmaTokenizer:
+    """
+    Tokenizer for a CountVectorizer which lemmatizes each token.
+    """
+
+    def __call__(self, document: str) -> list:
+        return lemmatize_document(document)
+
+
+def add_lemmas(documents: dict, text_column: str = "article_text") -> dict:
+    """
+    Batched Dataset.map function which adds the column 'lemmas', the lowercased
+    and lemmatized tokens of each document separated by a space. A CountVectorizer
+    with token_pattern=LEMMA_TOKEN_PATTERN and lowercase=False gets the same
+    tokens from it as with a LemmaTokenizer from the document.
+    @param dict documents: a batch of rows from the dataset
+    @param str text_column: the column with the texts to lemmatize
+    @return dict
+    """
+    lemmas = [lemmatize_document(document.lower()) for document in documents[text_column]]
+    return {"lemmas": [" ".join(tokens) for tokens in lemmas],
+            "n_lemmas": [len(tokens) for tokens in lemmas]}
+
+
+def lemmatize_dataset(dataset: 'dataset', text_column: str = "article_text", num_proc: int = None) -> 'dataset':
+    """
+    Lemmatizes all documents of the dataset in num_proc processes.
+    @param dataset: the dataset of documents
+    @param str text_column: the column with the texts to lemmatize
+    @param int num_proc: number of processes
+    @return 'dataset': a dataset with only the column 'lemmas'
+    """
+    print(f"### Lemmatization:  Lemmatizing {len(dataset)} Documents...")
+    start = time.perf_counter()
+    lemmatized = dataset.map(
+        add_lemmas,
+        batched=True,
+        batch_size=1000,
+        num_proc=num_proc,
+        remove_columns=dataset.column_names,
+        fn_kwargs={"text_column": text_column}
+    )
+    elapsed = time.perf_counter() - start
+
+    n_lemmas = sum(lemmatized["n_lemmas"])
+    statistics = f"{len(dataset) / elapsed:.0f} docs/s, {n_lemmas / elapsed:.0f} tokens/s"
+    if num_proc is None or num_proc <= 1:
+        cache_info = lemmatize.cache_info()
+        if cache_info.hits + cache_info.misses > 0:
+            statistics += f", {cache_info.hits / (cache_info.hits + cache_info.misses):.1%} lemma cache hits"
+    print(f"### Lemmatization:  Lemmatized {n_lemmas} tokens in {elapsed:.1f}s ({statistics})")
+
+    return lemmatized.remove_columns("n_lemmas")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import time
+import numpy as np
+
+
+# corpora with more documents get an approximate graph from NN-descent
+EXACT_THRESHOLD = 50000
+# bytes of a block of the exact graph: the float32 scores and the int64 positions of np.argpartition
+EXACT_BLOCK_BUDGET = 2**28
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Returns the L2-normalized embeddings as float32.
+    @param np.ndarray embeddings
+    @return np.ndarray
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), np.finfo(np.float32).tiny)
+
+
+def exact_knn_graph(embeddings: np.ndarray, k: int, batch_size: int = 10000, memory_budget: int = EXACT_BLOCK_BUDGET) -> tuple:
+    """
+    Computes the k nearest neighbors of each document by cosine similarity with
+    a blocked matrix product of the normalized embeddings. A block scores its
+    documents against all documents, so it has as many rows as fit into the
+    memory budget.
+    @param np.ndarray embeddings
+    @param int k: number of neighbors of each document
+    @param int batch_size: maximal number of documents whose neighbors are computed at once
+    @param int memory_budget: maximal bytes of the scores of a block and their positions
+    @return tuple: the neighbor indices (n, k) and their similarities (n, k)
+    """
+    normalized = normalize(embeddings)
+    n = len(normalized)
+    batch_size = max(1, min(batch_size, memory_budget // (12 * n)))
+    indices = np.empty((n, k), dtype=np.int32)
+    similarities = np.empty((n, k), dtype=np.float32)
+    for start in range(0, n, batch_size):
+        scores = normalized[start:start + batch_size] @ normalized.T
+        rows = np.arange(len(scores))
+        # a document is not its own neighbor
+        scores[rows, rows + start] = -np.inf
+        # the k highest scores are at the end of the partition, without a negated copy of the block
+        top = np.argpartition(scores, min(n - k, n - 1), axis=1)[:, n - k:]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        indices[start:start + batch_size] = np.take_along_axis(top, order, axis=1)
+        similarities[start:start + batch_size] = np.take_along_axis(top_scores, order, axis=1)
+    return indices, similarities
+
+
+def approximate_knn_graph(embeddings: np.ndarray, k: int, seed: int = None) -> tuple:
+    """
+    Computes the approximate k nearest neighbors of each document by cosine
+    similarity with NN-descent (pynndescent, which is installed with UMAP).
+    @param np.ndarray embeddings
+    @param int k: number of neighbors of each document
+    @param int seed: seed of NN-descent
+    @return tuple: the neighbor indices (n, k) and their similarities (n, k)
+    """
+    from pynndescent import NNDescent
+
+    index = NNDescent(normalize(embeddings), n_neighbors=k + 1, metric="dot", random_state=seed,
+                      low_memory=True, compressed=True)
+    neighbors, distances = index.neighbor_graph
+    # drop each document from its own neighbors
+    not_self = neighbors != np.arange(len(neighbors))[:, None]
+    order = np.argsort(~not_self, axis=1, kind="stable")[:, :k]
+    indices = np.take_along_axis(neighbors, order, axis=1).astype(np.int32)
+    # the dot 'distance' of pynndescent is 1 - the inner product
+    similarities = (1 - np.take_along_axis(distances, order, axis=1)).astype(np.float32)
+    return indices, similarities
+
+
+def knn_graph(embeddings: np.ndarray, k: int, batch_size: int = 10000, seed: int = None) -> tuple:
+    """
+    Computes the k nearest neighbor graph of the documents, exactly for up to
+    EXACT_THRESHOLD documents and approximately for more.
+    @param np.ndarray embeddings
+    @param int k: number of neighbors of each document
+    @param int batch_size: number of documents whose neighbors are computed at once
+    @param int seed: seed of the approximate graph
+    @return tuple: the neighbor indices (n, k) and their similarities (n, k)
+    """
+    k = min(k, len(embeddings) - 1)
+    exact = len(embeddings) <= EXACT_THRESHOLD
+    print(f"### Neighbors:  Computing the {'exact' if exact else 'approximate'} {k} nearest neighbors " +
+          f"of {len(embeddings)} Documents...")
+    start = time.perf_counter()
+    if exact:
+        graph = exact_knn_graph(embeddings, k, batch_size)
+    else:
+        graph = approximate_knn_graph(embeddings, k, seed)
+    print(f"### Neighbors:  Done in {time.perf_counter() - start:.1f}s")
+    return graph
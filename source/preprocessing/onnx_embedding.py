@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+import json
+import os
+import numpy as np
+import onnxruntime as ort
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from transformers import AutoTokenizer
+from bertopic.backend import BaseEmbedder as BERTopicBaseEmbedder
+from keybert.backend import BaseEmbedder as KeyBERTBaseEmbedder
+
+
+# the model BERTopic and KeyBERT use for english documents
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+
+
+def export_model(model_name: str, cache_dir: str = "./import/onnx") -> str:
+    """
+    Exports the transformer of a sentence-transformers model to ONNX and quantizes
+    its weights to int8. The exported model, its tokenizer and the pooling
+    configuration are cached in cache_dir, so the export only runs once per model.
+    @param str model_name: name of the sentence-transformers model
+    @param str cache_dir: directory in which the exported models are cached
+    @return str: the directory of the exported model
+    """
+    directory = os.path.join(cache_dir, model_name.replace("/", "__"))
+    if os.path.exists(os.path.join(directory, "model-int8.onnx")):
+        return directory
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    print(f"### Embedding:  Exporting '{model_name}' to ONNX...")
+    os.makedirs(directory, exist_ok=True)
+    sentence_transformer = SentenceTransformer(model_name, device="cpu")
+    transformer = sentence_transformer[0]
+    pooling = next(module for module in sentence_transformer if isinstance(module, Pooling))
+
+    dummy_input = transformer.tokenizer(["An example sentence"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy_input]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    transformer.auto_model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer.auto_model,
+            tuple(dummy_input[name] for name in input_names),
+            os.path.join(directory, "model.onnx"),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14
+        )
+
+    print(f"### Embedding:  Quantizing '{model_name}' to int8...")
+    quantize_dynamic(os.path.join(directory, "model.onnx"), os.path.join(directory, "model-int8.onnx"),
+                     weight_type=QuantType.QInt8)
+    os.remove(os.path.join(directory, "model.onnx"))
+
+    transformer.tokenizer.save_pretrained(directory)
+    with open(os.path.join(directory, "pooling.json"), "w") as f:
+        json.dump({
+            "mode": "cls" if pooling.pooling_mode_cls_token else "mean",
+            "normalize": any(isinstance(module, Normalize) for module in sentence_transformer),
+            "max_seq_length": sentence_transformer.max_seq_length
+        }, f)
+
+    return directory
+
+
+class OnnxSentenceEncoder:
+    """
+    Embeds documents with a quantized ONNX export of a sentence-transformers model
+    on the CPU with ONNX Runtime.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str = "./import/onnx", batch_size: int = 64, threads: int = None):
+        """
+        @param str model_name: name of the sentence-transformers model
+        @param str cache_dir: directory in which the exported models are cached
+        @param int batch_size: number of documents embedded at once
+        @param int threads: number of threads used by ONNX Runtime. Default: all cores
+        """
+        directory = export_model(model_name, cache_dir)
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        with open(os.path.join(directory, "pooling.json"), "r") as f:
+            self.pooling = json.load(f)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads if threads is not None else os.cpu_count()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(os.path.join(directory, "model-int8.onnx"), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def encode(self, documents: list, verbose: bool = False) -> np.ndarray:
+        """
+        Embeds the documents in batches. The documents are sorted by length
+        before batching, so that little padding is needed.
+        @param list documents: list of strings
+        @param bool verbose: print the progress
+        @return np.ndarray: one embedding per document, in the order of documents
+        """
+        order = np.argsort([-len(document) for document in documents], kind="stable")
+        embeddings = None
+        for start in range(0, len(documents), self.batch_size):
+            batch = [documents[i] for i in order[start:start + self.batch_size]]
+            tokens = self.tokenizer(batch, padding=True, truncation=True,
+                                    max_length=self.pooling["max_seq_length"], return_tensors="np")
+            hidden = self.session.run(["last_hidden_state"], {name: tokens[name] for name in self.input_names})[0]
+
+            if self.pooling["mode"] == "cls":
+                batch_embeddings = hidden[:, 0]
+            else:
+                mask = tokens["attention_mask"][..., None].astype(hidden.dtype)
+                batch_embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.pooling["normalize"]:
+                batch_embeddings /= np.linalg.norm(batch_embeddings, axis=1, keepdims=True)
+
+            if embeddings is None:
+                embeddings = np.empty((len(documents), batch_embeddings.shape[1]), dtype=np.float32)
+            embeddings[order[start:start + self.batch_size]] = batch_embeddings
+            if verbose:
+                print(f"### Embedding:  Embedded {min(start + self.batch_size, len(documents))}/{len(documents)} Documents")
+
+        return embeddings
+
+
+class BERTopicBackend(BERTopicBaseEmbedder):
+    """
+    Embedding backend for BERTopic which uses an OnnxSentenceEncoder.
+    """
+
+    def __init__(self, encoder: OnnxSentenceEncoder):
+        super().__init__()
+        self.encoder = encoder
+
+    def embed(self, documents: list, verbose: bool = False) -> np.ndarray:
+        return self.encoder.encode(documents, verbose)
+
+
+class KeyBERTBackend(KeyBERTBaseEmbedder):
+    """
+    Embedding backend for KeyBERT which uses an OnnxSentenceEncoder.
+    """
+
+    def __init__(self, encoder: OnnxSentenceEncoder):
+        super().__init__()
+        self.encoder = encoder
+
+    def embed(self, documents: list, verbose: bool = False) -> np.ndarray:
+        return self.encoder.encode(documents, verbose)
+
+
+def check_accuracy(encoder: OnnxSentenceEncoder, model_name: str, documents: list) -> dict:
+    """
+    Compares the embeddings of the quantized ONNX model with the fp32 embeddings
+    of the original sentence-transformers model by their cosine similarity.
+    @param OnnxSentenceEncoder encoder: the encoder to check
+    @param str model_name: name of the sentence-transformers model
+    @param list documents: the documents to compare the embeddings of
+    @return dict: mean and minimal cosine similarity
+    """
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer(model_name, device="cpu").encode(documents, convert_to_numpy=True)
+    quantized = encoder.encode(documents)
+    similarities = (reference * quantized).sum(axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(quantized, axis=1))
+
+    accuracy = {"mean": float(similarities.mean()), "min": float(similarities.min())}
+    print(f"### Embedding:  Cosine similarity of the int8 ONNX and fp32 embeddings of {len(documents)} " +
+          f"Documents: mean {accuracy['mean']:.4f}, min {accuracy['min']:.4f}")
+    return accuracy
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+
+class Stage:
+    """
+    A step of the preprocessing whose output is saved to its own directory,
+    together with a fingerprint of its parameters and inputs.
+    """
+
+    def __init__(self, name: str, run, load, inputs: list = None, params: dict = None):
+        """
+        @param str name: name of the stage, also the name of its directory
+        @param run: function run(directory, inputs, params) which computes the
+            output of the stage from the loaded outputs of its input stages (a dict
+            by stage name) and writes it to directory
+        @param load: function load(directory) which loads the output of the stage
+        @param list inputs: names of the stages whose output this stage needs
+        @param dict params: all parameters which influence the output of the stage,
+            must be json serializable
+        """
+        self.name = name
+        self.run = run
+        self.load = load
+        self.inputs = inputs if inputs is not None else []
+        self.params = params if params is not None else {}
+
+
+class Pipeline:
+    """
+    Runs a sequence of stages. A stage is skipped if the fingerprint of its
+    parameters and of the outputs of its input stages did not change since its
+    output was saved, so only the stages affected by a change are run again.
+    """
+
+    def __init__(self, directory: str = "./export/stages", from_stage: str = None, until_stage: str = None, report=None):
+        """
+        @param str directory: directory in which the outputs of the stages are saved
+        @param str from_stage: run this and all following stages even if their
+            output is up to date. The saved outputs of the stages before are used
+            as they are. Default: None (run all stages which are not up to date)
+        @param str until_stage: don't run the stages after this one. Default: None
+            (run until the last stage)
+        @param RunReport report: report in which the stages are measured.
+            Default: None
+        """
+        self.directory = directory
+        self.from_stage = from_stage
+        self.until_stage = until_stage
+        self.report = report
+        self.stages = dict()
+        self.fingerprints = dict()
+        self.outputs = dict()
+
+    def add_stage(self, stage: Stage):
+        """
+        Adds a stage to the end of the pipeline. Its inputs must already be added.
+        @param Stage stage
+        """
+        for name in stage.inputs:
+            if name not in self.stages:
+                raise ValueError(f"Stage '{stage.name}' needs stage '{name}' which is not added before it")
+        self.stages[stage.name] = stage
+
+    def stage_directory(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def saved_fingerprint(self, name: str) -> str:
+        """
+        Returns the fingerprint of the saved output of a stage or None if there
+        is no complete output.
+        @param str name: name of the stage
+        @return str
+        """
+        try:
+            with open(os.path.join(self.stage_directory(name), "fingerprint.json"), "r") as f:
+                return json.load(f)["fingerprint"]
+        except (IOError, ValueError, KeyError):
+            return None
+
+    def fingerprint(self, stage: Stage) -> str:
+        """
+        Computes the fingerprint of a stage from its name, its parameters and
+        the fingerprints of its inputs.
+        @param Stage stage
+        @return str
+        """
+        description = {
+            "stage": stage.name,
+            "params": stage.params,
+            "inputs": {name: self.fingerprints[name] for name in stage.inputs}
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def output(self, name: str):
+        """
+        Returns the output of a stage, loaded from its directory on first use.
+        @param str name: name of the stage
+        """
+        if name not in self.outputs:
+            self.outputs[name] = self.stages[name].load(self.stage_directory(name))
+        return self.outputs[name]
+
+    def run(self):
+        """
+        Runs all stages which are not up to date, in the order they were added.
+        """
+        names = list(self.stages)
+        for name in (self.from_stage, self.until_stage):
+            if name is not None and name not in self.stages:
+                sys.exit(f"{sys.argv[0]}: Unknown stage '{name}'. Stages: {', '.join(names)}")
+        forced = set(names[names.index(self.from_stage):]) if self.from_stage is not None else set()
+
+        for name in names:
+            stage = self.stages[name]
+            directory = self.stage_directory(name)
+            saved_fingerprint = self.saved_fingerprint(name)
+
+            if self.from_stage is not None and name not in forced:
+                if saved_fingerprint is None:
+                    sys.exit(f"{sys.argv[0]}: Can't start at stage '{self.from_stage}', " +
+                             f"stage '{name}' has no saved output.")
+                print(f"### Pipeline:  Using saved output of stage '{name}'")
+                self.fingerprints[name] = saved_fingerprint
+                if self.report is not None:
+                    self.report.skip(name)
+            else:
+                fingerprint = self.fingerprint(stage)
+                self.fingerprints[name] = fingerprint
+                if name not in forced and fingerprint == saved_fingerprint:
+                    print(f"### Pipeline:  Stage '{name}' is up to date; Skipping...")
+                    if self.report is not None:
+                        self.report.skip(name)
+                else:
+                    print(f"### Pipeline:  Running stage '{name}'...")
+                    if os.path.exists(directory):
+                        shutil.rmtree(directory)
+                    os.makedirs(directory)
+                    inputs = {input_name: self.output(input_name) for input_name in stage.inputs}
+                    measure = self.report.stage(name) if self.report is not None else contextlib.nullcontext()
+                    with measure:
+                        stage.run(directory, inputs, stage.params)
+                    if self.report is not None:
+                        self.report.add_artifact(name, directory)
+                    self.outputs.pop(name, None)
+                    # written last, so an interrupted stage is never taken as complete
+                    with open(os.path.join(directory, "fingerprint.json"), "w") as f:
+                        json.dump({"fingerprint": fingerprint, "params": stage.params}, f, indent=4, default=str)
+
+            if name == self.until_stage:
+                print(f"### Pipeline:  Stopping after stage '{name}'")
+                break
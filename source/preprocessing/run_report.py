@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+import contextlib
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+from datetime import datetime, timezone
+
+
+def artifact_size(path: str) -> int:
+    """
+    Returns the size of a file or of all files in a directory in bytes.
+    @param str path
+    @return int
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, _, files in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return size
+
+
+def peak_rss() -> dict:
+    """
+    Returns the peak resident set size of this process and of its largest
+    terminated child process in bytes (ru_maxrss is in KiB on Linux). These are
+    high water marks over the lifetime of the process, not of a stage.
+    @return dict
+    """
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    }
+
+
+class RunReport:
+    """
+    Collects the wall and CPU time, the peak memory, the throughput and the
+    sizes of the artifacts of each stage of a run and writes them as a section
+    of a JSON run report. idt-preprocessing.py and create_database.py write
+    their own section of the same report.
+    """
+
+    def __init__(self, section: str, path: str = "./export/run_report.json", profile_dir: str = None):
+        """
+        @param str section: name of the section of the report, e.g. 'preprocessing'
+        @param str path: path of the JSON report
+        @param str profile_dir: directory to which a cProfile dump of each stage
+            is written, None to not profile (Default)
+        """
+        self.section = section
+        self.path = path
+        self.profile_dir = profile_dir
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.start = time.perf_counter()
+        self.stages = dict()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, documents: int = None):
+        """
+        Measures the stage run inside the with block. The yielded dict of the
+        stage can be extended, e.g. with the number of processed 'documents'.
+        @param str name: name of the stage
+        @param int documents: number of documents the stage processes
+        """
+        entry = {"documents": documents}
+        profiler = cProfile.Profile() if self.profile_dir is not None else None
+        start = time.perf_counter()
+        cpu_start = os.times()
+        rss_start = peak_rss()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield entry
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                entry["profile"] = os.path.join(self.profile_dir, f"{self.section}-{name}.prof")
+                profiler.dump_stats(entry["profile"])
+            cpu_end = os.times()
+            entry["wall_time"] = time.perf_counter() - start
+            entry["cpu_time"] = (cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system)
+            # processes of Dataset.map(num_proc=...) count once they terminated
+            entry["children_cpu_time"] = ((cpu_end.children_user - cpu_start.children_user) +
+                                          (cpu_end.children_system - cpu_start.children_system))
+            # a stage can only be measured by how far it raised the high water
+            # mark of the process; a stage below an earlier peak shows 0
+            entry["process_peak_rss"] = peak_rss()
+            entry["peak_rss_increase"] = {kind: entry["process_peak_rss"][kind] - rss_start[kind] for kind in rss_start}
+            self.stages[name] = entry
+            print(f"### Report:  Stage '{name}' took {entry['wall_time']:.1f}s " +
+                  f"(CPU {entry['cpu_time'] + entry['children_cpu_time']:.1f}s, " +
+                  f"raised the peak RSS by {entry['peak_rss_increase']['self'] / 2**20:.0f} MiB " +
+                  f"to {entry['process_peak_rss']['self'] / 2**20:.0f} MiB)")
+
+    def skip(self, name: str):
+        """
+        Records that a stage was skipped.
+        @param str name: name of the stage
+        """
+        self.stages[name] = {"skipped": True}
+
+    def add_artifact(self, stage: str, path: str):
+        """
+        Records the size of a file or directory written by a stage.
+        @param str stage: name of the stage
+        @param str path: path of the file or directory
+        """
+        if stage in self.stages and os.path.exists(path):
+            self.stages[stage].setdefault("artifacts", {})[path] = artifact_size(path)
+
+    def set_documents(self, documents: int):
+        """
+        Sets the number of documents of all stages which ran without one.
+        @param int documents
+        """
+        for entry in self.stages.values():
+            if not entry.get("skipped") and entry.get("documents") is None:
+                entry["documents"] = documents
+
+    def save(self, **details):
+        """
+        Writes the section of this run to the report. The other sections of the
+        report are kept.
+        @param details: additional json serializable values of the section
+        """
+        for entry in self.stages.values():
+            if entry.get("documents") and entry.get("wall_time"):
+                entry["docs_per_second"] = entry["documents"] / entry["wall_time"]
+
+        try:
+            with open(self.path, "r") as f:
+                report = json.load(f)
+        except (IOError, ValueError):
+            report = dict()
+        report[self.section] = dict(details, **{
+            "started_at": self.started_at,
+            "argv": sys.argv,
+            "wall_time": time.perf_counter() - self.start,
+            "peak_rss": peak_rss(),
+            "stages": self.stages
+        })
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"### Report:  Wrote run report to {self.path}")
@@ -1,7 +1,13 @@
 #!/usr/bin/env python3
+import time
+import numpy as np
+import pyarrow as pa
+from datasets import Features
 from bertopic import BERTopic
+from bertopic.backend._utils import select_backend
 from umap import UMAP
 from sklearn.feature_extraction.text import CountVectorizer
+import layout as lt
 
 
 class TopicModeling:
@@ -10,25 +16,38 @@ class TopicModeling:
     Keywords to descripe a Cluster (Topic)
     """
     
-    def __init__(self, dataset: 'dataset', nr_topics: int = None, language: str = 'english', stop_words=None, lemmatization: bool = False, min_length_of_keywords: int = 1, max_length_of_keywords: int = 1):
-        self.articles = dataset['article_text']
-
+    def __init__(self, nr_topics: int = None, language: str = 'english', stop_words=None, lemmatization: bool = False, min_length_of_keywords: int = 1, max_length_of_keywords: int = 1, layout: str = "umap", layout_seed: int = None, embedding_model=None, pre_lemmatized: bool = False):
+        """
+        @param int nr_topics: The number of Topics which should be generated
+        @param str language: The language of the documents
+        @param stop_words: list of strings with stop_words or a known string for built in stop_words e.g. 'english'
+        @param bool lemmatization: should lemmatization be used for the creation of the topic representation
+        @param int min_length_of_keywords: minimal number of words for a keyword in the topic representation
+        @param int max_length_of_keywords: maximal number of words for a keyword in the topic representation
+        @param str layout: how the 2D coordinates are computed, one of layout.LAYOUTS
+        @param int layout_seed: seed for a reproducible layout
+        @param embedding_model: embedding backend or name of a sentence-transformers
+            model. Default: None (the default model of BERTopic for the language)
+        @param bool pre_lemmatized: the documents for the topic representation are
+            already lemmatized by lemmatization.lemmatize_dataset
+        """
         # vectorizer_model to filter out stopwords
         vectorizer_model = CountVectorizer(
             ngram_range=(min_length_of_keywords, max_length_of_keywords),
             stop_words=stop_words
         )
 
-        if lemmatization:
-            from nltk import word_tokenize
-            from nltk.stem import WordNetLemmatizer
-
-            class LemmaTokenizer:
-                def __init__(self):
-                    self.wnl = WordNetLemmatizer()
+        if pre_lemmatized:
+            from lemmatization import LEMMA_TOKEN_PATTERN
 
-                def __call__(self, doc):
-                    return [self.wnl.lemmatize(t) for t in word_tokenize(doc)]
+            vectorizer_model = CountVectorizer(
+                token_pattern=LEMMA_TOKEN_PATTERN,
+                lowercase=False,
+                ngram_range=(min_length_of_keywords, max_length_of_keywords),
+                stop_words=stop_words
+            )
+        elif lemmatization:
+            from lemmatization import LemmaTokenizer
 
             vectorizer_model = CountVectorizer(
                 tokenizer=LemmaTokenizer(),
@@ -36,27 +55,75 @@ class TopicModeling:
                 stop_words=stop_words
             )
 
-        nr_topics = nr_topics if nr_topics > 0 else None
+        nr_topics = nr_topics if nr_topics is not None and nr_topics > 0 else None
+
+        # embed the documents once and hand the embeddings to BERTopic
+        self.embedding_model = select_backend(embedding_model, language)
+
+        # BERTopic's default UMAP model, unless its reduction is reused for the layout
+        topic_umap_model = UMAP(n_neighbors=15, n_components=5, min_dist=0.0, metric='cosine', low_memory=False)
+        if layout == "reuse":
+            topic_umap_model = UMAP(n_neighbors=15, n_components=2, min_dist=0.0, metric='cosine', random_state=layout_seed)
 
         # topic_model
         self.topic_model = BERTopic(
             language=language,
             top_n_words=5,
             calculate_probabilities=False,
+            embedding_model=self.embedding_model,
+            umap_model=topic_umap_model,
             vectorizer_model=vectorizer_model,
             nr_topics=nr_topics,
             verbose=True
         )
+        self.layout_model = lt.create_layout(layout, layout_seed, topic_umap_model)
+        self.topic_label_dict = dict()
+
+    def fit_topics(self, dataset: 'dataset', embeddings: np.ndarray, fit_indices: np.ndarray, text_column: str = "article_text", batch_size: int = 10000) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Fits the topic model to the documents at fit_indices and assigns topics
+        to all other documents in batches with transform. Generates a label for
+        each topic afterwards.
+        @param dataset: the dataset of documents
+        @param np.ndarray embeddings: the embeddings of all documents
+        @param np.ndarray fit_indices: sorted indices of the documents to fit on
+        @param str text_column: the column with the texts for the topic representation
+        @param int batch_size: number of documents transformed at once
+        @return tuple(np.ndarray, np.ndarray): topic id and probability of each document
+        """
+        n_documents = len(dataset)
+        topic_ids = np.empty(n_documents, dtype=np.int64)
+        probabilities = np.empty(n_documents, dtype=np.float64)
+
+        if len(fit_indices) < n_documents:
+            fit_articles = dataset.select(fit_indices)[text_column]
+        else:
+            fit_articles = dataset[text_column]
 
         # Topic Modeling
-        print("### Topic Modeling:  Fitting Model to Data")
-        self.topics, _ = self.topic_model.fit_transform(self.articles)
-        embeddings = self.topic_model._extract_embeddings(
-            self.articles, method="document")
-        self.umap_embeddings = UMAP(
-            n_neighbors=15, n_components=2, min_dist=0.0, metric='cosine').fit_transform(embeddings)
+        print(f"### Topic Modeling:  Fitting Model to {len(fit_indices)} Documents")
+        topics, fit_probabilities = self.topic_model.fit_transform(fit_articles, np.asarray(embeddings[fit_indices]))
+        topic_ids[fit_indices] = topics
+        probabilities[fit_indices] = fit_probabilities
+        del fit_articles
 
-        self.document_info = self.topic_model.get_document_info(self.articles)
+        remaining = np.ones(n_documents, dtype=bool)
+        remaining[fit_indices] = False
+        n_remaining = int(remaining.sum())
+        done = 0
+        start_time = time.perf_counter()
+        for start in range(0, n_documents if n_remaining > 0 else 0, batch_size):
+            indices = np.flatnonzero(remaining[start:start + batch_size]) + start
+            if len(indices) == 0:
+                continue
+            articles = dataset.select(indices)[text_column]
+            topics, batch_probabilities = self.topic_model.transform(articles, np.asarray(embeddings[indices]))
+            topic_ids[indices] = topics
+            probabilities[indices] = batch_probabilities
+
+            done += len(indices)
+            elapsed = time.perf_counter() - start_time
+            print(f"### Topic Modeling:  Assigned {done}/{n_remaining} remaining Documents ({done / elapsed:.0f} docs/s)")
 
         # generate topic labels
         print("### Topic Modeling:  Generating Label for each Topic")
@@ -66,27 +133,164 @@ class TopicModeling:
         self.topic_label_dict = {
             key: value if key != '-1' else 'None' for (key, value) in topic_label_tuples}
 
-    def add_topics(self, article: dict, idx: int) -> dict:
-        """
-        Add a new column with a topic dictionary:
-        {topic_label : <string>, probaility: <float>, x: <float>, y: <float>}
-        """
-        topic = dict()
+        return topic_ids, probabilities
 
-        topic_id = self.document_info['Topic'][idx]
-        topic['topic_name'] = self.topic_label_dict[str(topic_id)]
-        topic['probability'] = self.document_info['Probability'][idx]
 
-        x, y = tuple(self.umap_embeddings[idx])
-        topic['x'] = x
-        topic['y'] = y
+def embed(dataset: 'dataset', embedding_model, text_column: str = "article_text", batch_size: int = 10000) -> np.ndarray:
+    """
+    Embeds all documents of the dataset, read in batches.
+    @param dataset: the dataset of documents
+    @param embedding_model: the BERTopic embedding backend
+    @param str text_column: the column with the texts to embed
+    @param int batch_size: number of documents read and embedded at once
+    @return np.ndarray: one embedding per document
+    """
+    embeddings = None
+    start_time = time.perf_counter()
+    for start in range(0, len(dataset), batch_size):
+        articles = dataset[start:start + batch_size][text_column]
+        batch_embeddings = embedding_model.embed_documents(articles)
+        if embeddings is None:
+            embeddings = np.empty((len(dataset), batch_embeddings.shape[1]), dtype=np.float32)
+        embeddings[start:start + len(articles)] = batch_embeddings
 
-        article['topic'] = topic
+        done = start + len(articles)
+        elapsed = time.perf_counter() - start_time
+        print(f"### Topic Modeling:  Embedded {done}/{len(dataset)} Documents ({done / elapsed:.0f} docs/s)")
+    return embeddings
 
-        return article
 
+def fit_layout(layout_model, embeddings: np.ndarray, fit_indices: np.ndarray, batch_size: int = 10000, layout: str = "umap") -> np.ndarray:
+    """
+    Fits the layout model to the documents at fit_indices and transforms all
+    other documents in batches.
+    With the layout 'reuse' the topic model must be fitted before.
+    @param layout_model: a model created by layout.create_layout
+    @param np.ndarray embeddings: the embeddings of all documents
+    @param np.ndarray fit_indices: sorted indices of the documents to fit on
+    @param int batch_size: number of documents transformed at once
+    @param str layout: name of the layout, for the progress messages
+    @return np.ndarray: the 2D coordinates of each document
+    """
+    coordinates = np.empty((len(embeddings), 2), dtype=np.float32)
 
-def main(dataset: 'dataset', nr_topics: int = 0, language: str = 'english', stop_words=None, lemmatization: bool = False, min_length_of_keywords: int = 1, max_length_of_keywords: int = 1) -> 'dataset':
+    start = time.perf_counter()
+    coordinates[fit_indices] = layout_model.fit_transform(np.asarray(embeddings[fit_indices]))
+    print(f"### Topic Modeling:  Computed '{layout}' layout in {time.perf_counter() - start:.1f}s")
+
+    if len(fit_indices) < len(embeddings):
+        remaining = np.ones(len(embeddings), dtype=bool)
+        remaining[fit_indices] = False
+        start = time.perf_counter()
+        for batch_start in range(0, len(embeddings), batch_size):
+            indices = np.flatnonzero(remaining[batch_start:batch_start + batch_size]) + batch_start
+            if len(indices) > 0:
+                coordinates[indices] = layout_model.transform(np.asarray(embeddings[indices]))
+        print(f"### Topic Modeling:  Transformed remaining Documents into '{layout}' layout in {time.perf_counter() - start:.1f}s")
+
+    return coordinates
+
+
+def select_fit_indices(dataset: 'dataset', fit_sample_size: int = 0, seed: int = None, text_column: str = "article_text", batch_size: int = 10000) -> np.ndarray:
+    """
+    Selects the documents the topic model and the layout are fitted on.
+    @param dataset: the dataset of documents
+    @param int fit_sample_size: number of documents in a sample stratified by
+        document length, 0 to fit on all documents
+    @param int seed: seed for the sample
+    @param str text_column: the column with the texts
+    @param int batch_size: number of documents read at once
+    @return np.ndarray: sorted indices of the documents
+    """
+    if 0 < fit_sample_size < len(dataset):
+        return stratified_sample(document_lengths(dataset, batch_size, text_column), fit_sample_size, seed=seed)
+    return np.arange(len(dataset))
+
+
+def topic_names(topic_ids: np.ndarray, topic_label_dict: dict) -> np.ndarray:
+    """
+    Returns the topic label of each document.
+    @param np.ndarray topic_ids: the topic id of each document
+    @param dict topic_label_dict: the label of each topic id (as string)
+    @return np.ndarray
+    """
+    unique_topic_ids, topic_codes = np.unique(topic_ids, return_inverse=True)
+    topic_labels = np.array([topic_label_dict[str(topic_id)] for topic_id in unique_topic_ids], dtype=object)
+    return topic_labels[topic_codes]
+
+
+def document_lengths(dataset: 'dataset', batch_size: int = 10000, text_column: str = "article_text") -> np.ndarray:
+    """
+    Returns the number of characters of each document, read in batches.
+    @param dataset: the dataset of documents
+    @param int batch_size: number of documents read at once
+    @param str text_column: the column with the texts
+    @return np.ndarray
+    """
+    lengths = np.empty(len(dataset), dtype=np.int64)
+    for start in range(0, len(dataset), batch_size):
+        articles = dataset[start:start + batch_size][text_column]
+        lengths[start:start + len(articles)] = [len(article) for article in articles]
+    return lengths
+
+
+def stratified_sample(lengths: np.ndarray, size: int, strata: int = 10, seed: int = None) -> np.ndarray:
+    """
+    Selects a random sample of size documents, stratified by document length:
+    The documents are divided into strata of equal size by length and each
+    stratum contributes proportionally to the sample, so short and long documents
+    are represented as in the complete corpus.
+    @param np.ndarray lengths: the length of each document
+    @param int size: size of the sample
+    @param int strata: number of length strata
+    @param int seed: seed for the random number generator
+    @return np.ndarray: the sorted indices of the sampled documents
+    """
+    rng = np.random.default_rng(seed)
+    order = np.argsort(lengths, kind="stable")
+    sample = []
+    for stratum in np.array_split(order, strata):
+        # proportional allocation, rounding differences are evened out below
+        n = min(len(stratum), round(size * len(stratum) / len(lengths)))
+        sample.append(rng.choice(stratum, size=n, replace=False))
+    sample = np.concatenate(sample)
+    if len(sample) < size:
+        rest = np.setdiff1d(order, sample, assume_unique=True)
+        sample = np.concatenate([sample, rng.choice(rest, size=size - len(sample), replace=False)])
+    elif len(sample) > size:
+        sample = rng.choice(sample, size=size, replace=False)
+    return np.sort(sample)
+
+
+# type of the 'topic' column, with the fields sorted like datasets infers them from dicts
+TOPIC_TYPE = pa.struct([("probability", pa.float64()), ("topic_name", pa.string()),
+                        ("x", pa.float64()), ("y", pa.float64())])
+
+
+def add_topics(articles: pa.Table, indices: list, topic_names: np.ndarray, probabilities: np.ndarray, coordinates: np.ndarray) -> dict:
+    """
+    Batched Dataset.map function which adds a new column with a topic dictionary:
+    {topic_label : <string>, probaility: <float>, x: <float>, y: <float>}
+    The column is built as an Arrow struct array from the arrays, without a
+    Python object per row, so the dataset is mapped in the "arrow" format.
+    @param pa.Table articles: a batch of rows from the dataset
+    @param list indices: the indices of the rows in the dataset
+    @param np.ndarray topic_names: the topic label of each document
+    @param np.ndarray probabilities: the topic probability of each document
+    @param np.ndarray coordinates: the 2D coordinates of each document
+    @return pa.Table
+    """
+    indices = np.asarray(indices)
+    topic = pa.StructArray.from_arrays([
+        pa.array(np.asarray(probabilities[indices], dtype=np.float64)),
+        pa.array(topic_names[indices], type=pa.string()),
+        pa.array(np.ascontiguousarray(coordinates[indices, 0], dtype=np.float64)),
+        pa.array(np.ascontiguousarray(coordinates[indices, 1], dtype=np.float64))
+    ], fields=list(TOPIC_TYPE))
+    return articles.append_column("topic", topic)
+
+
+def main(dataset: 'dataset', nr_topics: int = 0, language: str = 'english', stop_words=None, lemmatization: bool = False, min_length_of_keywords: int = 1, max_length_of_keywords: int = 1, num_proc: int = None, fit_sample_size: int = 0, batch_size: int = 10000, seed: int = None, layout: str = "umap", layout_seed: int = None, embedding_model=None, text_column: str = "article_text") -> 'dataset':
     """
     Generates Clusters (sets of documents) with similar content, determines the
     topic for each Cluster and adds a column 'topic' to the dataset, with 
@@ -100,11 +304,58 @@ def main(dataset: 'dataset', nr_topics: int = 0, language: str = 'english', stop
     @param bool lemmatization: should lemmatization be used for the creation of the topic representation
     @param int min_length_of_keywords: minimal number of words for a keyword in the topic representation
     @param int max_length_of_keywords: maximal number of words for a keyword in the topic representation
+    @param int num_proc: number of processes used to add the 'topic' column
+    @param int fit_sample_size: number of documents the models are fitted on,
+        0 to fit on all documents
+    @param int batch_size: number of documents embedded and transformed at once
+    @param int seed: seed for the selection of the documents to fit on
+    @param str layout: how the 2D coordinates are computed, one of layout.LAYOUTS
+    @param int layout_seed: seed for a reproducible layout
+    @param embedding_model: embedding backend or name of a sentence-transformers model
+    @param str text_column: the column with the texts the models are applied to
+    @return 'dataset'
+    """
+    topic_modeling = TopicModeling(nr_topics, language, stop_words, lemmatization,
+                                   min_length_of_keywords, max_length_of_keywords,
+                                   layout, layout_seed, embedding_model)
+    embeddings = embed(dataset, topic_modeling.embedding_model, text_column, batch_size)
+    fit_indices = select_fit_indices(dataset, fit_sample_size, seed, text_column, batch_size)
+    topic_ids, probabilities = topic_modeling.fit_topics(dataset, embeddings, fit_indices, text_column, batch_size)
+    coordinates = fit_layout(topic_modeling.layout_model, embeddings, fit_indices, batch_size, layout)
+
+    return add_topic_column(dataset, topic_names(topic_ids, topic_modeling.topic_label_dict),
+                            probabilities, coordinates, num_proc)
+
+
+def add_topic_column(dataset: 'dataset', topic_names: np.ndarray, probabilities: np.ndarray, coordinates: np.ndarray, num_proc: int = None) -> 'dataset':
+    """
+    Adds the column 'topic' to the dataset.
+    @param dataset: the dataset of documents
+    @param np.ndarray topic_names: the topic label of each document
+    @param np.ndarray probabilities: the topic probability of each document
+    @param np.ndarray coordinates: the 2D coordinates of each document
+    @param int num_proc: number of processes used to add the column
     @return 'dataset'
     """
-    topic_modeling = TopicModeling(dataset, nr_topics)
-    # Adds a column 'topic' to the data set
     print("### Topic Modeling:  Adding 'topic' column to Dataset")
-    updated_dataset = dataset.map(topic_modeling.add_topics, with_indices=True)
+    start = time.perf_counter()
+    features = dataset.features.copy()
+    features.update(Features.from_arrow_schema(pa.schema({"topic": TOPIC_TYPE})))
+    updated_dataset = dataset.with_format("arrow").map(
+        add_topics,
+        with_indices=True,
+        batched=True,
+        batch_size=10000,
+        num_proc=num_proc,
+        features=features,
+        fn_kwargs={
+            "topic_names": topic_names,
+            "probabilities": probabilities,
+            "coordinates": coordinates
+        }
+    )
+    updated_dataset = updated_dataset.with_format(None)
+    elapsed = time.perf_counter() - start
+    print(f"### Topic Modeling:  Added 'topic' column to {len(updated_dataset)} rows ({len(updated_dataset) / elapsed:.0f} rows/s)")
 
     return updated_dataset
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# The budgets are counted in characters and whitespace separated words, an
+# approximation of the token limit of the embedding model: the views are built
+# before the model and its tokenizer are loaded.
+import re
+
+
+MODEL_VIEWS = ("full", "head", "sections")
+WORD = re.compile(r"\S+")
+
+
+def head(text: str, max_chars: int = 0, max_words: int = 0) -> str:
+    """
+    Returns the beginning of text with at most max_chars characters and
+    max_words words. The text is only cut at whitespace.
+    @param str text: the text to truncate
+    @param int max_chars: maximal number of characters, 0 for no limit
+    @param int max_words: maximal number of words, 0 for no limit
+    @return str
+    """
+    if max_chars > 0 and len(text) > max_chars:
+        cut = text.rfind(" ", 0, max_chars + 1)
+        text = text[:cut if cut > 0 else max_chars]
+    if max_words > 0:
+        for i, word in enumerate(WORD.finditer(text)):
+            if i == max_words - 1:
+                return text[:word.end()]
+    return text
+
+
+def sample_sections(text: str, max_chars: int = 0, max_words: int = 0, min_section_chars: int = 200, min_section_words: int = 30) -> str:
+    """
+    Returns a view of text within the budget which covers the whole document:
+    Half of the budget goes to the first paragraph, the rest is split evenly
+    between paragraphs taken at equal distances from the remaining ones, each of
+    them truncated to its share.
+    @param str text: the text to truncate
+    @param int max_chars: maximal number of characters, 0 for no limit
+    @param int max_words: maximal number of words, 0 for no limit
+    @param int min_section_chars: minimal share in characters of a sampled paragraph
+    @param int min_section_words: minimal share in words of a sampled paragraph
+    @return str
+    """
+    if (max_chars <= 0 or len(text) <= max_chars) and max_words <= 0:
+        return text
+
+    paragraphs = [paragraph for paragraph in text.split("\n") if paragraph.strip()]
+    if len(paragraphs) <= 1:
+        return head(text, max_chars, max_words)
+
+    # without a character limit the word limit is spread the same way
+    lead = head(paragraphs[0], max_chars // 2, max_words // 2)
+    rest = paragraphs[1:]
+    chars_left = max(0, max_chars - len(lead)) if max_chars > 0 else 0
+    words_left = max(0, max_words - len(WORD.findall(lead))) if max_words > 0 else 0
+
+    n_sections = len(rest)
+    if max_chars > 0:
+        n_sections = min(n_sections, max(1, chars_left // min_section_chars))
+    if max_words > 0:
+        n_sections = min(n_sections, max(1, words_left // min_section_words))
+    step = len(rest) / n_sections
+    sections = [rest[int(i * step)] for i in range(n_sections)]
+    sections = [head(section, chars_left // n_sections, words_left // n_sections) for section in sections]
+    return head("\n".join([lead] + sections), max_chars, max_words)
+
+
+def add_model_text(documents: dict, view: str, max_chars: int = 0, max_words: int = 0) -> dict:
+    """
+    Batched Dataset.map function which adds the column 'model_text', a bounded
+    view of 'article_text' for embedding and keyword candidate extraction.
+    @param dict documents: a batch of rows from the dataset
+    @param str view: 'head' or 'sections'
+    @param int max_chars: maximal number of characters, 0 for no limit
+    @param int max_words: maximal number of words, 0 for no limit
+    @return dict
+    """
+    truncate = head if view == "head" else sample_sections
+    return {"model_text": [truncate(text, max_chars, max_words) for text in documents["article_text"]]}
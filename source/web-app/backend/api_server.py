@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import tornado.web
+from tornado.ioloop import IOLoop
+from tornado.web import GZipContentEncoding
+
+from backend import DocumentClient
+from article_columns import ArticleColumns
+
+
+ARROW_MIME_TYPE = "application/vnd.apache.arrow.stream"
+
+
+class ArrowGZipContentEncoding(GZipContentEncoding):
+    """
+    Compresses the Arrow responses besides the JSON responses.
+    """
+    CONTENT_TYPES = GZipContentEncoding.CONTENT_TYPES | {ARROW_MIME_TYPE}
+
+
+def to_arrow(df: pd.DataFrame) -> bytes:
+    """
+    Serializes a DataFrame as an Arrow IPC stream.
+    @param pd.DataFrame df
+    @return bytes
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def paginate(df: pd.DataFrame, offset: int, limit: int) -> pd.DataFrame:
+    """
+    Returns the rows offset:offset + limit, all rows from offset if limit is None.
+    @param pd.DataFrame df
+    @param int offset
+    @param int limit
+    @return pd.DataFrame
+    """
+    return df.iloc[offset:] if limit is None else df.iloc[offset:offset + limit]
+
+
+class CorpusCache:
+    """
+    Caches the corpus-wide responses (points, keyword and tag counts) of all
+    clients. Each cached value belongs to a version of the corpus: the articles
+    version changes when the number of articles or the columnar export changes,
+    the tags version with every tag mutation through the API and with every
+    write to the article or tag index which became visible, also from the
+    frontend or scripts (by the indexing and refresh counters of
+    Elasticsearch). The versions are checked at most every
+    check_interval seconds. Concurrent requests for the same value wait for a
+    single computation.
+    """
+
+    def __init__(self, document_client: DocumentClient, executor: ThreadPoolExecutor, columns_path: str, check_interval: float = 30):
+        """
+        @param DocumentClient document_client
+        @param ThreadPoolExecutor executor: runs the blocking calls of the document client
+        @param str columns_path: path of the columnar export of the preprocessing
+        @param float check_interval: seconds after which the versions are checked again
+        """
+        self.document_client = document_client
+        self.executor = executor
+        self.columns_path = columns_path
+        self.check_interval = check_interval
+        self.article_columns = None
+        self.versions = {"articles": None, "tags": None}
+        self.tag_mutations = 0
+        self.checked_at = 0
+        self.values = dict()
+
+    async def run(self, function, *args):
+        """
+        Runs a blocking function in the executor.
+        """
+        return await IOLoop.current().run_in_executor(self.executor, function, *args)
+
+    def read_versions(self) -> dict:
+        """
+        Reads the current versions of the articles and the tags.
+        @return dict
+        """
+        article_count = self.document_client.get_article_count()
+        columns_mtime = os.path.getmtime(self.columns_path) if os.path.exists(self.columns_path) else None
+        # every index, update (also by script or update_by_query) and delete counts
+        # as an operation; the refreshes make them visible to searches. Updates
+        # which change nothing are noops and don't count.
+        stats = self.document_client.es_index_client.stats(
+            index=f"{self.document_client.article_db},{self.document_client.tag_db}",
+            metric="indexing,refresh")
+        writes = {name: (index["primaries"]["indexing"]["index_total"], index["primaries"]["indexing"]["delete_total"],
+                         index["primaries"]["refresh"]["total"])
+                  for name, index in sorted(stats["indices"].items())}
+        return {
+            "articles": f"{article_count}-{columns_mtime}",
+            "tags": f"{writes}-{self.tag_mutations}"
+        }
+
+    async def refresh(self, force: bool = False):
+        """
+        Checks the versions and drops the values of outdated versions.
+        @param bool force: check even if the last check is less than check_interval ago
+        """
+        if not force and time.monotonic() - self.checked_at < self.check_interval:
+            return
+        self.checked_at = time.monotonic()
+        versions = await self.run(self.read_versions)
+        if versions["articles"] != self.versions["articles"]:
+            self.article_columns = await self.run(
+                lambda: ArticleColumns.open(self.columns_path, expected_rows=self.document_client.get_article_count()))
+        for kind, version in versions.items():
+            if version != self.versions[kind]:
+                self.values = {key: value for key, value in self.values.items() if key[0] != kind}
+        self.versions = versions
+
+    def tags_changed(self):
+        """
+        Marks the tag responses as outdated after a tag mutation.
+        """
+        self.tag_mutations += 1
+        self.checked_at = 0
+
+    async def get(self, kind: str, name: str, compute) -> tuple:
+        """
+        Returns a cached value and its ETag, computing it once per version.
+        @param str kind: 'articles' or 'tags', the version the value depends on
+        @param str name: name of the value
+        @param compute: blocking function which computes the value
+        @return tuple: the value and its ETag
+        """
+        await self.refresh()
+        key = (kind, name, self.versions[kind])
+        if key not in self.values:
+            self.values[key] = asyncio.ensure_future(self.run(compute))
+        try:
+            value = await self.values[key]
+        except Exception:
+            self.values.pop(key, None)
+            raise
+        etag = hashlib.sha1(f"{name}-{self.versions[kind]}".encode()).hexdigest()
+        return value, f'"{etag}"'
+
+    def points(self) -> pd.DataFrame:
+        """
+        Returns the id, heading, topic_name, probability, x and y of all articles.
+        @return pd.DataFrame
+        """
+        if self.article_columns is not None:
+            return self.article_columns.get_points()
+        df = pd.DataFrame(self.document_client.get_all_articles())
+        return pd.concat([df[["id", "heading"]], pd.DataFrame(list(df["topic"]))], axis=1, join="inner")
+
+    def keyword_counts(self) -> pd.Series:
+        """
+        Returns the number of documents of each keyword, sorted descending.
+        @return pd.Series
+        """
+        if self.article_columns is not None:
+            return self.article_columns.get_keyword_counts()
+        return pd.Series(self.document_client.get_all_keywords(), dtype="object").value_counts()
+
+    def tag_counts(self) -> pd.Series:
+        """
+        Returns the number of documents of each tag, tags without documents included.
+        @return pd.Series
+        """
+        tags = pd.Series(self.document_client.get_all_tags(), dtype="object").value_counts() - 1
+        tag_count = pd.Series(self.document_client.get_all_tags(filter=False), dtype="object").value_counts()
+        return tag_count.add(tags, fill_value=0).astype(int).sort_values(ascending=False)
+
+
+class BaseHandler(tornado.web.RequestHandler):
+
+    def initialize(self, cache: CorpusCache):
+        self.cache = cache
+        self.document_client = cache.document_client
+
+    def get_offset_and_limit(self) -> tuple:
+        offset = int(self.get_query_argument("offset", "0"))
+        limit = self.get_query_argument("limit", None)
+        return offset, None if limit is None else int(limit)
+
+    def get_json_body(self) -> dict:
+        try:
+            return json.loads(self.request.body or b"{}")
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="Body is not valid JSON")
+
+    def not_modified(self, etag: str) -> bool:
+        """
+        Sets the ETag and returns True (with status 304) if the client has this version.
+        """
+        self.set_header("ETag", etag)
+        self.set_header("Cache-Control", "no-cache")
+        if etag in self.request.headers.get("If-None-Match", ""):
+            self.set_status(304)
+            return True
+        return False
+
+    def write_frame(self, df: pd.DataFrame, total: int):
+        """
+        Writes a DataFrame as JSON records or, with ?format=arrow, as an Arrow IPC stream.
+        """
+        self.set_header("X-Total-Count", str(total))
+        if self.get_query_argument("format", "json") == "arrow":
+            self.set_header("Content-Type", ARROW_MIME_TYPE)
+            self.write(to_arrow(df))
+        else:
+            self.set_header("Content-Type", "application/json")
+            self.write(df.to_json(orient="records"))
+
+
+class PointsHandler(BaseHandler):
+    """
+    GET /points?offset=&limit=&format=json|arrow
+    """
+
+    async def get(self):
+        points, etag = await self.cache.get("articles", "points", self.cache.points)
+        if self.not_modified(etag):
+            return
+        offset, limit = self.get_offset_and_limit()
+        self.write_frame(paginate(points, offset, limit), len(points))
+
+
+class CountsHandler(BaseHandler):
+    """
+    GET /counts/keywords and /counts/tags?offset=&limit=&format=json|arrow
+    """
+
+    async def get(self, kind: str):
+        if kind == "keywords":
+            counts, etag = await self.cache.get("articles", "keyword_counts", self.cache.keyword_counts)
+        else:
+            counts, etag = await self.cache.get("tags", "tag_counts", self.cache.tag_counts)
+        if self.not_modified(etag):
+            return
+        offset, limit = self.get_offset_and_limit()
+        df = counts.rename_axis("name").reset_index(name="count")
+        self.write_frame(paginate(df, offset, limit), len(df))
+
+
+class SelectionHandler(BaseHandler):
+    """
+    POST /selection {"ids": [...], "top": 20}
+    Returns the keyword and tag counts of the selected articles.
+    """
+
+    async def post(self):
+        body = self.get_json_body()
+        ids = [str(id) for id in body.get("ids", [])]
+        top = int(body.get("top", 20))
+        await self.cache.refresh()
+        keyword_client = self.cache.article_columns if self.cache.article_columns is not None else self.document_client
+        keywords, tags = await asyncio.gather(
+            self.cache.run(keyword_client.get_keywords_by_ids, ids),
+            self.cache.run(self.document_client.get_tags_by_ids, ids, False)
+        )
+        self.write({
+            "count": len(ids),
+            "keywords": pd.Series(keywords, dtype="object").value_counts().head(top).to_dict(),
+            "tags": pd.Series(tags, dtype="object").value_counts().to_dict()
+        })
+
+
+class TagsHandler(BaseHandler):
+    """
+    GET /tags lists the tags, POST /tags {"name": ..., "description": ...} creates one.
+    """
+
+    async def get(self):
+        tags, etag = await self.cache.get("tags", "tags", self.document_client.get_tag_index)
+        if self.not_modified(etag):
+            return
+        self.write({"tags": [dict(tag, id=tag_id) for tag_id, tag in tags.items()]})
+
+    async def post(self):
+        body = self.get_json_body()
+        if not body.get("name"):
+            raise tornado.web.HTTPError(400, reason="A tag needs a name")
+        tag_id = await self.cache.run(self.document_client.add_new_tag, body["name"], body.get("description", ""))
+        self.cache.tags_changed()
+        if tag_id == "TAG ALREADY EXISTS":
+            raise tornado.web.HTTPError(409, reason=tag_id)
+        self.set_status(201)
+        self.write({"id": tag_id})
+
+
+class TagArticlesHandler(BaseHandler):
+    """
+    POST /tags/<name>/articles {"ids": [...]} adds the tag to the articles,
+    DELETE /tags/<name>/articles {"ids": [...]} removes it.
+    """
+
+    async def post(self, name: str):
+        ids = [str(id) for id in self.get_json_body().get("ids", [])]
+        await self.cache.run(self.document_client.add_tag_to_articles, name, ids)
+        self.cache.tags_changed()
+        self.write({"count": len(ids)})
+
+    async def delete(self, name: str):
+        ids = [str(id) for id in self.get_json_body().get("ids", [])]
+        await self.cache.run(self.document_client.delete_tag_from_articles, name, ids)
+        self.cache.tags_changed()
+        self.write({"count": len(ids)})
+
+
+def make_app(document_client: DocumentClient, columns_path: str, check_interval: float = 30, workers: int = 8) -> tornado.web.Application:
+    """
+    Creates the API application. Responses are gzip compressed if the client
+    accepts it, including the Arrow responses.
+    @param DocumentClient document_client
+    @param str columns_path: path of the columnar export of the preprocessing
+    @param float check_interval: seconds after which the corpus versions are checked again
+    @param int workers: number of threads for the calls to the database
+    @return tornado.web.Application
+    """
+    cache = CorpusCache(document_client, ThreadPoolExecutor(max_workers=workers), columns_path, check_interval)
+    arguments = {"cache": cache}
+    return tornado.web.Application([
+        (r"/points", PointsHandler, arguments),
+        (r"/counts/(keywords|tags)", CountsHandler, arguments),
+        (r"/selection", SelectionHandler, arguments),
+        (r"/tags", TagsHandler, arguments),
+        (r"/tags/([^/]+)/articles", TagArticlesHandler, arguments),
+    ], transforms=[ArrowGZipContentEncoding])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="api_server.py",
+        description="HTTP API for the points, the keyword and tag counts, selection " +
+            "summaries and tag mutations, shared by all frontend processes and scripts."
+    )
+    parser.add_argument('--port',
+        metavar='n',
+        action='store',
+        type=int,
+        help="Port to listen on. Default: 8000",
+        default=8000
+    )
+    parser.add_argument('--columns',
+        metavar='path',
+        action='store',
+        type=str,
+        help="Path of the columnar export of the preprocessing. " +
+            "Default: /data/export/article_columns.arrow",
+        default="/data/export/article_columns.arrow"
+    )
+    parser.add_argument('--check-interval',
+        metavar='s',
+        action='store',
+        type=float,
+        help="Seconds after which the cached responses are checked against the " +
+            "database again. Default: 30",
+        default=30
+    )
+    parser.add_argument('--workers',
+        metavar='n',
+        action='store',
+        type=int,
+        help="Number of threads for the calls to the database. Default: 8",
+        default=8
+    )
+
+    args = parser.parse_args()
+    app = make_app(DocumentClient(), args.columns, args.check_interval, args.workers)
+    app.listen(args.port)
+    print(f"### API:  Listening on port {args.port}")
+    IOLoop.current().start()
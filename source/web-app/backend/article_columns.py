@@ -0,0 +1,125 @@
+import functools
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+class ArticleColumns:
+    """
+    Reads the columnar export of the preprocessing (article_columns.arrow) from a
+    memory map. The numeric columns and the keyword ids are used without copying
+    them, so the cluster plot and the keyword counts don't need to be fetched
+    from Elasticsearch document by document.
+    """
+
+    def __init__(self, path: str = "/data/export/article_columns.arrow"):
+        """
+        @param str path: path of the Arrow IPC file written by idt-preprocessing.py
+        """
+        self.path = path
+        self.table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+        keywords = self.table.column("keywords").combine_chunks()
+        # the keywords of row i are keyword_ids[offsets[i]:offsets[i + 1]]
+        self.keyword_offsets = keywords.offsets.to_numpy()
+        self.keyword_ids = keywords.values.indices.to_numpy()
+        self.keyword_vocabulary = keywords.values.dictionary.to_numpy(zero_copy_only=False)
+
+        ids = self.table.column("id").to_numpy()
+        self.row_order = np.argsort(ids, kind="stable")
+        self.sorted_ids = ids[self.row_order]
+        # built on first use, shared by all users of this instance
+        self.points = None
+        self.keyword_counts = None
+
+    @classmethod
+    def open(cls, path: str = "/data/export/article_columns.arrow", expected_rows: int = None) -> 'ArticleColumns':
+        """
+        Opens the columnar export, if there is one which matches the database.
+        The export is shared by all sessions of the server process until the
+        file or the number of articles changes.
+        @param str path: path of the Arrow IPC file
+        @param int expected_rows: number of articles in the database, None to not check it
+        @return ArticleColumns or None
+        """
+        if not os.path.exists(path):
+            return None
+        return cls.open_version(path, os.path.getmtime(path), expected_rows)
+
+    @classmethod
+    @functools.lru_cache(maxsize=1)
+    def open_version(cls, path: str, mtime: float, expected_rows: int) -> 'ArticleColumns':
+        """
+        Opens a version of the columnar export, see open.
+        @param str path: path of the Arrow IPC file
+        @param float mtime: modification time of the file, part of the cache key
+        @param int expected_rows: number of articles in the database, None to not check it
+        @return ArticleColumns or None
+        """
+        article_columns = cls(path)
+        if expected_rows is not None and article_columns.table.num_rows != expected_rows:
+            print(f"'{path}' has {article_columns.table.num_rows} articles, the database {expected_rows}; Ignoring it")
+            return None
+        return article_columns
+
+    def rows(self, ids: list) -> np.ndarray:
+        """
+        Returns the row of each id, ids which don't exist are skipped.
+        @param list ids: article ids as strings or ints
+        @return np.ndarray
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.sorted_ids, ids), len(self.sorted_ids) - 1)
+        found = self.sorted_ids[positions] == ids
+        return self.row_order[positions[found]]
+
+    def get_points(self) -> pd.DataFrame:
+        """
+        Returns the id, heading, topic_name, probability, x and y of all articles
+        like ClusterWidget.getPoints. The frame is built once and shared, so it
+        must not be modified.
+        @return pd.DataFrame
+        """
+        if self.points is None:
+            self.points = self.create_points()
+        return self.points
+
+    def create_points(self) -> pd.DataFrame:
+        """
+        Builds the frame of get_points.
+        @return pd.DataFrame
+        """
+        return pd.DataFrame({
+            "id": self.table.column("id").to_numpy().astype(str),
+            "heading": self.table.column("heading").to_pandas(),
+            "topic_name": self.table.column("topic").to_pandas().astype(str),
+            "probability": self.table.column("probability").to_numpy(),
+            "x": self.table.column("x").to_numpy(),
+            "y": self.table.column("y").to_numpy()
+        })
+
+    def get_keyword_counts(self) -> pd.Series:
+        """
+        Returns the number of documents of each keyword, sorted descending. The
+        Series is computed once and shared, so it must not be modified.
+        @return pd.Series
+        """
+        if self.keyword_counts is None:
+            counts = np.bincount(self.keyword_ids, minlength=len(self.keyword_vocabulary))
+            self.keyword_counts = pd.Series(counts, index=self.keyword_vocabulary).sort_values(ascending=False)
+        return self.keyword_counts
+
+    def get_keywords_by_ids(self, ids: list) -> list:
+        """
+        Input: List of IDs
+        Output: List of keywords as Strings, like DocumentClient.get_keywords_by_ids
+        """
+        rows = self.rows(ids)
+        if len(rows) == 0:
+            return []
+        starts = self.keyword_offsets[rows]
+        lengths = self.keyword_offsets[rows + 1] - starts
+        # positions of all keywords of the rows without a loop over the rows
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return self.keyword_vocabulary[self.keyword_ids[positions]].tolist()
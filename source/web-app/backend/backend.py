@@ -1,6 +1,12 @@
 from elasticsearch import Elasticsearch
 from elasticsearch.client import IndicesClient
+from elasticsearch.helpers import scan, streaming_bulk
+from datetime import datetime, timezone
+from itertools import groupby
 from time import sleep
+import csv
+import json
+import os
 
 class DocumentClient:
     def __init__(self):
@@ -11,10 +17,18 @@ class DocumentClient:
         self.es_index_client = IndicesClient(self.es_client)
         self.article_db = "articles"
         self.tag_db = "tags"
+        self.selection_db = "selections"
         self.size = 1000
 
 
     ###########ARTICLE DB############
+    def get_article_count(self):
+        """
+        Input: None
+        Output: Number of articles as int
+        """
+        return self.es_client.count(index=self.article_db)["count"]
+
     def get_article_text(self, id):
         """
         Input: ID of article
@@ -104,6 +118,37 @@ class DocumentClient:
             all_ids.append(id["_id"])
         return all_ids
 
+    def search_article_ids(self, text, page_size=10000, keep_alive="1m"):
+        """
+        Full-text search in the headings and texts of the articles. Only the IDs
+        of the hits are fetched (no _source, filter_path), page by page with
+        search_after in a point in time, so all hits are returned.
+        Input: Query as String in the simple query string syntax ("quoted phrase",
+        -excluded, a | b), number of hits per page, how long the point in time is kept
+        Output: List of the IDs of all matching articles
+        """
+        query = {"simple_query_string": {"query": text, "fields": ["heading^2", "article_text"],
+                                         "default_operator": "and"}}
+        pit = self.es_client.open_point_in_time(index=self.article_db, keep_alive=keep_alive)["id"]
+        ids = []
+        page_after = dict()
+        try:
+            while True:
+                page = self.es_client.search(
+                    size=page_size, query=query, _source=False, track_total_hits=False,
+                    pit={"id": pit, "keep_alive": keep_alive}, sort=[{"_shard_doc": "asc"}],
+                    filter_path=["pit_id", "hits.hits._id", "hits.hits.sort"], **page_after
+                )
+                hits = page.get("hits", {}).get("hits", [])
+                ids.extend(hit["_id"] for hit in hits)
+                if len(hits) < page_size:
+                    break
+                pit = page.get("pit_id", pit)
+                page_after = {"search_after": hits[-1]["sort"]}
+        finally:
+            self.es_client.close_point_in_time(body={"id": pit})
+        return ids
+
     def get_keywords_by_ids(self, ids):
         """
         Input: List of IDs
@@ -242,3 +287,387 @@ class DocumentClient:
                 tags_of_article.remove(id)
                 self.es_client.update(index=self.article_db, id=article, body={"doc": {"tags": tags_of_article}})
         print("deleted tag")
+
+
+    ############SELECTION DB################
+
+    def create_selection_index(self):
+        """
+        Creates the index of the saved selections, if it doesn't exist. The
+        bitset is stored, but not indexed.
+        Input: None
+        Output: None
+        """
+        if not self.es_index_client.exists(index=self.selection_db):
+            self.es_index_client.create(index=self.selection_db, mappings={"properties": {
+                "name": {"type": "keyword"},
+                "bitset": {"type": "binary"},
+                "n_rows": {"type": "long"},
+                "count": {"type": "long"},
+                "rows_version": {"type": "keyword"},
+                "created_at": {"type": "date"}
+            }})
+
+    def save_selection(self, name, bitset, n_rows, count, rows_version):
+        """
+        Saves a selection under its name, an existing selection with the name is replaced.
+        Input: Name as String, the compressed bitset as base64 String (see
+        selections.encode_mask), the number of rows it covers, the number of
+        selected rows and the fingerprint of the order of the rows
+        Output: None
+        """
+        self.create_selection_index()
+        self.es_client.index(index=self.selection_db, id=name, refresh="wait_for", document={
+            "name": name, "bitset": bitset, "n_rows": n_rows, "count": count,
+            "rows_version": rows_version, "created_at": datetime.now(timezone.utc).isoformat()
+        })
+
+    def get_selection(self, name):
+        """
+        Input: Name as String
+        Output: Dict with the keys of save_selection, None if there is no selection with the name
+        """
+        if not self.es_index_client.exists(index=self.selection_db):
+            return None
+        result = self.es_client.get(index=self.selection_db, id=name, ignore=404)
+        return result["_source"] if result.get("found") else None
+
+    def get_all_selections(self):
+        """
+        Input: None
+        Output: Dict of the number of selected rows by the name of each saved selection
+        """
+        if not self.es_index_client.exists(index=self.selection_db):
+            return {}
+        hits = scan(self.es_client, index=self.selection_db, _source=["name", "count"], query={"query": {"match_all": {}}})
+        return {hit["_source"]["name"]: hit["_source"]["count"] for hit in hits}
+
+    def delete_selection(self, name):
+        """
+        Input: Name as String
+        Output: None
+        """
+        if self.es_index_client.exists(index=self.selection_db):
+            self.es_client.delete(index=self.selection_db, id=name, refresh="wait_for", ignore=404)
+
+
+    ############TAG RULES################
+
+    # keys of a tag rule, an article must match all keys of the rule
+    TAG_RULE_KEYS = ("keywords", "topic", "phrase")
+
+    def get_article_mapping_version(self):
+        """
+        Input: None
+        Output: Version of the mapping of the articles, "v1" (nested keywords and
+        topic) or "v2" (see create_database.py)
+        """
+        mappings = self.es_index_client.get_mapping(index=self.article_db)
+        properties = next(iter(mappings.values()))["mappings"]["properties"]
+        return "v1" if properties["keywords"].get("type") == "nested" else "v2"
+
+    def tag_rule_query(self, rule):
+        """
+        Input: Rule as Dict (see set_tag_rule)
+        Output: List of the filters of the articles matching the rule
+        """
+        nested = self.get_article_mapping_version() == "v1"
+        filters = []
+        if rule.get("keywords"):
+            if nested:
+                filters.append({"nested": {"path": "keywords", "query": {"bool": {
+                    "should": [{"match_phrase": {"keywords.word": word}} for word in rule["keywords"]]}}}})
+            else:
+                filters.append({"terms": {"keywords.word": rule["keywords"]}})
+        if rule.get("topic"):
+            if nested:
+                filters.append({"nested": {"path": "topic", "query": {"match_phrase": {"topic.topic_name": rule["topic"]}}}})
+            else:
+                filters.append({"term": {"topic.topic_name": rule["topic"]}})
+        if rule.get("phrase"):
+            filters.append({"multi_match": {"query": rule["phrase"], "type": "phrase", "fields": ["heading", "article_text"]}})
+        return filters
+
+    def set_tag_rule(self, tag, rule):
+        """
+        Stores a rule with the tag, next to its description. A changed rule is
+        applied to all articles again by the next apply_tag_rules.
+        Input: Tag as String, rule as Dict with any of the keys "keywords" (List of
+        keywords, the article must have one of them), "topic" (name of the topic of
+        the article) and "phrase" (a phrase in the heading or the text), None to
+        remove the rule
+        Output: None
+        """
+        if rule is not None:
+            rule = {key: value for key, value in rule.items() if value}
+            unknown = set(rule) - set(self.TAG_RULE_KEYS)
+            if unknown or len(rule) == 0:
+                raise ValueError(f"A tag rule needs some of the keys {self.TAG_RULE_KEYS}, got {sorted(rule)}")
+        tag_ids = [tag_id for tag_id, tag_source in self.get_tag_index().items() if tag_source["name"] == tag]
+        for tag_id in tag_ids[:1]:
+            self.es_client.update(index=self.tag_db, id=tag_id, refresh=True,
+                                  doc={"rule": rule, "rule_applied_until": None})
+
+    def get_tag_rules(self):
+        """
+        Input: None
+        Output: Dict of the tags with a rule by name, each a Dict with the keys "id",
+        "rule" and "applied_until" (ingestion time of the newest article the rule was
+        applied to, None if it wasn't applied yet)
+        """
+        if not self.es_index_client.exists(index=self.tag_db):
+            return {}
+        # the rules are stored, but not indexed, so they can't be searched
+        hits = scan(self.es_client, index=self.tag_db, _source=["name", "rule", "rule_applied_until"],
+                    query={"query": {"match_all": {}}})
+        return {hit["_source"]["name"]: {"id": hit["_id"], "rule": hit["_source"]["rule"],
+                                         "applied_until": hit["_source"].get("rule_applied_until")}
+                for hit in hits if hit["_source"].get("rule")}
+
+    def apply_tag_rules(self, tags=None, incremental=True):
+        """
+        Adds the tags to the articles matching their rules, each with one scripted
+        update_by_query that runs in Elasticsearch. Incrementally, only articles
+        ingested since the last application are updated (create_database.py stores
+        the ingestion time in "ingested_at"). Articles which were changed during
+        the update are retried by the next application.
+        Input: List of tags, None for all tags with a rule, and whether only the
+        articles ingested since the last application are updated
+        Output: Dict of the number of newly tagged articles by tag
+        """
+        rules = self.get_tag_rules()
+        updated = dict()
+        for tag in (tags if tags is not None else sorted(rules)):
+            if tag not in rules:
+                continue
+            tag_rule = rules[tag]
+            # articles ingested after this are left to the next application
+            latest = self.es_client.search(index=self.article_db, size=0, aggs={"latest": {"max": {"field": "ingested_at"}}})
+            latest = latest["aggregations"]["latest"].get("value_as_string")
+
+            query = {"bool": {"filter": self.tag_rule_query(tag_rule["rule"]),
+                              "must_not": [{"term": {"tags": tag_rule["id"]}}]}}
+            if incremental and tag_rule["applied_until"] is not None:
+                query["bool"]["filter"].append({"range": {"ingested_at": {"gte": tag_rule["applied_until"]}}})
+            result = self.es_client.update_by_query(index=self.article_db, body={
+                "query": query,
+                "script": {"source": self.ADD_TAGS_SCRIPT, "lang": "painless", "params": {"tags": [tag_rule["id"]]}}
+            }, conflicts="proceed", refresh=True, slices="auto", request_timeout=3600)
+            updated[tag] = result["updated"]
+            if result["version_conflicts"] == 0 and len(result["failures"]) == 0:
+                self.es_client.update(index=self.tag_db, id=tag_rule["id"], refresh=True,
+                                      doc={"rule_applied_until": latest})
+        return updated
+
+
+    ############TAG ASSIGNMENTS################
+
+    # adds the tag ids in params.tags to an article, without duplicates
+    ADD_TAGS_SCRIPT = """
+        if (ctx._source.tags == null) { ctx._source.tags = []; }
+        boolean changed = false;
+        for (tag in params.tags) {
+            if (!ctx._source.tags.contains(tag)) { ctx._source.tags.add(tag); changed = true; }
+        }
+        if (!changed) { ctx.op = 'noop'; }
+    """
+
+    def get_tag_index(self):
+        """
+        Input: None
+        Output: Dict of all tags by id, each a Dict with keys "name" and "description"
+        """
+        if not self.es_index_client.exists(index=self.tag_db):
+            return {}
+        return {hit["_id"]: {"name": hit["_source"]["name"], "description": hit["_source"].get("description", "")}
+                for hit in scan(self.es_client, index=self.tag_db, query={"query": {"match_all": {}}})}
+
+    def iter_tag_assignments(self, page_size=1000):
+        """
+        Input: Number of articles per page
+        Output: Generator of Dicts with keys "id", "tag" and "description", one per
+        tag of each article. The articles are read page by page with a scroll, so
+        the memory usage doesn't depend on the number of articles.
+        """
+        tags = self.get_tag_index()
+        hits = scan(self.es_client, index=self.article_db, size=page_size, _source=["tags"],
+                    query={"query": {"exists": {"field": "tags"}}})
+        for hit in hits:
+            for tag_id in hit["_source"].get("tags", []):
+                if tag_id in tags:
+                    yield {"id": hit["_id"], "tag": tags[tag_id]["name"], "description": tags[tag_id]["description"]}
+
+    def export_tag_assignments(self, path, file_format=None, page_size=1000):
+        """
+        Input: Path of the file, "jsonl" or "csv" (None to choose by the file extension)
+        and number of articles per page
+        Output: Number of exported assignments
+        """
+        file_format = file_format if file_format is not None else ("csv" if path.endswith(".csv") else "jsonl")
+        exported = 0
+        with open(path, "w", newline="") as f:
+            writer = None
+            if file_format == "csv":
+                writer = csv.DictWriter(f, fieldnames=["id", "tag", "description"])
+                writer.writeheader()
+            for assignment in self.iter_tag_assignments(page_size):
+                if writer is not None:
+                    writer.writerow(assignment)
+                else:
+                    f.write(json.dumps(assignment) + "\n")
+                exported += 1
+        return exported
+
+    def read_tag_assignments(self, path, file_format=None):
+        """
+        Input: Path of a file written by export_tag_assignments, its format (None to
+        choose by the file extension)
+        Output: Generator of Dicts with keys "id", "tag" and "description"
+        """
+        file_format = file_format if file_format is not None else ("csv" if path.endswith(".csv") else "jsonl")
+        with open(path, "r", newline="") as f:
+            if file_format == "csv":
+                yield from csv.DictReader(f)
+            else:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def get_all_article_ids_by_tag(self, tag, page_size=1000):
+        """
+        Input: Tag as String, number of articles per page
+        Output: List of the IDs of all articles with the tag, unlike
+        get_article_id_by_tag not limited to one page
+        """
+        tag_ids = [tag_id for tag_id, tag_source in self.get_tag_index().items() if tag_source["name"] == tag]
+        if len(tag_ids) == 0:
+            return []
+        hits = scan(self.es_client, index=self.article_db, size=page_size, _source=False,
+                    query={"query": {"terms": {"tags": tag_ids}}})
+        return [hit["_id"] for hit in hits]
+
+    def bulk_add_tag_to_articles(self, tag, ids, chunk_size=1000):
+        """
+        Adds an existing tag to many articles with scripted bulk updates instead
+        of one read and one write per article like add_tag_to_articles.
+        Input: Tag as String, list of IDs, number of updates per bulk request
+        Output: Number of updated articles
+        """
+        tag_ids = [tag_id for tag_id, tag_source in self.get_tag_index().items() if tag_source["name"] == tag]
+        if len(tag_ids) == 0:
+            return 0
+        actions = ({
+            "_op_type": "update",
+            "_index": self.article_db,
+            "_id": id,
+            "script": {"source": self.ADD_TAGS_SCRIPT, "lang": "painless", "params": {"tags": tag_ids[:1]}}
+        } for id in ids)
+        updated = 0
+        for ok, item in streaming_bulk(self.es_client, actions, chunk_size=chunk_size, max_retries=5,
+                                       raise_on_error=False, refresh="wait_for"):
+            updated += ok
+        return updated
+
+    def import_tag_assignments(self, path, file_format=None, chunk_size=1000):
+        """
+        Re-applies exported tag assignments. Tags which don't exist yet are created
+        with their description. Consecutive assignments of the same article are
+        sent as one scripted update, in bulk requests of chunk_size updates.
+        Input: Path of the file, its format (None to choose by the file extension) and
+        the number of updates per bulk request
+        Output: Tuple of the number of updated articles and of articles which failed
+        (e.g. because they don't exist in the database)
+        """
+        tag_ids = {tag["name"]: tag_id for tag_id, tag in self.get_tag_index().items()}
+
+        def tag_id_of(assignment):
+            if assignment["tag"] not in tag_ids:
+                new_tag = self.es_client.index(index=self.tag_db, refresh=True,
+                                               body={"name": assignment["tag"], "description": assignment.get("description", "")})
+                tag_ids[assignment["tag"]] = new_tag["_id"]
+            return tag_ids[assignment["tag"]]
+
+        def actions():
+            assignments = self.read_tag_assignments(path, file_format)
+            for article_id, group in groupby(assignments, key=lambda assignment: str(assignment["id"])):
+                yield {
+                    "_op_type": "update",
+                    "_index": self.article_db,
+                    "_id": article_id,
+                    "script": {"source": self.ADD_TAGS_SCRIPT, "lang": "painless",
+                               "params": {"tags": [tag_id_of(assignment) for assignment in group]}}
+                }
+
+        updated, failed = 0, 0
+        for ok, item in streaming_bulk(self.es_client, actions(), chunk_size=chunk_size, max_retries=5,
+                                       raise_on_error=False, raise_on_exception=False, request_timeout=120):
+            if ok:
+                updated += 1
+            else:
+                failed += 1
+        return updated, failed
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        prog="backend.py",
+        description="Exports the tag assignments of all articles or imports them " +
+            "again, e.g. to keep them over a new import of the articles, or applies " +
+            "the tag rules to newly imported articles."
+    )
+    parser.add_argument('command',
+        type=str,
+        help="'export' writes all assignments to FILE, 'import' re-applies the " +
+            "assignments in FILE, 'apply-rules' adds the tags with a rule to the " +
+            "matching articles",
+        choices=["export", "import", "apply-rules"]
+    )
+    parser.add_argument('file',
+        metavar='FILE',
+        type=str,
+        nargs='?',
+        help="A .jsonl or .csv file with one (id, tag, description) assignment per line",
+        default=None
+    )
+    parser.add_argument('--format',
+        type=str,
+        help="Format of FILE. Default: by the extension of FILE",
+        choices=["jsonl", "csv"],
+        default=None
+    )
+    parser.add_argument('--chunk-size',
+        metavar='n',
+        action='store',
+        type=int,
+        help="Number of articles per page of the export or per bulk request of " +
+            "the import. Default: 1000",
+        default=1000
+    )
+    parser.add_argument('--full',
+        action='store_true',
+        help="With apply-rules: apply the rules to all articles instead of only " +
+            "the articles imported since the last application. Default: False",
+        default=False
+    )
+
+    args = parser.parse_args()
+    if args.command != "apply-rules" and args.file is None:
+        parser.error(f"{args.command} needs a FILE")
+    document_client = DocumentClient()
+    start = time.perf_counter()
+    if args.command == "apply-rules":
+        updated = document_client.apply_tag_rules(incremental=not args.full)
+        for tag, number in updated.items():
+            print(f"Tagged {number} articles with '{tag}'")
+        print(f"Applied {len(updated)} tag rules in {time.perf_counter() - start:.1f}s")
+    elif args.command == "export":
+        exported = document_client.export_tag_assignments(args.file, args.format, args.chunk_size)
+        print(f"Exported {exported} tag assignments to {args.file} in {time.perf_counter() - start:.1f}s")
+    else:
+        if not os.path.exists(args.file):
+            raise SystemExit(f"{args.file} does not exist")
+        updated, failed = document_client.import_tag_assignments(args.file, args.format, args.chunk_size)
+        print(f"Updated the tags of {updated} articles in {time.perf_counter() - start:.1f}s, {failed} failed")
@@ -0,0 +1,248 @@
+import os
+import time
+import numpy as np
+
+
+class MemoryDocumentClient:
+    """
+    Stand-in for DocumentClient which keeps a synthetic corpus in memory. It
+    has the methods of DocumentClient the frontend uses, so the web app can run
+    without Elasticsearch, e.g. for load tests (see load_test.py). Set the
+    environment variable IDT_BACKEND=memory to use it in main.py.
+    """
+
+    # one instance per server process, so all sessions see the same tags like with a database
+    _shared = None
+
+    def __init__(self, n_articles: int = 10000, n_tags: int = 30, n_topics: int = 20, latency: float = 0.0, seed: int = 0):
+        """
+        @param int n_articles: number of synthetic articles
+        @param int n_tags: number of tags, each assigned to a few random articles
+        @param int n_topics: number of topic clusters of the articles
+        @param float latency: seconds each call waits to emulate the round trip to a database
+        @param int seed: seed of the synthetic corpus
+        """
+        rng = np.random.default_rng(seed)
+        self.latency = latency
+        self.size = 1000
+
+        centers = rng.normal(scale=10, size=(n_topics, 2))
+        topics = rng.integers(0, n_topics, n_articles)
+        coordinates = centers[topics] + rng.normal(size=(n_articles, 2))
+        vocabulary = [f"keyword{i}" for i in range(2000)]
+        self.articles = dict()
+        for i in range(n_articles):
+            topic_name = "None" if topics[i] == 0 else f"{topics[i]}_topic_{topics[i]}"
+            keywords = rng.choice(len(vocabulary), 5, replace=False)
+            self.articles[str(i)] = {
+                "heading": f"Article {i} about topic {topics[i]}",
+                "article_text": f"Text of article {i}. " * 50,
+                "url": f"https://example.org/articles/{i}",
+                "topic": {"topic_name": topic_name, "probability": float(rng.random()),
+                          "x": float(coordinates[i, 0]), "y": float(coordinates[i, 1])},
+                "keywords": [{"word": vocabulary[k], "similarity": 0.5} for k in keywords],
+                "tags": []
+            }
+
+        self.tags = dict()
+        self.selections = dict()
+        self.next_tag_id = 0
+        for i in range(n_tags):
+            tag_id = self.add_new_tag(f"tag {i}", f"Description of tag {i}")
+            for id in rng.choice(n_articles, min(20, n_articles), replace=False):
+                self.articles[str(id)]["tags"].append(tag_id)
+
+    @classmethod
+    def shared(cls) -> 'MemoryDocumentClient':
+        """
+        Returns the client of this process, created with the parameters in the
+        environment variables IDT_MEMORY_ARTICLES, IDT_MEMORY_TAGS,
+        IDT_MEMORY_LATENCY (seconds) and IDT_MEMORY_SEED.
+        @return MemoryDocumentClient
+        """
+        if cls._shared is None:
+            cls._shared = cls(
+                n_articles=int(os.environ.get("IDT_MEMORY_ARTICLES", 10000)),
+                n_tags=int(os.environ.get("IDT_MEMORY_TAGS", 30)),
+                latency=float(os.environ.get("IDT_MEMORY_LATENCY", 0.0)),
+                seed=int(os.environ.get("IDT_MEMORY_SEED", 0))
+            )
+        return cls._shared
+
+    def wait(self, calls: int = 1):
+        """
+        Emulates the latency of calls to a database.
+        """
+        if self.latency > 0:
+            time.sleep(self.latency * calls)
+
+    def tag_id(self, tag):
+        for tag_id, tag_source in self.tags.items():
+            if tag_source["name"] == tag:
+                return tag_id
+        return None
+
+    ###########ARTICLE DB############
+    def get_article_count(self):
+        self.wait()
+        return len(self.articles)
+
+    def get_article_text(self, id):
+        self.wait()
+        return self.articles[id]["article_text"]
+
+    def get_article_name_and_topic(self, id):
+        self.wait()
+        return {"heading": self.articles[id]["heading"], "topic": self.articles[id]["topic"]}
+
+    def add_tag_to_articles(self, tag, ids):
+        if tag != "":
+            tag_id = self.tag_id(tag)
+            self.wait(1 + 2 * len(ids))
+            for id in ids:
+                if tag_id not in self.articles[id]["tags"]:
+                    self.articles[id]["tags"].append(tag_id)
+            return "SUCCESS"
+
+    def delete_tag_from_articles(self, tag, ids):
+        if tag != "":
+            tag_id = self.tag_id(tag)
+            self.wait(1 + 2 * len(ids))
+            for id in ids:
+                if tag_id in self.articles[id]["tags"]:
+                    self.articles[id]["tags"].remove(tag_id)
+
+    def get_all_articles(self):
+        self.wait()
+        return [{"id": id, "heading": article["heading"], "topic": article["topic"]}
+                for id, article in self.articles.items()]
+
+    def get_all_keywords(self):
+        self.wait()
+        return [keyword["word"] for article in self.articles.values() for keyword in article["keywords"]]
+
+    def search_article_ids(self, text):
+        words = text.lower().split()
+        self.wait(1 + len(self.articles) // 10000)
+        return [id for id, article in self.articles.items()
+                if all(word in (article["heading"] + " " + article["article_text"]).lower() for word in words)]
+
+    def get_keywords_by_ids(self, ids):
+        self.wait(len(ids))
+        return [keyword["word"] for id in ids if id in self.articles for keyword in self.articles[id]["keywords"]]
+
+    def get_all_articles_id(self):
+        self.wait()
+        return list(self.articles.keys())
+
+    def get_url_from_id(self, ids):
+        self.wait(len(ids))
+        return [self.articles[id]["url"] for id in ids]
+
+    ############TAG DB################
+    def get_all_tags_id(self):
+        self.wait()
+        return list(self.tags.keys())
+
+    def get_tags_by_ids(self, ids, filter=True):
+        self.wait(2 * len(ids))
+        all_tags = []
+        for id in ids:
+            for tag_id in self.articles[id]["tags"]:
+                name = self.tags[tag_id]["name"]
+                if not filter or name not in all_tags:
+                    all_tags.append(name)
+        return all_tags
+
+    def get_all_article_ids_by_tag(self, tag):
+        tag_id = self.tag_id(tag)
+        self.wait(2)
+        return [id for id, article in self.articles.items() if tag_id in article["tags"]]
+
+    def bulk_add_tag_to_articles(self, tag, ids):
+        tag_id = self.tag_id(tag)
+        if tag_id is None:
+            return 0
+        self.wait(1 + len(ids) // 1000)
+        for id in ids:
+            if tag_id not in self.articles[id]["tags"]:
+                self.articles[id]["tags"].append(tag_id)
+        return len(ids)
+
+    def get_tags_by_partial_words(self, part):
+        self.wait()
+        return [tag["name"] for tag in self.tags.values() if tag["name"].lower().startswith(part)]
+
+    def add_new_tag(self, tag, description):
+        self.wait()
+        if self.tag_id(tag) is None:
+            tag_id = str(self.next_tag_id)
+            self.next_tag_id += 1
+            self.tags[tag_id] = {"name": tag, "description": description}
+            return tag_id
+        return "TAG ALREADY EXISTS"
+
+    def get_all_tags(self, filter=True):
+        if filter:
+            self.wait()
+            return [tag["name"] for tag in self.tags.values()]
+        self.wait(len(self.articles))
+        return [self.tags[tag_id]["name"] for article in self.articles.values() for tag_id in article["tags"]]
+
+    def delete_tag(self, tag):
+        tag_id = self.tag_id(tag)
+        self.wait(1 + len(self.articles))
+        del self.tags[tag_id]
+        for article in self.articles.values():
+            if tag_id in article["tags"]:
+                article["tags"].remove(tag_id)
+
+    def save_selection(self, name, bitset, n_rows, count, rows_version):
+        self.wait()
+        self.selections[name] = {"name": name, "bitset": bitset, "n_rows": n_rows, "count": count,
+                                 "rows_version": rows_version, "created_at": time.time()}
+
+    def get_selection(self, name):
+        self.wait()
+        return self.selections.get(name)
+
+    def get_all_selections(self):
+        self.wait()
+        return {name: selection["count"] for name, selection in self.selections.items()}
+
+    def delete_selection(self, name):
+        self.wait()
+        self.selections.pop(name, None)
+
+    def set_tag_rule(self, tag, rule):
+        self.wait()
+        tag_id = self.tag_id(tag)
+        if tag_id is not None:
+            self.tags[tag_id]["rule"] = {key: value for key, value in rule.items() if value} if rule is not None else None
+
+    def get_tag_rules(self):
+        self.wait()
+        return {tag["name"]: {"id": tag_id, "rule": tag["rule"], "applied_until": None}
+                for tag_id, tag in self.tags.items() if tag.get("rule")}
+
+    def apply_tag_rules(self, tags=None, incremental=True):
+        rules = self.get_tag_rules()
+        updated = dict()
+        for tag in (tags if tags is not None else sorted(rules)):
+            if tag not in rules:
+                continue
+            tag_id, rule = rules[tag]["id"], rules[tag]["rule"]
+            self.wait(1 + len(self.articles) // 10000)
+            updated[tag] = 0
+            for article in self.articles.values():
+                if tag_id in article["tags"]:
+                    continue
+                if rule.get("keywords") and not set(rule["keywords"]) & {keyword["word"] for keyword in article["keywords"]}:
+                    continue
+                if rule.get("topic") and article["topic"]["topic_name"] != rule["topic"]:
+                    continue
+                if rule.get("phrase") and not any(rule["phrase"].lower() in article[field].lower() for field in ("heading", "article_text")):
+                    continue
+                article["tags"].append(tag_id)
+                updated[tag] += 1
+        return updated
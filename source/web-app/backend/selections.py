@@ -0,0 +1,62 @@
+import base64
+import hashlib
+import zlib
+import numpy as np
+
+
+# set operations between a selection and another selection or the documents of a tag
+OPERATIONS = {
+    "union": np.logical_or,
+    "intersection": np.logical_and,
+    "difference": lambda mask, other: mask & ~other
+}
+
+
+def rows_version(ids: np.ndarray) -> str:
+    """
+    Returns a fingerprint of the order of the rows of the cluster plot. A
+    saved selection only matches the rows if it was saved for the same order.
+    @param np.ndarray ids: the article id of each row
+    @return str
+    """
+    return hashlib.sha1(np.ascontiguousarray(ids, dtype=np.int64).tobytes()).hexdigest()[:16]
+
+
+def rows_to_mask(rows, n_rows: int) -> np.ndarray:
+    """
+    Returns the selection of rows as a boolean mask over all rows.
+    @param rows: the selected rows
+    @param int n_rows: the number of rows
+    @return np.ndarray
+    """
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[np.asarray(rows, dtype=np.int64)] = True
+    return mask
+
+
+def encode_mask(mask: np.ndarray) -> str:
+    """
+    Compresses a selection: the boundaries of the runs of selected rows are
+    delta encoded as uint32 and deflated, which is small for the contiguous
+    runs of lasso selections and for sparse selections alike.
+    @param np.ndarray mask: boolean mask over all rows
+    @return str: base64, as stored in the binary field of Elasticsearch
+    """
+    # starts and ends of the runs alternate
+    boundaries = np.flatnonzero(np.diff(mask.astype(np.int8), prepend=0, append=0))
+    deltas = np.diff(boundaries, prepend=0).astype(np.uint32)
+    return base64.b64encode(zlib.compress(deltas.tobytes(), 6)).decode("ascii")
+
+
+def decode_mask(bitset: str, n_rows: int) -> np.ndarray:
+    """
+    Decompresses a selection written by encode_mask.
+    @param str bitset
+    @param int n_rows: the number of rows
+    @return np.ndarray: boolean mask over all rows
+    """
+    boundaries = np.cumsum(np.frombuffer(zlib.decompress(base64.b64decode(bitset)), dtype=np.uint32), dtype=np.int64)
+    changes = np.zeros(n_rows + 1, dtype=np.int8)
+    changes[boundaries[0::2]] += 1
+    changes[boundaries[1::2]] -= 1
+    return np.cumsum(changes[:-1]) > 0
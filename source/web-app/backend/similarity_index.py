@@ -0,0 +1,166 @@
+import functools
+import os
+import numpy as np
+
+
+# corpora with more documents get an approximate (IVF) index by default
+APPROXIMATE_THRESHOLD = 200000
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Returns the positions of the k highest scores, highest first.
+    @param np.ndarray scores
+    @param int k
+    @return np.ndarray
+    """
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+class SimilarityIndex:
+    """
+    Nearest neighbor index over the normalized document embeddings of the
+    preprocessing (article_embeddings.npy), which is memory mapped. Small corpora
+    are searched exactly with a blocked matrix-vector product. Large corpora
+    get an inverted file index: the embeddings are clustered by spherical
+    k-means and only the rows of the n_probe clusters nearest to the query
+    are scored. The clusters are built once and saved next to the embeddings.
+    """
+
+    def __init__(self, path: str = "/data/export/article_embeddings.npy", n_lists: int = None, n_probe: int = 16, block_size: int = 2**16, seed: int = 0):
+        """
+        @param str path: path of the normalized embeddings written by idt-preprocessing.py
+        @param int n_lists: number of clusters of the inverted file index, 0 for
+            an exact search, None to choose by the size of the corpus (Default)
+        @param int n_probe: number of clusters scored per query
+        @param int block_size: number of rows scored at once by the exact search
+        @param int seed: seed of the k-means clustering
+        """
+        self.path = path
+        self.embeddings = np.load(path, mmap_mode="r")
+        self.n_probe = n_probe
+        self.block_size = block_size
+        if n_lists is None:
+            n_lists = 0 if len(self.embeddings) < APPROXIMATE_THRESHOLD else int(np.sqrt(len(self.embeddings)))
+        self.centroids = None
+        if n_lists > 0:
+            self.load_or_build_lists(n_lists, seed)
+
+    @classmethod
+    def open(cls, path: str = "/data/export/article_embeddings.npy", expected_rows: int = None) -> 'SimilarityIndex':
+        """
+        Opens the index, if there are embeddings which match the articles. The
+        index is shared by all sessions of the server process until the file
+        or the number of articles changes.
+        @param str path: path of the normalized embeddings
+        @param int expected_rows: number of articles, None to not check it
+        @return SimilarityIndex or None
+        """
+        if not os.path.exists(path):
+            return None
+        return cls.open_version(path, os.path.getmtime(path), expected_rows)
+
+    @classmethod
+    @functools.lru_cache(maxsize=1)
+    def open_version(cls, path: str, mtime: float, expected_rows: int) -> 'SimilarityIndex':
+        """
+        Opens a version of the index, see open.
+        @param str path: path of the normalized embeddings
+        @param float mtime: modification time of the file, part of the cache key
+        @param int expected_rows: number of articles, None to not check it
+        @return SimilarityIndex or None
+        """
+        index = cls(path)
+        if expected_rows is not None and len(index.embeddings) != expected_rows:
+            print(f"'{path}' has {len(index.embeddings)} embeddings, but there are {expected_rows} articles; Ignoring it")
+            return None
+        return index
+
+    def load_or_build_lists(self, n_lists: int, seed: int):
+        """
+        Loads the inverted file index saved next to the embeddings or builds it,
+        if it is missing or older than the embeddings.
+        @param int n_lists: number of clusters
+        @param int seed: seed of the k-means clustering
+        """
+        lists_path = os.path.splitext(self.path)[0] + f".ivf{n_lists}.npz"
+        if os.path.exists(lists_path) and os.path.getmtime(lists_path) >= os.path.getmtime(self.path):
+            lists = np.load(lists_path)
+            self.centroids, self.order, self.offsets = lists["centroids"], lists["order"], lists["offsets"]
+            return
+        print(f"### Similarity:  Clustering {len(self.embeddings)} embeddings into {n_lists} lists...")
+        self.centroids = self.kmeans(n_lists, seed)
+        assignments = np.concatenate([
+            np.argmax(np.asarray(self.embeddings[start:start + self.block_size]) @ self.centroids.T, axis=1)
+            for start in range(0, len(self.embeddings), self.block_size)
+        ])
+        # the rows of list i are order[offsets[i]:offsets[i + 1]], ascending for a sequential read
+        self.order = np.argsort(assignments, kind="stable")
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))])
+        try:
+            np.savez(lists_path, centroids=self.centroids, order=self.order, offsets=self.offsets)
+        except OSError:
+            print(f"### Similarity:  Can't save the lists to '{lists_path}', they are built again on the next start")
+
+    def kmeans(self, n_lists: int, seed: int, iterations: int = 10, sample_size: int = 100000) -> np.ndarray:
+        """
+        Spherical k-means on a sample of the embeddings.
+        @param int n_lists: number of clusters
+        @param int seed
+        @param int iterations
+        @param int sample_size: number of rows the clusters are fitted on
+        @return np.ndarray: the normalized centroids
+        """
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(len(self.embeddings), min(sample_size, len(self.embeddings)), replace=False))
+        sample = np.asarray(self.embeddings[rows])
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            empty = np.bincount(assignments, minlength=n_lists) == 0
+            # empty clusters start again from random rows
+            sums[empty] = sample[rng.choice(len(sample), empty.sum(), replace=False)]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), np.finfo(np.float32).tiny)
+        return centroids.astype(np.float32)
+
+    def most_similar(self, row: int, k: int) -> tuple:
+        """
+        Returns the k rows most similar to a row, the row itself excluded.
+        @param int row: row of the document in the embeddings
+        @param int k: number of similar rows
+        @return tuple: the rows and their cosine similarities, most similar first
+        """
+        query = np.asarray(self.embeddings[row], dtype=np.float32)
+        if self.centroids is None:
+            rows, scores = self.search_exact(query, k + 1)
+        else:
+            lists = top_k(self.centroids @ query, self.n_probe)
+            candidates = np.sort(np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists]))
+            candidate_scores = np.asarray(self.embeddings[candidates]) @ query
+            top = top_k(candidate_scores, k + 1)
+            rows, scores = candidates[top], candidate_scores[top]
+        keep = rows != row
+        return rows[keep][:k], scores[keep][:k]
+
+    def search_exact(self, query: np.ndarray, k: int) -> tuple:
+        """
+        Scores all rows block by block and keeps the k best of each block.
+        @param np.ndarray query: normalized embedding
+        @param int k
+        @return tuple: the rows and their scores, highest first
+        """
+        rows, scores = [], []
+        for start in range(0, len(self.embeddings), self.block_size):
+            block_scores = np.asarray(self.embeddings[start:start + self.block_size]) @ query
+            top = top_k(block_scores, k)
+            rows.append(top + start)
+            scores.append(block_scores[top])
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        top = top_k(scores, k)
+        return rows[top], scores[top]
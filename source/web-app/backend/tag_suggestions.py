@@ -0,0 +1,113 @@
+import functools
+import os
+import time
+import numpy as np
+
+
+class TagSuggester:
+    """
+    Suggests documents for a tag by label propagation over the k nearest
+    neighbor graph of the preprocessing (article_neighbors.npz). The documents
+    with the tag are the seeds; the score of each document is the fixed point of
+    f = alpha * W f + (1 - alpha) * y, where W holds the row-normalized
+    similarities to the k neighbors and y is 1 for the seeds. An iteration is a
+    gather of the scores of the neighbors, so it takes O(n * k). The scores of
+    each tag are kept and the next propagation for the tag starts from them,
+    corrected by the seeds which changed since.
+    """
+
+    def __init__(self, path: str = "/data/export/article_neighbors.npz", alpha: float = 0.85, tolerance: float = 1e-3, max_iterations: int = 100):
+        """
+        @param str path: path of the neighbor graph written by idt-preprocessing.py
+        @param float alpha: weight of the neighbors against the seeds
+        @param float tolerance: the propagation stops once no score changes more than this
+        @param int max_iterations: maximal number of iterations of a propagation
+        """
+        graph = np.load(path)
+        self.indices = graph["indices"]
+        weights = np.maximum(graph["similarities"], 0).astype(np.float32)
+        self.weights = weights / np.maximum(weights.sum(axis=1, keepdims=True), np.finfo(np.float32).tiny)
+        self.alpha = alpha
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        # the last scores and seed labels of each tag
+        self.scores = dict()
+
+    @classmethod
+    def open(cls, path: str = "/data/export/article_neighbors.npz", expected_rows: int = None) -> 'TagSuggester':
+        """
+        Opens the neighbor graph, if there is one which matches the articles. The
+        suggester is shared by all sessions of the server process until the
+        file or the number of articles changes.
+        @param str path: path of the neighbor graph
+        @param int expected_rows: number of articles, None to not check it
+        @return TagSuggester or None
+        """
+        if not os.path.exists(path):
+            return None
+        return cls.open_version(path, os.path.getmtime(path), expected_rows)
+
+    @classmethod
+    @functools.lru_cache(maxsize=1)
+    def open_version(cls, path: str, mtime: float, expected_rows: int) -> 'TagSuggester':
+        """
+        Opens a version of the neighbor graph, see open.
+        @param str path: path of the neighbor graph
+        @param float mtime: modification time of the file, part of the cache key
+        @param int expected_rows: number of articles, None to not check it
+        @return TagSuggester or None
+        """
+        suggester = cls(path)
+        if expected_rows is not None and len(suggester.indices) != expected_rows:
+            print(f"'{path}' has {len(suggester.indices)} documents, but there are {expected_rows} articles; Ignoring it")
+            return None
+        return suggester
+
+    def propagate(self, seeds: np.ndarray, previous: tuple = None) -> tuple:
+        """
+        Propagates the seeds through the graph.
+        @param np.ndarray seeds: rows of the documents with the tag
+        @param tuple previous: the scores and labels of the last propagation to
+            start from, None to start from the seeds
+        @return tuple: the score of each document, the labels and the number of iterations
+        """
+        labels = np.zeros(len(self.indices), dtype=np.float32)
+        labels[seeds] = 1
+        teleport = (1 - self.alpha) * labels
+        if previous is None:
+            scores = teleport.copy()
+        else:
+            # only the changed seeds are away from the last fixed point
+            previous_scores, previous_labels = previous
+            scores = previous_scores + (1 - self.alpha) * (labels - previous_labels)
+        for iteration in range(1, self.max_iterations + 1):
+            new_scores = self.alpha * np.einsum("ij,ij->i", self.weights, scores[self.indices]) + teleport
+            change = np.abs(new_scores - scores).max(initial=0)
+            scores = new_scores
+            if change < self.tolerance:
+                break
+        return scores, labels, iteration
+
+    def suggest(self, tag: str, seeds: np.ndarray, n: int) -> tuple:
+        """
+        Returns the n documents without the tag with the highest scores.
+        @param str tag: the tag, whose last scores are the start of the propagation
+        @param np.ndarray seeds: rows of the documents with the tag
+        @param int n: number of suggestions
+        @return tuple: the rows and the scores of the suggestions, highest first,
+            and a dict with the number of iterations and the time in seconds
+        """
+        start = time.perf_counter()
+        seeds = np.asarray(seeds, dtype=np.int64)
+        scores, labels, iterations = self.propagate(seeds, self.scores.get(tag))
+        self.scores[tag] = (scores, labels)
+
+        candidates = scores.copy()
+        candidates[seeds] = -np.inf
+        n = min(n, int((candidates > 0).sum()))
+        if n == 0:
+            rows = np.empty(0, dtype=np.int64)
+        else:
+            rows = np.argpartition(-candidates, n - 1)[:n]
+            rows = rows[np.argsort(-candidates[rows], kind="stable")]
+        return rows, scores[rows], {"iterations": iterations, "seconds": time.perf_counter() - start}
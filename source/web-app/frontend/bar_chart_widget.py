@@ -1,10 +1,37 @@
 #!/usr/bin/env python3
+import numpy as np
 import pandas as pd
 from bokeh.plotting import figure, curdoc
-from bokeh.models import Button, HoverTool, ColumnDataSource, FactorRange
+from bokeh.models import Button, HoverTool, ColumnDataSource, FactorRange, Toggle
 from bokeh.events import ButtonClick
 
 
+def log_odds_scores(selected_counts: pd.Series, corpus_counts: pd.Series, corpus_total: int, prior_size: float = 1000.0) -> pd.Series:
+    """
+    Scores how over-represented each keyword of a selection is compared to the
+    rest of the corpus: the z-score of the log-odds ratio with an informative
+    Dirichlet prior from the corpus counts (Monroe et al., 2008). Keywords which
+    are frequent everywhere score low and the prior keeps rare keywords from
+    ranking first by chance.
+    @param pd.Series selected_counts: number of selected documents of each keyword
+    @param pd.Series corpus_counts: number of all documents of each keyword
+    @param int corpus_total: sum of corpus_counts
+    @param float prior_size: number of pseudo counts of the prior
+    @return pd.Series: the score of each keyword of selected_counts
+    """
+    selected = selected_counts.to_numpy(dtype=np.float64)
+    corpus = corpus_counts.reindex(selected_counts.index, fill_value=0).to_numpy(dtype=np.float64)
+    rest = np.maximum(corpus - selected, 0)
+    selected_total = selected.sum()
+    rest_total = max(corpus_total - selected_total, rest.sum())
+    prior = prior_size * np.maximum(corpus, selected) / max(corpus_total, selected_total)
+
+    log_odds_selected = np.log(selected + prior) - np.log(selected_total + prior_size - selected - prior)
+    log_odds_rest = np.log(rest + prior) - np.log(rest_total + prior_size - rest - prior)
+    variance = 1 / (selected + prior) + 1 / (rest + prior)
+    return pd.Series((log_odds_selected - log_odds_rest) / np.sqrt(variance), index=selected_counts.index)
+
+
 class BarChartWidget:
     """
     A class for making two bar charts (one for keywords, one for tags), 
@@ -12,22 +39,29 @@ class BarChartWidget:
     This class also provides functions to update the bar charts.
     """
 
-    def __init__(self, kw_bar_chart_name: str, tag_bar_chart_name: str, button_name: str, tags: pd.Series, keywords: pd.Series):
+    def __init__(self, kw_bar_chart_name: str, tag_bar_chart_name: str, button_name: str, tags: pd.Series, keywords: pd.Series, distinctive_name: str = None):
         """
         @param str kw_bar_chart_name: The name of the figure, used in the HTML file
         @param str tag_bar_chart_name: The name of the figure, used in the HTML file
         @param str button_name: The name of the button, used in the HTML file
         @param pd.Series tags: number of documents for each tag
         @param pd.Series keywords: number of documents for each keyword
+        @param str distinctive_name: The name of the toggle between the most frequent
+            and the most distinctive keywords, used in the HTML file (default: None)
         """
         self.tag_data = self.create_data(tags)
         self.kw_data = self.create_data(keywords)
+        # corpus counts for scoring the keywords of a selection
+        self.keyword_counts = keywords
+        self.keyword_total = int(keywords.sum())
+        self.selected_kw_counts = pd.Series(dtype='int64')
 
         self.tag_plot, self.tag_datasource, self.tag_y_range = self.create_bar_chart(
             self.tag_data, "Tags", tag_bar_chart_name)
         self.kw_plot, self.kw_datasource, self.kw_y_range = self.create_bar_chart(
             self.kw_data, "Keywords", kw_bar_chart_name)
         self.button = self.create_button(button_name)
+        self.distinctive_toggle = self.create_distinctive_toggle(distinctive_name)
         self.kw_plot.visible = False
 
     def create_button(self, button_name: str) -> Button:
@@ -49,11 +83,24 @@ class BarChartWidget:
                 self.tag_plot.visible = False
                 self.kw_plot.visible = True
                 self.button.label = "Show Tags"
+            self.distinctive_toggle.visible = self.kw_plot.visible
 
         button.on_event(ButtonClick, switch_tags_keywords_table_callback)
 
         return button
 
+    def create_distinctive_toggle(self, distinctive_name: str) -> Toggle:
+        """
+        Creates a Toggle which switches the keyword bar chart of a selection from
+        the most frequent to the most distinctive keywords of the selection
+        @param str distinctive_name: name for the toggle to be able to add it in the html file
+        @return Toggle
+        """
+        toggle = Toggle(label="Distinctive Keywords", button_type="default", name=distinctive_name)
+        toggle.visible = False
+        toggle.on_change("active", lambda attr, old, new: self.update_keyword_chart())
+        return toggle
+
     def create_data(self, number_per_word: pd.Series) -> pd.DataFrame:
         """
         Creates a panda Series object with the number of occurrences of words in
@@ -139,18 +186,50 @@ class BarChartWidget:
         @param list selected_kw: list of keywords-strings of selected documents
         @param list selected_tags: list of tag-strings of selected tags
         """
-        self.update_data(self.kw_data, selected_kw)
+        self.selected_kw_counts = self.update_data(self.kw_data, selected_kw)
         self.update_data(self.tag_data, selected_tags)
-        self.update_bar_chart(
-            self.kw_data, self.kw_datasource, self.kw_y_range)
+        self.update_keyword_chart()
         self.update_bar_chart(
             self.tag_data, self.tag_datasource, self.tag_y_range)
 
+    def update_keyword_chart(self):
+        """
+        Shows the most frequent keywords of the selection or, if the toggle is
+        active and documents are selected, the most distinctive ones.
+        """
+        if self.distinctive_toggle.active and len(self.selected_kw_counts) > 0:
+            self.kw_plot.title.text = "Distinctive Keywords"
+            self.update_bar_chart(
+                self.distinctive_data(), self.kw_datasource, self.kw_y_range)
+        else:
+            self.kw_plot.title.text = "Keywords"
+            self.update_bar_chart(
+                self.kw_data, self.kw_datasource, self.kw_y_range)
+
+    def distinctive_data(self) -> pd.DataFrame:
+        """
+        Creates the data of the keyword bar chart for the keywords of the
+        selection, sorted by how over-represented they are in the selection.
+        Only the keywords of the selection are scored.
+        @return pd.DataFrame
+        """
+        scores = log_odds_scores(self.selected_kw_counts, self.keyword_counts, self.keyword_total)
+        corpus_counts = self.keyword_counts.reindex(self.selected_kw_counts.index, fill_value=0)
+        data = pd.DataFrame({
+            "selected_occ": self.selected_kw_counts,
+            "unselected_occ": (corpus_counts - self.selected_kw_counts).clip(lower=0),
+            "score": scores
+        })
+        data.index.names = ["words"]
+        data.sort_values(["score", "selected_occ"], inplace=True)
+        return data[["selected_occ", "unselected_occ"]]
+
     def update_data(self, data: pd.DataFrame, selected_words: list):
         """
         Updates the data DataFrame for the given list of selected_word
         @param DataFrame data: The DataFrame to be updated
         @param list selected_words: List of words of selected documents
+        @return pd.Series: number of selected documents of each word
         """
         selected_words_count = pd.Series(
             selected_words, dtype='object').value_counts()
@@ -160,6 +239,7 @@ class BarChartWidget:
         data["unselected_occ"] = data["unselected_occ"] - data["selected_occ"]
 
         data.sort_values(["selected_occ", "unselected_occ"], inplace=True)
+        return selected_words_count
 
     def add_tag(self, name: str, number: int):
         """
@@ -185,6 +265,19 @@ class BarChartWidget:
         self.update_bar_chart(
             self.tag_data, self.tag_datasource, self.tag_y_range)
 
+    def add_to_tag_count(self, name: str, number: int):
+        """
+        Adds documents outside of the selection to the row with index name, e.g.
+        documents tagged by a tag rule
+        @param str name: Name of the tag
+        @param int number: number of documents which got the tag
+        """
+        if name not in self.tag_data.index:
+            self.add_tag(name, 0)
+        self.tag_data.at[name, 'unselected_occ'] += number
+        self.update_bar_chart(
+            self.tag_data, self.tag_datasource, self.tag_y_range)
+
     def remove_tag(self, name: str):
         """
         Remove a row with name as index fron tag_data
@@ -202,3 +295,4 @@ class BarChartWidget:
         curdoc().add_root(self.tag_plot)
         curdoc().add_root(self.kw_plot)
         curdoc().add_root(self.button)
+        curdoc().add_root(self.distinctive_toggle)
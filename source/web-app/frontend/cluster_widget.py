@@ -1,17 +1,21 @@
 #!/usr/bin/env python3
+import numpy as np
 import pandas as pd
 from bokeh.plotting import figure, curdoc
-from bokeh.models import HoverTool, ColumnDataSource
-from bokeh.transform import factor_cmap
+from bokeh.models import HoverTool, ColumnDataSource, CustomJS, CustomJSHover
+from bokeh.transform import linear_cmap
 
 
+# number of titles of hovered points the browser keeps
+TITLE_CACHE_SIZE = 256
+
 
 class ClusterWidget:
     """
     A class to create the Scatterplot to desplay the clustering of the documents
     """
 
-    def __init__(self, document_client:'DocumentClient', document_view_widget:'DocumentViewWidget', tags_widget:'TagsWidget', bar_chart_widget:'BarChartWidget', cluster_widget_name:str, color_map:tuple):
+    def __init__(self, document_client:'DocumentClient', document_view_widget:'DocumentViewWidget', tags_widget:'TagsWidget', bar_chart_widget:'BarChartWidget', cluster_widget_name:str, color_map:tuple, article_columns:'ArticleColumns'=None, similarity_index:'SimilarityIndex'=None):
         """
         @param DocumentClient document_client
         @param DocumentViewWidget document_view_widget
@@ -19,8 +23,15 @@ class ClusterWidget:
         @param BarChartWidget bar_chart_widget
         @param str cluster_widget_name: The name of the cluster, for the HTML file
         @param tuple color_map: a tuple of strings which defines colors in hex
+        @param ArticleColumns article_columns: the columnar export of the preprocessing,
+            which is read instead of the database if it is given
+        @param SimilarityIndex similarity_index: index over the embeddings of the
+            rows of article_columns for selecting similar documents, None to disable it
         """
         self.document_client = document_client
+        self.article_columns = article_columns
+        # the keywords of the selected documents come from the columnar export if there is one
+        self.keyword_client = article_columns if article_columns is not None else document_client
         self.document_view_widget = document_view_widget
         self.bar_chart_widget = bar_chart_widget
         self.tags_widget = tags_widget
@@ -28,22 +39,80 @@ class ClusterWidget:
         self.tags_widget.visible = False
         self.cluster_widget_name = cluster_widget_name
         self.data = self.getPoints()
+        self.row_of_id = self.create_row_of_id()
         self.alltags = self.document_client.get_all_tags()
         
         self.cluster_plot = self.scatterplot(color_map)
 
+        self.similarity_index = similarity_index
+        if similarity_index is not None:
+            self.document_view_widget.add_similar_button(self.select_similar)
+
     
     def getPoints(self)->pd.DataFrame:
         """
         Gets the information needed for the cluster and returns it in the needed formation
         @return pd.DataFrame
         """
+        if self.article_columns is not None:
+            return self.article_columns.get_points()
         df = pd.DataFrame(self.document_client.get_all_articles())
         df2 = pd.DataFrame(list(df["topic"]))
         df3 = pd.concat([df[['id', 'heading']], df2], axis=1, join='inner')
         return df3
         
     
+    def create_row_of_id(self)->np.ndarray:
+        """
+        Creates the lookup from article ids to rows of the scatter plot: an array
+        indexed by id if the ids are dense, otherwise the sorted ids.
+        @return np.ndarray
+        """
+        ids = pd.to_numeric(self.data["id"]).to_numpy()
+        if len(ids) > 0 and 0 <= ids.min() and ids.max() < 8 * len(ids) + 1024:
+            row_of_id = np.full(ids.max() + 1, -1, dtype=np.int32)
+            row_of_id[ids] = np.arange(len(ids), dtype=np.int32)
+            return row_of_id
+        self.id_order = np.argsort(ids, kind="stable")
+        self.sorted_ids = ids[self.id_order]
+        return None
+
+    def rows_of_ids(self, ids:list)->np.ndarray:
+        """
+        Returns the rows of the scatter plot of the given article ids, ids which
+        aren't in the plot are skipped.
+        @param list ids: article ids as strings or ints
+        @return np.ndarray
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.row_of_id is not None:
+            ids = ids[(ids >= 0) & (ids < len(self.row_of_id))]
+            rows = self.row_of_id[ids]
+            return rows[rows >= 0]
+        if len(self.sorted_ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.sorted_ids, ids), len(self.sorted_ids) - 1)
+        return self.id_order[positions[self.sorted_ids[positions] == ids]]
+
+    def compact_points(self, topics:list)->dict:
+        """
+        Returns the columns of the scatter plot as NumPy arrays, which Bokeh sends
+        to the browser as binary buffers: float32 coordinates and probabilities,
+        the topics as int codes into the list of topics and int ids. The headings
+        stay on the server and are sent on hover (see title_callback).
+        @param list topics: the topic names, the code of a topic is its index
+        @return dict
+        """
+        ids = pd.to_numeric(self.data["id"]).to_numpy()
+        return {
+            "x": self.data["x"].to_numpy(dtype=np.float32),
+            "y": self.data["y"].to_numpy(dtype=np.float32),
+            "topic": pd.Categorical(self.data["topic_name"], categories=topics).codes.astype(np.int32),
+            "probability": self.data["probability"].to_numpy(dtype=np.float32),
+            # browsers have no int64 arrays
+            "id": ids.astype(np.int32) if ids.max(initial=0) < 2**31 else ids.astype(np.float64)
+        }
+
     def scatterplot(self, color_map:tuple):
         """
         Creates the sactter plot to visualize the clustering
@@ -54,13 +123,36 @@ class ClusterWidget:
             TOPICS.remove('None')
 
         TOPICS = ['None'] + TOPICS
-        self.source = ColumnDataSource(self.data)
-
-        hover = HoverTool(tooltips=[
-            ("Titel", "@heading"),
-            ("Cluster", "@topic_name"),
-            ("Propability","@probability{0:.0%}")
-        ])
+        self.source = ColumnDataSource(self.compact_points(TOPICS))
+
+        # titles of hovered points, requested by the browser through title_request
+        self.titles = ColumnDataSource(data={"index": [], "heading": []})
+        self.title_request = ColumnDataSource(data={"index": []})
+        self.title_request.on_change('data', self.title_callback)
+
+        # topics beyond the color map are gray like with factor_cmap
+        palette = [color_map[i] if i < len(color_map) else "gray" for i in range(len(TOPICS))]
+        hover = HoverTool(
+            tooltips=[
+                ("Titel", "$index{title}"),
+                ("Cluster", "@topic{topic}"),
+                ("Propability","@probability{0:.0%}")
+            ],
+            formatters={
+                "$index": CustomJSHover(args=dict(titles=self.titles), code="""
+                    const i = titles.data.index.indexOf(value)
+                    return i < 0 ? "..." : titles.data.heading[i]
+                """),
+                "@topic": CustomJSHover(args=dict(topics=TOPICS), code="return topics[value]")
+            },
+            callback=CustomJS(args=dict(titles=self.titles, request=self.title_request), code="""
+                const indices = cb_data.index.indices
+                if (indices.length > 0 && !titles.data.index.includes(indices[0])
+                        && request.data.index[0] != indices[0]) {
+                    request.data = {index: [indices[0]]}
+                }
+            """)
+        )
 
         fig = figure(name=self.cluster_widget_name, sizing_mode="stretch_both", title=None,
                 tools=["pan", "tap", "box_select", "lasso_select", "wheel_zoom", "box_zoom", "zoom_in", "zoom_out", "reset", hover],
@@ -68,7 +160,7 @@ class ClusterWidget:
                 active_drag="box_select", active_tap="tap", background_fill_color="#ffffff")
 
         fig.scatter("x", "y", source=self.source,
-            color=factor_cmap('topic_name', color_map, TOPICS))
+            color=linear_cmap('topic', palette, low=-0.5, high=len(TOPICS) - 0.5))
 
         fig.toolbar.logo = None
         fig.xaxis.visible = False
@@ -83,7 +175,7 @@ class ClusterWidget:
             """
             ids = self.data['id'][self.source.selected.indices].to_list()
             # list of keywords of selected documents
-            keywords = self.document_client.get_keywords_by_ids(ids)
+            keywords = self.keyword_client.get_keywords_by_ids(ids)
             # list of tags of selected documents
             tags = self.document_client.get_tags_by_ids(ids,filter=False)
             
@@ -120,5 +212,25 @@ class ClusterWidget:
         return fig
 
 
+    def select_similar(self, k:int):
+        """
+        Selects the single selected document and the k documents most similar to it.
+        @param int k
+        """
+        if len(self.source.selected.indices) == 1:
+            index = self.source.selected.indices[0]
+            rows, _ = self.similarity_index.most_similar(index, k)
+            self.source.selected.indices = [index] + rows.tolist()
+
+    def title_callback(self, attr, old, new):
+        """
+        Sends the title of the hovered point to the browser, which keeps the
+        last TITLE_CACHE_SIZE titles.
+        """
+        for index in new["index"]:
+            if 0 <= index < len(self.data) and index not in self.titles.data["index"]:
+                self.titles.stream({"index": [index], "heading": [self.data["heading"][index]]},
+                                   rollover=TITLE_CACHE_SIZE)
+
     def give_to_curdoc(self):
         curdoc().add_root(self.cluster_plot)
\ No newline at end of file
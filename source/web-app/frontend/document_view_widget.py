@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 from bokeh.plotting import curdoc
 from bokeh.models.widgets import Div
-from bokeh.layouts import column
+from bokeh.models import Button, Spinner
+from bokeh.events import ButtonClick
+from bokeh.layouts import column, row
 
 
 class DocumentViewWidget():
@@ -20,6 +22,7 @@ class DocumentViewWidget():
         self.document_client = document_client
         self.document_view_name = document_view_name
         self.article_text = self.create_article_text()
+        self.similar_controls = None
 
 
     def create_article_text(self) -> column:
@@ -36,6 +39,19 @@ class DocumentViewWidget():
         return column(name=self.document_view_name, children=[self.article_text_headline, self.article_text_body])
 
 
+    def add_similar_button(self, callback):
+        """
+        Adds a button above the article, which calls callback(k) to select the
+        k documents most similar to the displayed one.
+        @param callback: function with the number of documents to select
+        """
+        k_input = Spinner(value=20, low=1, high=1000, step=5, width=80)
+        button = Button(label="Select most similar", button_type="primary")
+        button.on_event(ButtonClick, lambda event: callback(k_input.value))
+        self.similar_controls = row(children=[k_input, button], visible=False)
+        self.article_text.children.insert(0, self.similar_controls)
+
+
     def update_article_text(self, text: str, title: str, url: str):
         """
         Update the text and title to show, text and heading of the selected article.
@@ -48,6 +64,8 @@ class DocumentViewWidget():
         else:
             self.article_text_headline.update(text=f'<a href="{url}" target="_blank" rel="noopener noreferrer">{title}</a>')
         self.article_text_body.update(text=text)
+        if self.similar_controls is not None:
+            self.similar_controls.visible = True
 
 
     def reset_article_text(self):
@@ -56,6 +74,8 @@ class DocumentViewWidget():
         """
         self.article_text_headline.update(text=self.help_title)
         self.article_text_body.update(text=self.help_message)
+        if self.similar_controls is not None:
+            self.similar_controls.visible = False
 
 
     def set_visible(self, visibility: bool):
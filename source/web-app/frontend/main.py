@@ -1,13 +1,21 @@
 #!/usr/bin/env python3
 
+import os
 import pandas as pd
 
 from bar_chart_widget import BarChartWidget
 from tags_widget import TagsWidget
 from document_view_widget import DocumentViewWidget
 from cluster_widget import ClusterWidget
+from suggestion_widget import SuggestionWidget
+from search_widget import SearchWidget
+from selection_widget import SelectionWidget
+from tag_rule_widget import TagRuleWidget
 
 from backend import DocumentClient
+from article_columns import ArticleColumns
+from similarity_index import SimilarityIndex
+from tag_suggestions import TagSuggester
 
 
 COLOR_MAP = ("#c0c0c0", "#f44336", "#E91E63",  "#9C27B0", "#673AB7", "#3F51B5",
@@ -19,20 +27,38 @@ COLOR_MAP = ("#c0c0c0", "#f44336", "#E91E63",  "#9C27B0", "#673AB7", "#3F51B5",
              "#90CAF9", "#80DEEA", "#80CBC4", "#A5D6A7", "#C5E1A5", "#E6EE9C",
              "#FFF59D", "#FFE082", "#FFCC80", "#FFAB91")
 
-document_client = DocumentClient()
+if os.environ.get("IDT_BACKEND") == "memory":
+    # synthetic corpus without Elasticsearch, e.g. for load_test.py
+    from memory_backend import MemoryDocumentClient
+    document_client = MemoryDocumentClient.shared()
+else:
+    document_client = DocumentClient()
+# columnar export of the preprocessing, None if it's missing or doesn't match the database
+article_columns = ArticleColumns.open(expected_rows=document_client.get_article_count())
+
+# the embeddings and the neighbor graph are in the row order of the columnar export
+similarity_index = None
+tag_suggester = None
+if article_columns is not None:
+    similarity_index = SimilarityIndex.open(expected_rows=article_columns.table.num_rows)
+    tag_suggester = TagSuggester.open(expected_rows=article_columns.table.num_rows)
 
 tags = pd.Series(document_client.get_all_tags(), dtype='object').value_counts() - 1
 tag_count = pd.Series(document_client.get_all_tags(filter=False), dtype='object').value_counts()
 tag_count = tag_count.add(tags, fill_value=0)
-keywords = document_client.get_all_keywords()
-keyword_count = pd.Series(keywords).value_counts()
+if article_columns is not None:
+    keyword_count = article_columns.get_keyword_counts()
+else:
+    keywords = document_client.get_all_keywords()
+    keyword_count = pd.Series(keywords).value_counts()
 
 bar_chart_widget = BarChartWidget(
     kw_bar_chart_name="keywords_bar_chart",
     tag_bar_chart_name="tag_bar_chart",
     button_name="bar_chart_toggle",
     tags=tag_count,
-    keywords=keyword_count
+    keywords=keyword_count,
+    distinctive_name="distinctive_keywords_toggle"
 )
 
 tags_widget = TagsWidget(
@@ -51,10 +77,46 @@ cluster_widget = ClusterWidget(
     tags_widget=tags_widget,
     bar_chart_widget=bar_chart_widget,
     cluster_widget_name="cluster_plot",
-    color_map=COLOR_MAP
+    color_map=COLOR_MAP,
+    article_columns=article_columns,
+    similarity_index=similarity_index
+)
+
+search_widget = SearchWidget(
+    document_client=document_client,
+    cluster_widget=cluster_widget,
+    search_name="search_bar"
+)
+
+suggestion_widget = SuggestionWidget(
+    document_client=document_client,
+    cluster_widget=cluster_widget,
+    tags_widget=tags_widget,
+    bar_chart_widget=bar_chart_widget,
+    tag_suggester=tag_suggester,
+    article_columns=article_columns,
+    suggestion_name="tag_suggestions"
+)
+
+selection_widget = SelectionWidget(
+    document_client=document_client,
+    cluster_widget=cluster_widget,
+    selection_name="saved_selections"
+)
+
+tag_rule_widget = TagRuleWidget(
+    document_client=document_client,
+    tags_widget=tags_widget,
+    bar_chart_widget=bar_chart_widget,
+    topics=cluster_widget.data["topic_name"].unique().tolist(),
+    rule_name="tag_rules"
 )
 
 bar_chart_widget.give_to_curdoc()
 cluster_widget.give_to_curdoc()
 document_view_widget.give_to_curdoc()
 tags_widget.give_to_curdoc()
+suggestion_widget.give_to_curdoc()
+search_widget.give_to_curdoc()
+selection_widget.give_to_curdoc()
+tag_rule_widget.give_to_curdoc()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import time
+from bokeh.plotting import curdoc
+from bokeh.models import Div, TextInput
+from bokeh.layouts import row
+
+
+class SearchWidget:
+    """
+    A class to make a search box, which selects the documents matching a
+    full-text query in the cluster plot.
+    """
+
+    def __init__(self, document_client: 'DocumentClient', cluster_widget: 'ClusterWidget', search_name: str = None):
+        """
+        @param DocumentClient document_client
+        @param ClusterWidget cluster_widget: its selection shows the hits
+        @param str search_name: The name of the UI, used in the HTML file (default: None)
+        """
+        self.document_client = document_client
+        self.cluster_widget = cluster_widget
+
+        self.search_input = TextInput(placeholder='Search, e.g. "neural network" -biology', width=300)
+        self.search_input.on_change("value", self.search_callback)
+        self.status = Div(text="")
+        self.row = row(name=search_name, children=[self.search_input, self.status])
+
+    def search_callback(self, attr, old, new):
+        """
+        Selects all documents matching the query when Enter is pressed. Only the
+        ids of the hits are fetched and mapped to the rows of the cluster plot.
+        """
+        if new.strip() == "":
+            self.status.text = ""
+            return
+        start = time.perf_counter()
+        ids = self.document_client.search_article_ids(new)
+        rows = self.cluster_widget.rows_of_ids(ids)
+        self.cluster_widget.source.selected.indices = rows.tolist()
+        self.status.text = f"{len(rows)} hits ({(time.perf_counter() - start) * 1000:.0f} ms)"
+
+    def give_to_curdoc(self):
+        """
+        Gives the widget to curdoc to be diplayed in the browser.
+        """
+        curdoc().add_root(self.row)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+import numpy as np
+import pandas as pd
+from bokeh.plotting import curdoc
+from bokeh.models import Button, Div, Select, TextInput
+from bokeh.events import ButtonClick
+from bokeh.layouts import column, row
+
+from selections import OPERATIONS, rows_version, rows_to_mask, encode_mask, decode_mask
+
+
+class SelectionWidget:
+    """
+    A class to make the UI-elements, which save the selection of the cluster
+    plot under a name and recall it. The selections are stored as compressed
+    bitsets over the rows of the plot, so recalling one and combining it with
+    other selections or the documents of a tag happens on bitsets, without
+    looking up the ids of the selected documents in the database.
+    """
+
+    def __init__(self, document_client: 'DocumentClient', cluster_widget: 'ClusterWidget', selection_name: str = None):
+        """
+        @param DocumentClient document_client
+        @param ClusterWidget cluster_widget: its selection is saved and recalled
+        @param str selection_name: The name of the UI, used in the HTML file (default: None)
+        """
+        self.document_client = document_client
+        self.cluster_widget = cluster_widget
+        self.n_rows = len(cluster_widget.data)
+        self.rows_version = rows_version(pd.to_numeric(cluster_widget.data["id"]).to_numpy())
+        # decoded selections of this session by name
+        self.masks = dict()
+
+        self.name_input = TextInput(placeholder="Name of the selection", width=170)
+        self.save_button = Button(label="Save selection", button_type="primary")
+        self.save_button.on_event(ButtonClick, self.save_callback)
+
+        self.saved_select = Select(title="Saved selections:", options=[], width=170)
+        self.recall_button = Button(label="Recall", button_type="success")
+        self.recall_button.on_event(ButtonClick, self.recall_callback)
+        self.delete_button = Button(label="Delete", button_type="danger")
+        self.delete_button.on_event(ButtonClick, self.delete_callback)
+
+        self.operation_select = Select(title="Combine the selection:", options=list(OPERATIONS), value="union", width=110)
+        self.operand_select = Select(title="with:", options=[], width=170)
+        self.apply_button = Button(label="Apply", button_type="primary")
+        self.apply_button.on_event(ButtonClick, self.apply_callback)
+        self.status = Div(text="")
+
+        self.column = column(name=selection_name, children=[
+            row(children=[self.name_input, self.save_button]),
+            self.saved_select, row(children=[self.recall_button, self.delete_button]),
+            row(children=[self.operation_select, self.operand_select]), self.apply_button,
+            self.status])
+        self.update_options()
+
+    def update_options(self):
+        """
+        Updates the saved selections and the tags to choose from.
+        """
+        selections = self.document_client.get_all_selections()
+        self.saved_select.options = [(name, f"{name} ({count})") for name, count in sorted(selections.items())]
+        self.operand_select.options = ([("selection:" + name, name) for name in sorted(selections)] +
+                                       [("tag:" + tag, f"tag: {tag}") for tag in sorted(self.document_client.get_all_tags())])
+        for select in (self.saved_select, self.operand_select):
+            values = [value for value, label in select.options]
+            if select.value not in values:
+                select.value = values[0] if len(values) > 0 else ""
+
+    def current_mask(self) -> np.ndarray:
+        """
+        @return np.ndarray: the selection of the cluster plot as mask over its rows
+        """
+        return rows_to_mask(self.cluster_widget.source.selected.indices, self.n_rows)
+
+    def saved_mask(self, name: str) -> np.ndarray:
+        """
+        Returns a saved selection, decoded once per session.
+        @param str name
+        @return np.ndarray: the mask over the rows, None if the selection doesn't
+            exist or was saved for other rows
+        """
+        if name not in self.masks:
+            selection = self.document_client.get_selection(name)
+            if selection is None:
+                return None
+            if selection["rows_version"] != self.rows_version or selection["n_rows"] != self.n_rows:
+                self.status.text = f"'{name}' was saved for other documents and can't be recalled."
+                return None
+            self.masks[name] = decode_mask(selection["bitset"], self.n_rows)
+        return self.masks[name]
+
+    def tag_mask(self, tag: str) -> np.ndarray:
+        """
+        @param str tag
+        @return np.ndarray: the documents with the tag as mask over the rows
+        """
+        ids = self.document_client.get_all_article_ids_by_tag(tag)
+        return rows_to_mask(self.cluster_widget.rows_of_ids(ids), self.n_rows)
+
+    def save_callback(self, event):
+        """
+        Saves the selection of the cluster plot under the name in the text input.
+        """
+        name = self.name_input.value.strip()
+        if name == "":
+            self.status.text = "Enter a name for the selection."
+            return
+        mask = self.current_mask()
+        bitset = encode_mask(mask)
+        self.document_client.save_selection(name, bitset, self.n_rows, int(mask.sum()), self.rows_version)
+        self.masks[name] = mask
+        self.name_input.value = ""
+        self.update_options()
+        self.saved_select.value = name
+        self.status.text = f"Saved {mask.sum()} documents as '{name}' ({len(bitset)} bytes)."
+
+    def recall_callback(self, event):
+        """
+        Selects the documents of the chosen saved selection.
+        """
+        mask = self.saved_mask(self.saved_select.value)
+        if mask is None:
+            return
+        self.cluster_widget.source.selected.indices = np.flatnonzero(mask).tolist()
+        self.status.text = f"Recalled {mask.sum()} documents of '{self.saved_select.value}'."
+
+    def delete_callback(self, event):
+        """
+        Deletes the chosen saved selection.
+        """
+        name = self.saved_select.value
+        if name == "":
+            return
+        self.document_client.delete_selection(name)
+        self.masks.pop(name, None)
+        self.update_options()
+        self.status.text = f"Deleted '{name}'."
+
+    def apply_callback(self, event):
+        """
+        Replaces the selection of the cluster plot by its union, intersection or
+        difference with a saved selection or the documents of a tag.
+        """
+        kind, _, name = self.operand_select.value.partition(":")
+        if name == "":
+            return
+        other = self.saved_mask(name) if kind == "selection" else self.tag_mask(name)
+        if other is None:
+            return
+        mask = OPERATIONS[self.operation_select.value](self.current_mask(), other)
+        self.cluster_widget.source.selected.indices = np.flatnonzero(mask).tolist()
+        self.status.text = f"{self.operation_select.value.capitalize()} with '{name}': {mask.sum()} documents."
+
+    def give_to_curdoc(self):
+        """
+        Gives the widget to curdoc to be diplayed in the browser.
+        """
+        curdoc().add_root(self.column)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+from bokeh.plotting import curdoc
+from bokeh.models import Button, Div, Select, Spinner
+from bokeh.events import ButtonClick
+from bokeh.layouts import column, row
+
+
+class SuggestionWidget:
+    """
+    A class to make the UI-elements, which suggest documents for a tag by
+    propagating the tag through the similarity graph of the documents. The
+    suggestions are selected in the cluster plot and can be tagged at once.
+    """
+
+    def __init__(self, document_client: 'DocumentClient', cluster_widget: 'ClusterWidget', tags_widget: 'TagsWidget', bar_chart_widget: 'BarChartWidget', tag_suggester: 'TagSuggester', article_columns: 'ArticleColumns', suggestion_name: str = None):
+        """
+        @param DocumentClient document_client
+        @param ClusterWidget cluster_widget: its selection shows the suggestions
+        @param TagsWidget tags_widget
+        @param BarChartWidget bar_chart_widget
+        @param TagSuggester tag_suggester: None to hide the widget
+        @param ArticleColumns article_columns: maps the article ids to the rows of the graph
+        @param str suggestion_name: The name of the UI, used in the HTML file (default: None)
+        """
+        self.document_client = document_client
+        self.cluster_widget = cluster_widget
+        self.tags_widget = tags_widget
+        self.bar_chart_widget = bar_chart_widget
+        self.tag_suggester = tag_suggester
+        self.article_columns = article_columns
+        self.suggested_tag = None
+
+        self.tag_select = Select(title="Suggest documents for tag:", options=[], width=170)
+        self.number_input = Spinner(value=50, low=1, high=5000, step=10, width=80)
+        self.suggest_button = Button(label="Suggest", button_type="primary")
+        self.suggest_button.on_event(ButtonClick, self.suggest_callback)
+        self.accept_button = Button(label="Tag selection", button_type="success", disabled=True)
+        self.accept_button.on_event(ButtonClick, self.accept_callback)
+        self.status = Div(text="")
+
+        self.column = column(name=suggestion_name, children=[
+            self.tag_select, row(children=[self.number_input, self.suggest_button]),
+            self.accept_button, self.status])
+        self.column.visible = tag_suggester is not None
+        if tag_suggester is not None:
+            self.update_tag_options()
+
+    def update_tag_options(self):
+        """
+        Updates the tags to choose from.
+        """
+        self.tag_select.options = sorted(self.document_client.get_all_tags())
+        if self.tag_select.value not in self.tag_select.options and len(self.tag_select.options) > 0:
+            self.tag_select.value = self.tag_select.options[0]
+
+    def suggest_callback(self, event):
+        """
+        Selects the untagged documents with the highest scores for the chosen tag.
+        """
+        tag = self.tag_select.value
+        if tag == "":
+            return
+        ids = self.document_client.get_all_article_ids_by_tag(tag)
+        seeds = self.article_columns.rows(ids)
+        if len(seeds) == 0:
+            self.status.text = f"No document has the tag '{tag}' yet."
+            self.update_tag_options()
+            return
+        rows, scores, info = self.tag_suggester.suggest(tag, seeds, self.number_input.value)
+        self.suggested_tag = tag
+        self.cluster_widget.source.selected.indices = rows.tolist()
+        self.accept_button.disabled = len(rows) == 0
+        self.accept_button.label = f"Tag selection with '{tag}'"
+        self.status.text = (f"{len(rows)} suggestions from {len(seeds)} tagged documents " +
+                            f"({info['iterations']} iterations, {info['seconds'] * 1000:.0f} ms).")
+        self.update_tag_options()
+
+    def accept_callback(self, event):
+        """
+        Adds the suggested tag to the selected documents in one bulk operation.
+        The selection can be changed before.
+        """
+        tag = self.suggested_tag
+        indices = self.cluster_widget.source.selected.indices
+        if tag is None or len(indices) == 0:
+            return
+        ids = self.cluster_widget.data["id"][indices].to_list()
+        updated = self.document_client.bulk_add_tag_to_articles(tag, ids)
+        self.bar_chart_widget.update_tag_count(tag, len(ids))
+        self.tags_widget.update_tags_in_checkbox()
+        self.accept_button.disabled = True
+        self.status.text = f"Tagged {updated} documents with '{tag}'."
+
+    def give_to_curdoc(self):
+        """
+        Gives the widget to curdoc to be diplayed in the browser.
+        """
+        curdoc().add_root(self.column)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+from bokeh.plotting import curdoc
+from bokeh.models import Button, Div, Select, TextInput
+from bokeh.events import ButtonClick
+from bokeh.layouts import column, row
+
+
+class TagRuleWidget:
+    """
+    A class to make the UI-elements, which store a rule with a tag (keywords,
+    topic and/or a phrase of the articles) and apply the rules in the database.
+    Applying the rules again only tags the articles ingested since.
+    """
+
+    def __init__(self, document_client: 'DocumentClient', tags_widget: 'TagsWidget', bar_chart_widget: 'BarChartWidget', topics: list, rule_name: str = None):
+        """
+        @param DocumentClient document_client
+        @param TagsWidget tags_widget
+        @param BarChartWidget bar_chart_widget: shows the number of newly tagged articles
+        @param list topics: the topic names of the articles, as stored in the database
+        @param str rule_name: The name of the UI, used in the HTML file (default: None)
+        """
+        self.document_client = document_client
+        self.tags_widget = tags_widget
+        self.bar_chart_widget = bar_chart_widget
+        self.topics = sorted(topics)
+
+        self.tag_select = Select(title="Rule of tag:", options=[], width=170)
+        self.tag_select.on_change("value", self.tag_callback)
+        self.keywords_input = TextInput(title="Has one of the keywords:", placeholder="keyword, keyword", width=170)
+        # a rule must name the topic exactly as stored, so it's chosen from the existing ones
+        self.topic_select = Select(title="Has the topic:", options=[("", "(any topic)")] + self.topics, value="", width=170)
+        self.phrase_input = TextInput(title="Contains the phrase:", placeholder="e.g. machine learning", width=170)
+        self.save_button = Button(label="Save and apply", button_type="primary")
+        self.save_button.on_event(ButtonClick, self.save_callback)
+        self.apply_button = Button(label="Apply all rules", button_type="success")
+        self.apply_button.on_event(ButtonClick, self.apply_callback)
+        self.status = Div(text="")
+
+        self.column = column(name=rule_name, children=[
+            self.tag_select, self.keywords_input, self.topic_select, self.phrase_input,
+            row(children=[self.save_button, self.apply_button]), self.status])
+        self.update_tag_options()
+
+    def update_tag_options(self):
+        """
+        Updates the tags to choose from and shows the rule of the chosen tag.
+        """
+        self.tag_select.options = sorted(self.document_client.get_all_tags())
+        if self.tag_select.value not in self.tag_select.options and len(self.tag_select.options) > 0:
+            self.tag_select.value = self.tag_select.options[0]
+        else:
+            self.tag_callback("value", None, self.tag_select.value)
+
+    def tag_callback(self, attr, old, new):
+        """
+        Fills the inputs with the rule of the chosen tag.
+        """
+        rule = self.document_client.get_tag_rules().get(new, {}).get("rule", {})
+        self.keywords_input.value = ", ".join(rule.get("keywords", []))
+        topic = rule.get("topic", "")
+        # keep the topic of a rule saved for an earlier topic model visible
+        extra = [topic] if topic != "" and topic not in self.topics else []
+        self.topic_select.options = [("", "(any topic)")] + extra + self.topics
+        self.topic_select.value = topic
+        self.phrase_input.value = rule.get("phrase", "")
+
+    def show_updated(self, updated: dict):
+        """
+        Adds the newly tagged articles to the tag bar chart.
+        @param dict updated: number of newly tagged articles by tag
+        """
+        for tag, number in updated.items():
+            if number > 0:
+                self.bar_chart_widget.add_to_tag_count(tag, number)
+        if sum(updated.values()) > 0:
+            self.tags_widget.update_tags_in_checkbox()
+        self.status.text = "<br>".join(f"'{tag}': {number} articles tagged" for tag, number in updated.items())
+
+    def save_callback(self, event):
+        """
+        Stores the rule of the chosen tag, or removes it if all inputs are empty,
+        and applies it to all articles.
+        """
+        tag = self.tag_select.value
+        if tag == "":
+            return
+        rule = {
+            "keywords": [keyword.strip() for keyword in self.keywords_input.value.split(",") if keyword.strip()],
+            "topic": self.topic_select.value,
+            "phrase": self.phrase_input.value.strip()
+        }
+        if not any(rule.values()):
+            self.document_client.set_tag_rule(tag, None)
+            self.status.text = f"Removed the rule of '{tag}'."
+            return
+        self.document_client.set_tag_rule(tag, rule)
+        self.show_updated(self.document_client.apply_tag_rules([tag], incremental=False))
+
+    def apply_callback(self, event):
+        """
+        Applies all rules to the articles ingested since their last application.
+        """
+        updated = self.document_client.apply_tag_rules()
+        self.update_tag_options()
+        if len(updated) == 0:
+            self.status.text = "No tag has a rule."
+            return
+        self.show_updated(updated)
+
+    def give_to_curdoc(self):
+        """
+        Gives the widget to curdoc to be diplayed in the browser.
+        """
+        curdoc().add_root(self.column)
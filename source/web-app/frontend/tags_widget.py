@@ -209,7 +209,8 @@ class TagsWidget:
 
                 diff_tag = self.checkbox_group.labels[diff_tag_index]
                 if len(new) > len(old) and diff_tag not in self.document_client.get_tags_by_ids(self.ids):
-                    self.document_client.add_tag_to_articles(
+                    # one bulk request instead of a read and a write per document
+                    self.document_client.bulk_add_tag_to_articles(
                         diff_tag, self.ids)
                     self.bar_chart_widget.update_tag_count(
                         diff_tag, len(self.ids))
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+
+# relative frequency of the user actions of a session
+ACTIONS = {"select": 5, "toggle_tag": 2, "search": 1}
+
+
+def start_server(port: int, articles: int, tags: int, latency: float) -> subprocess.Popen:
+    """
+    Starts 'bokeh serve' with the frontend and the in-memory backend and waits
+    until the app responds.
+    @param int port
+    @param int articles: number of synthetic articles of the in-memory backend
+    @param int tags: number of tags of the in-memory backend
+    @param float latency: seconds each backend call waits to emulate Elasticsearch
+    @return subprocess.Popen
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(filter(None, [os.path.join(directory, "backend"), os.environ.get("PYTHONPATH")])),
+               IDT_BACKEND="memory",
+               IDT_MEMORY_ARTICLES=str(articles),
+               IDT_MEMORY_TAGS=str(tags),
+               IDT_MEMORY_LATENCY=str(latency))
+    server = subprocess.Popen([sys.executable, "-m", "bokeh", "serve", "--port", str(port),
+                               "--allow-websocket-origin", f"localhost:{port}",
+                               os.path.join(directory, "frontend")],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://localhost:{port}/frontend"
+    for _ in range(120):
+        try:
+            urllib.request.urlopen(url, timeout=60)
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError("bokeh serve exited, run it manually to see the error")
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError(f"{url} did not respond")
+
+
+def round_trip(session) -> None:
+    """
+    Waits until the server processed all changes sent before. The server handles
+    the messages of a session in order, so the reply to the round trip request
+    arrives after the callbacks of the preceding changes ran.
+    """
+    session.force_roundtrip()
+
+
+class SessionWorkload:
+    """
+    Replays the actions of a user in one headless client session: lasso
+    selections of nearby points, toggling tags of the selection and typing into
+    the tag search.
+    """
+
+    def __init__(self, session, selection_sizes: list, rng: random.Random):
+        """
+        @param session: a pulled bokeh ClientSession of the app
+        @param list selection_sizes: the number of points of a lasso selection is drawn from these
+        @param random.Random rng
+        """
+        from bokeh.models import CheckboxGroup, TextInput
+
+        self.session = session
+        self.selection_sizes = selection_sizes
+        self.rng = rng
+        document = session.document
+        self.source = document.get_model_by_name("cluster_plot").renderers[0].data_source
+        self.checkbox_group = document.select_one({"type": CheckboxGroup})
+        self.search_bar = document.select_one({"type": TextInput, "placeholder": "Filter for a tag"})
+        self.points = np.column_stack([self.source.data["x"], self.source.data["y"]]).astype(np.float64)
+        self.selected = 0
+
+    def select(self) -> list:
+        """
+        Selects the points nearest to a random point, like a lasso around it.
+        """
+        size = min(self.rng.choice(self.selection_sizes), len(self.points))
+        center = self.points[self.rng.randrange(len(self.points))]
+        distances = ((self.points - center) ** 2).sum(axis=1)
+        indices = np.argpartition(distances, size - 1)[:size]
+        self.source.selected.indices = indices.tolist()
+        self.selected = size
+        return [("select", self.measure())]
+
+    def toggle_tag(self) -> list:
+        """
+        Checks or unchecks a tag of the current selection of several documents.
+        """
+        timings = []
+        if self.selected < 2:
+            timings += self.select() if min(self.selection_sizes) >= 2 else []
+            if self.selected < 2:
+                return timings
+        if len(self.checkbox_group.labels) == 0:
+            return timings
+        index = self.rng.randrange(len(self.checkbox_group.labels))
+        active = set(self.checkbox_group.active)
+        self.checkbox_group.active = sorted(active ^ {index})
+        return timings + [("toggle_tag", self.measure())]
+
+    def search(self) -> list:
+        """
+        Types a prefix of a tag name into the tag search, one keystroke at a time,
+        and clears it again.
+        """
+        labels = self.checkbox_group.labels or ["tag"]
+        word = self.rng.choice(labels)
+        timings = []
+        for end in range(1, min(len(word), 5) + 1):
+            self.search_bar.value_input = word[:end].lower()
+            timings.append(("search", self.measure()))
+        self.search_bar.value_input = ""
+        timings.append(("search", self.measure()))
+        return timings
+
+    def measure(self) -> float:
+        start = time.perf_counter()
+        round_trip(self.session)
+        return time.perf_counter() - start
+
+
+def run_session(url: str, start_at: float, duration: float, think_time: float, selection_sizes: list, seed: int) -> dict:
+    """
+    Opens a session, waits until start_at and replays random actions for
+    duration seconds. Runs in its own process.
+    @return dict: the latency of each action and the time the session took to open
+    """
+    from bokeh.client import pull_session
+
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    with pull_session(url=url) as session:
+        open_time = time.perf_counter() - start
+        workload = SessionWorkload(session, selection_sizes, rng)
+        time.sleep(max(0, start_at - time.time()))
+        actions, weights = list(ACTIONS), list(ACTIONS.values())
+        timings = []
+        errors = 0
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            action = rng.choices(actions, weights)[0]
+            try:
+                timings += getattr(workload, action)()
+            except Exception:
+                errors += 1
+            if think_time > 0:
+                time.sleep(rng.expovariate(1 / think_time))
+    return {"open_time": open_time, "timings": timings, "errors": errors}
+
+
+def percentiles(latencies: list) -> dict:
+    """
+    Returns the p50, p95 and p99 latency in milliseconds.
+    """
+    if len(latencies) == 0:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return {"count": len(latencies), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+            "max_ms": max(latencies) * 1000}
+
+
+def run_level(url: str, sessions: int, args: argparse.Namespace) -> dict:
+    """
+    Runs the given number of concurrent sessions and summarizes their latencies.
+    @return dict
+    """
+    start_at = time.time() + args.ramp_up
+    with ProcessPoolExecutor(max_workers=sessions, mp_context=get_context("spawn")) as executor:
+        futures = [executor.submit(run_session, url, start_at, args.duration, args.think_time,
+                                   args.selection_sizes, args.seed + i) for i in range(sessions)]
+        results = [future.result() for future in futures]
+
+    by_action = dict()
+    for result in results:
+        for action, latency in result["timings"]:
+            by_action.setdefault(action, []).append(latency)
+    all_latencies = [latency for latencies in by_action.values() for latency in latencies]
+    return {
+        "sessions": sessions,
+        "throughput": len(all_latencies) / args.duration,
+        "errors": sum(result["errors"] for result in results),
+        "open": percentiles([result["open_time"] for result in results]),
+        "all": percentiles(all_latencies),
+        "actions": {action: percentiles(latencies) for action, latencies in sorted(by_action.items())}
+    }
+
+
+def print_level(level: dict):
+    print(f"### Load test:  {level['sessions']} sessions, {level['throughput']:.1f} actions/s, " +
+          f"{level['errors']} errors, session open p50 {level['open']['p50_ms']:.0f} ms")
+    for name, stats in [("all", level["all"])] + list(level["actions"].items()):
+        if stats["count"] > 0:
+            print(f"    {name:<12}{stats['count']:>8}  p50 {stats['p50_ms']:8.1f} ms  " +
+                  f"p95 {stats['p95_ms']:8.1f} ms  p99 {stats['p99_ms']:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="load_test.py",
+        description="Opens N headless client sessions of the web app at once and " +
+            "replays lasso selections, tag toggles and tag search typing. Reports " +
+            "the p50/p95/p99 callback latency and the throughput per number of sessions."
+    )
+    parser.add_argument('--url',
+        metavar='url',
+        type=str,
+        help="URL of a running app, e.g. http://localhost/app. Default: start " +
+            "'bokeh serve' with the in-memory backend",
+        default=None
+    )
+    parser.add_argument('--sessions',
+        metavar='n',
+        type=int,
+        nargs='+',
+        help="Numbers of concurrent sessions to test. Default: 1 5 10 25",
+        default=[1, 5, 10, 25]
+    )
+    parser.add_argument('--duration',
+        metavar='s',
+        type=float,
+        help="Seconds each number of sessions runs. Default: 30",
+        default=30
+    )
+    parser.add_argument('--ramp-up',
+        metavar='s',
+        type=float,
+        help="Seconds the sessions get to open before the actions start. Default: 10",
+        default=10
+    )
+    parser.add_argument('--think-time',
+        metavar='s',
+        type=float,
+        help="Mean seconds a user waits between two actions, 0 for no pause. Default: 1",
+        default=1
+    )
+    parser.add_argument('--selection-sizes',
+        metavar='n',
+        type=int,
+        nargs='+',
+        help="Numbers of points of the lasso selections. Default: 1 10 100 1000",
+        default=[1, 10, 100, 1000]
+    )
+    parser.add_argument('--articles',
+        metavar='n',
+        type=int,
+        help="Number of articles of the in-memory backend. Default: 10000",
+        default=10000
+    )
+    parser.add_argument('--tags',
+        metavar='n',
+        type=int,
+        help="Number of tags of the in-memory backend. Default: 30",
+        default=30
+    )
+    parser.add_argument('--backend-latency',
+        metavar='s',
+        type=float,
+        help="Seconds each call to the in-memory backend waits to emulate " +
+            "Elasticsearch. Default: 0",
+        default=0
+    )
+    parser.add_argument('--port',
+        metavar='n',
+        type=int,
+        help="Port of the started server. Default: 5006",
+        default=5006
+    )
+    parser.add_argument('--seed',
+        metavar='n',
+        type=int,
+        help="Seed of the workload. Default: 0",
+        default=0
+    )
+    parser.add_argument('--output',
+        metavar='path',
+        type=str,
+        help="Path of a JSON file for the results. Default: None",
+        default=None
+    )
+
+    args = parser.parse_args()
+    server = None
+    url = args.url
+    if url is None:
+        print(f"### Load test:  Starting bokeh serve with {args.articles} in-memory articles")
+        server = start_server(args.port, args.articles, args.tags, args.backend_latency)
+        url = f"http://localhost:{args.port}/frontend"
+
+    levels = []
+    try:
+        for sessions in args.sessions:
+            print(f"### Load test:  Running {sessions} sessions for {args.duration:.0f}s")
+            level = run_level(url, sessions, args)
+            print_level(level)
+            levels.append(level)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"url": url, "arguments": vars(args), "levels": levels}, f, indent=4)
+        print(f"### Load test:  Wrote results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()